@@ -1,22 +1,56 @@
-import sys, os, inspect, platform
-import copy
+import sys, os
+import _thread
+import importlib.util
 
-from PyQt5.QtCore import QRegExp, Qt
-from PyQt5 import QtGui, QtWidgets
+
+def lazyImport(name):
+    """ Import the module 'name', its code being run on first attribute access
+
+        numpy takes longer to import than the rest of ThermAP; it is only
+        loaded when a computation is done.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+np = lazyImport("numpy")
 
 version = "3.2"
 appName =  "ThermAP"
 
+progpath = os.path.dirname(os.path.abspath(__file__))   # Directory of the data files
+
 DBnames = []          # List of database names
 DBtitles = []         # List of database titles
 curDBidx = 0          # Index of the current database
 Elems = []            # List of the Elements in current database
 Species = []          # List of the Species in current database
+ElemIndex = {}        # Elements of the current database by name
+ElemTrie = {}         # Prefix tree of the element names
+SpeciesIndex = {}     # Index of the Species in 'Species' by name
+DBfingerprint = ""    # SHA-1 of the contents of the files of the current database
+curDB = None          # The current DataBase of the registry, see useDataBase
+
+T0 = 298.0            # Standard temperature (K)
+R = 8.314             # Gas constant (J.mol-1.K-1)
+LN10 = 2.303          # ln(10) as used for Ksp
+EPSCHARGE = 1e-10     # Tolerance on the electroneutrality
+
+Properties = ("DGf", "DHf", "DSf", "So", "pKsp")
 
 # - Element class ------------------------------------------------------------
 
 class Element(object):
     """ Elem' contains information about each element """
+    __slots__ = ("name", "state", "So_298")
+
     def __init__(self, name="", state = '', So_298=0.0):
         self.name = name             # elem name
         self.state = state           # elem state (= L,S,G)
@@ -26,17 +60,32 @@ class Element(object):
 # - Specie class ------------------------------------------------------------
 
 class Specie(object):
-    """ Specie contains information about each species """
+    """ Specie contains information about each species
+
+        The coefficients of a composition are not stored in the species,
+        which are shared by all the computations (see Estimator).
+    """
+    __slots__ = ("col", "name", "charge", "g", "s", "DGaq", "elem", "Selem", "sg", "ss", "sDGaq")
 
-    def __init__(self, col=0, name="", charge=0.0, g=0.0, s=0.0, DGaq=0.0, elem=[], coef=0.0):
-        self.col = col               # column where the specie is displayed in inputDlg
+    def __init__(self, col=0, name="", charge=0.0, g=0.0, s=0.0, DGaq=0.0, elem=(), Selem=0.0,
+                 sg=0.0, ss=0.0, sDGaq=0.0):
+        self.col = col               # column of the database, the species being listed by column in inputDlg
         self.name = name             # specie name
         self.charge = charge         # charge
         self.g = g                   # Gibbs energy contribution
         self.s = s                   # entropy contribution
         self.DGaq = DGaq             # Gibbs energy of the specie dissolved in water
-        self.elem = elem             # list of elements (name, number) in specie
-        self.coef = coef
+        self.elem = tuple(elem)      # elements (name, number) in specie
+        self.Selem = Selem           # sum of the entropies of the elements in specie
+        self.sg = sg                 # uncertainty (standard deviation) of g
+        self.ss = ss                 # uncertainty of s
+        self.sDGaq = sDGaq           # uncertainty of DGaq
+
+# - DataBaseError class ------------------------------------------------------
+
+class DataBaseError(Exception):
+    """ Error in the database files, its message being shown to the user """
+    pass
 
 # ----------------------------------------------------------------------------
 
@@ -51,67 +100,110 @@ def IsNumber(s):
         return False
 
 
+def errorMessage(msg):
+    """ Report an error on stderr, in command line mode
+
+    :param msg: the error message.
+    :return: nothing.
+    """
+    sys.stderr.write("{0}: {1}\n".format(appName, msg))
+
+
 def getSpecie(name):
     """ Return the Specie which name is "name"
 
     :param name: a String containing the name of the Specie
     :return: the required Specie or None if not found.
     """
-    for spec in Species:
-        if spec.name == name:
-            return spec
+    if name in SpeciesIndex:
+        return Species[SpeciesIndex[name]]
     return None
 
 
+def readDBTitle(path):
+    """ Read the name and the title of a database in its species file
+
+        The name is on the first line, the title on the following comment
+        lines, up to an empty one or to "List of species".
+
+    :param path: the name of the SpeciesDBn.txt file.
+    :return: a tuple (name, title) or None if the file is empty.
+    """
+    with open(path) as f:
+        lines = f.read().splitlines()
+    if not len(lines):
+        return None
+    title = ""
+    for lin in lines[1:]:
+        lin = lin.strip("# ")
+        if lin == "" or lin.startswith("List of species"):
+            break
+        title += "{}<br>".format(lin)
+    return lines[0].strip("# "), title
+
+
 def lookForDB():
     """ Look for database files
 
         There are two files for each database ElemeDBn.txt and SpeciesDBn.txt
-    :return: An error message (="" if no error).
+        DBnames and DBtitles are replaced, so that each database is listed
+        once however many times they are looked for.
+    :return: True, a DataBaseError being raised if error.
     """
-    done = False
+    cache = loadCache()
+    if cache is not None:
+        DBnames[:] = [str(nam) for nam in cache["db_name"]]
+        DBtitles[:] = [str(title) for title in cache["db_title"]]
+        return True
+    dbs = findDataBases()
+    DBnames[:] = [name for name, title in dbs]
+    DBtitles[:] = [title for name, title in dbs]
+    return True
+
+
+def findDataBases():
+    """ Read the names and titles of the database files SpeciesDB1.txt, SpeciesDB2.txt...
+
+    :return: the list of (name, title), a DataBaseError being raised if error.
+    """
+    dbs = []
     msg = ""
-    i = 0
-    while not done:
-        dbfilnam = "SpeciesDB{}.txt".format(i+1)
+    while True:
+        dbfilnam = "SpeciesDB{}.txt".format(len(dbs)+1)
         path = os.path.join(progpath, dbfilnam)
-        if os.path.exists(path):
-            with open(path) as f:
-                lines = f.read().splitlines()
-                if len(lines):
-                    title = ""
-                    for l, lin in enumerate(lines):
-                        if l == 0:
-                           DBnames.append(lines[0].strip("# "))
-                           i += 1
-                        else:
-                            lin = lin.strip("# ")
-                            if lin == "" or lin.startswith("List of species"):
-                                DBtitles.append(title)
-                                break
-                            else:
-                                title += "{}<br>".format(lin)
-                else:
-                    msg = "No data in the file {}".format(dbfilnam)
-                    done = True
-        else:
-            done = True
-    if i == 0:
+        if not os.path.exists(path):
+            break
+        nametitle = readDBTitle(path)
+        if nametitle is None:
+            msg = "No data in the file {}".format(dbfilnam)
+            break
+        dbs.append(nametitle)
+    if not len(dbs):
         msg = "No database were found !"
-    if msg == "":
-        return True
-    QtWidgets.QMessageBox.critical(None, appName, msg)
-    return False
+    if msg != "":
+        raise DataBaseError(msg)
+    return dbs
 
 
 def loadElems(filename):
-    """
+    """ Load the elements of the file 'filename' in Elems
 
-    :param filename:
-    :return:
+    :param filename: the name of the ElemDB.txt file.
+    :return: True, a DataBaseError being raised if error.
     """
     global Elems
-    Elems = []
+    Elems = readElems(filename)
+    indexElems()
+    return True
+
+
+def readElems(filename):
+    """ Read the elements of the file 'filename'
+
+    :param filename: the name of the ElemDB.txt file.
+    :return: the list of Element, a DataBaseError being raised if error.
+    """
+    elems = []
     err = 0
     l = 0
     try:
@@ -147,27 +239,37 @@ def loadElems(filename):
                         errmsg = "Bad format for {0} in line {1}".format(item, l)
                         break
                     else:
-                        Elems.append(elem)
+                        elems.append(elem)
     except IOError as ioerr:
         err = 1
         errmsg = str(ioerr)
     if err:
         msg = "Error in reading Element data file\n"
         msg += errmsg
-        QtWidgets.QMessageBox.critical(None, appName, msg)
-        return False
-    return True
+        raise DataBaseError(msg)
+    return elems
 
 
 
 def loadSpecies(filename):
-    """
+    """ Load the species of the file 'filename' in Species
 
-    :param filename:
-    :return:
+    :param filename: the name of the SpeciesDBn.txt file.
+    :return: True, a DataBaseError being raised if error.
     """
     global Species
-    Species = []
+    Species = readSpecies(filename)
+    indexSpecies()
+    return True
+
+
+def readSpecies(filename):
+    """ Read the species of the file 'filename'
+
+    :param filename: the name of the SpeciesDBn.txt file.
+    :return: the list of Specie, a DataBaseError being raised if error.
+    """
+    species = []
     err = 0
     try:
         for line in open(filename):
@@ -210,615 +312,3358 @@ def loadSpecies(filename):
                             else:
                                 err = 1
                                 break
+                        # Optional uncertainties of g, s and DG(aq)
+                        elif i == 6:
+                            if IsNumber(item):
+                                spec.sg = float(item) * 1000
+                            else:
+                                err = 1
+                                break
+                        elif i == 7:
+                            if IsNumber(item):
+                                spec.ss = float(item)
+                            else:
+                                err = 1
+                                break
+                        elif i == 8:
+                            if IsNumber(item):
+                                spec.sDGaq = float(item) * 1000
+                            else:
+                                err = 1
+                                break
                     if err:
                         errmsg = "Bad format for {0} in line {1}".format(item, i + 1)
                         break
                     else:
-                        Species.append(spec)
+                        species.append(spec)
     except IOError as ioerr:
         errmsg = str(ioerr)
         err = 1
     if err:
         msg = "Error in reading Specie data file\n"
         msg += errmsg
-        QtWidgets.QMessageBox.critical(None, appName, msg)
-        return False
-    return True
+        raise DataBaseError(msg)
+    return species
+
+
+def indexElems():
+    """ Build the index and the prefix tree of the names of Elems """
+    global ElemIndex, ElemTrie
+    ElemIndex = {}
+    for elem in Elems:
+        ElemIndex[elem.name] = elem
+    ElemTrie = buildTrie(ElemIndex)
+
+
+def indexSpecies():
+    """ Build the index of the names of Species """
+    global SpeciesIndex
+    SpeciesIndex = {}
+    for i, spec in enumerate(Species):
+        SpeciesIndex[spec.name] = i
+
+
+def buildTrie(names):
+    """ Build the prefix tree of the element names
+
+        Each node is a dict {character: child node}, the key None
+        giving the element name which ends at this node.
+
+    :param names: an iterable of element names.
+    :return: the root node.
+    """
+    trie = {}
+    for nam in names:
+        node = trie
+        for ch in nam:
+            node = node.setdefault(ch, {})
+        node[None] = nam
+    return trie
+
+
+def splitFormula(nam, trie):
+    """ Decompose a formula in elements, e.g. "PO4" -> [("P", 1), ("O", 4)]
+
+        The longest element name matching at each position is used, and
+        it may be followed by a number of several digits.
+
+    :param nam: the formula (without charge).
+    :param trie: the prefix tree of the element names.
+    :return: the list of (element name, number) or None if an element is missing.
+    """
+    elemlst = []
+    i = 0
+    while i < len(nam):
+        node = trie
+        elnam = None
+        j = i
+        while j < len(nam) and nam[j] in node:
+            node = node[nam[j]]
+            j += 1
+            if None in node:
+                elnam = node[None]
+        if elnam is None:
+            return None
+        i += len(elnam)
+        j = i
+        while j < len(nam) and nam[j].isdigit():
+            j += 1
+        n = int(nam[i:j]) if j > i else 1
+        i = j
+        elemlst.append((elnam, n))
+    return elemlst
 
 
 def addElem2Specie():
-    """ Build the list of element names in Elems
+    """ Build the list of elements of each specie of Species
 
-    :return: a boolean = True if not error
+    :return: True, a DataBaseError being raised if error.
     """
-    elnames = []
-    for elem in Elems:
-        elnames.append(elem.name)
-    # Build the list of elements for each specie
-    for speci in Species:
-        elemlst = []
+    decomposeSpecies(Species, ElemIndex, ElemTrie)
+    return True
+
+
+def decomposeSpecies(species, elemindex, trie):
+    """ Build the list of elements of each specie
+
+        The sum of the entropies of its elements is also stored in each
+        specie, so that the element data are not needed for computing.
+
+    :param species: the list of Specie.
+    :param elemindex: the dict of the Element by name.
+    :param trie: the prefix tree of the element names (buildTrie).
+    :return: nothing, a DataBaseError being raised if error.
+    """
+    for speci in species:
         nam = speci.name
         if nam.endswith("2+") or nam.endswith("3+") or nam.endswith("4+"):
             nam = nam[:-2]
         elif nam.endswith('+') or nam.endswith('-'):
             nam = nam[:-1]
-        if nam in elnames:
-            # It is easy, there is only one element
-            elemlst.append((nam, 1))
-        else:
-            while len(nam):
-                find = False
-                for elnam in elnames:
-                    if nam.startswith(elnam):
-                        l = len(elnam)
-                        if len(nam) > l and IsNumber(nam[l]):
-                            n = int(nam[l])
-                            nam = nam[l + 1:]
-                        else:
-                            n = 1
-                            nam = nam[l:]
-                        elemlst.append((elnam, n))
-                        find = True
-                        break
-                if not find:
-                    msg = "Missing element required by {0} specie".format(speci.name)
-                    QtWidgets.QMessageBox.critical(None, appName, msg)
-                    return False
-        speci.elem = copy.copy(elemlst)
-    return True
+        elemlst = splitFormula(nam, trie)
+        if elemlst is None:
+            msg = "Missing element required by {0} specie".format(speci.name)
+            raise DataBaseError(msg)
+        speci.elem = tuple(elemlst)
+        speci.Selem = sum(elemindex[elnam].So_298 * n for elnam, n in elemlst)
 
 
 def initDataBase():
     """ Initialize data on element and species
 
-    :return: a boolean = True if ok.
+    :return: True, a DataBaseError being raised if error.
     """
     if len(Elems):
-        if not addElem2Specie():
-            return False
+        addElem2Specie()
     return True
 
 
-def aboutThermAP():
-    """ Open ThermAP_presentation.pdf in the Web Browser.
+# - Database cache -----------------------------------------------------------
 
-    :return: nothing.
+CacheName = "DBcache.npz"   # Compiled cache of the database files, in progpath
+CacheVersion = 2            # Version of the layout of the cache
+DBcache = None              # The cache loaded in memory
+
+
+def dataFiles():
+    """ Return the names of the database files: ElemDB.txt, SpeciesDB1.txt, ... """
+    files = ["ElemDB.txt"]
+    while os.path.exists(os.path.join(progpath, "SpeciesDB{}.txt".format(len(files)))):
+        files.append("SpeciesDB{}.txt".format(len(files)))
+    return files
+
+
+def fileStamps(files):
+    """ Return the size and modification time of the files as a JSON string """
+    import json
+    stamps = []
+    for filnam in files:
+        st = os.stat(os.path.join(progpath, filnam))
+        stamps.append([filnam, st.st_size, st.st_mtime_ns])
+    return json.dumps(stamps)
+
+
+def fileHash(filnam):
+    """ Return the SHA-1 of the contents of the database file 'filnam' """
+    import hashlib
+    with open(os.path.join(progpath, filnam), 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def buildCache(files):
+    """ Parse all the database files and return the arrays of the cache
+
+        All the strings are stored as unicode arrays, so that the cache
+        is loaded without pickle.
+
+    :param files: the list of the database files returned by dataFiles().
+    :return: a dict of arrays or None if a file can't be parsed.
     """
-    import webbrowser
-    url = os.path.join(progpath, "ThermAP_presentation.pdf")
-    if platform.system() == "Darwin":
-        webbrowser._browsers['safari'][1].open(url)
-    else:
-        webbrowser.open(url)
+    if len(files) < 2:
+        return None
+    try:
+        elems = readElems(os.path.join(progpath, files[0]))
+    except DataBaseError:
+        return None
+    elemindex = dict((elem.name, elem) for elem in elems)
+    trie = buildTrie(elemindex)
+    cache = {}
+    cache["elem_name"] = np.array([elem.name for elem in elems])
+    cache["elem_state"] = np.array([elem.state for elem in elems])
+    cache["elem_So"] = np.array([elem.So_298 for elem in elems], dtype=float)
+    dbnames = []
+    dbtitles = []
+    for i, filnam in enumerate(files[1:]):
+        path = os.path.join(progpath, filnam)
+        nametitle = readDBTitle(path)
+        if nametitle is None:
+            return None
+        try:
+            species = readSpecies(path)
+            decomposeSpecies(species, elemindex, trie)
+        except DataBaseError:
+            # The error will be reported when the text files are read
+            return None
+        dbnames.append(nametitle[0])
+        dbtitles.append(nametitle[1])
+        key = "sp{}_".format(i)
+        cache[key + "col"] = np.array([spec.col for spec in species], dtype=int)
+        cache[key + "name"] = np.array([spec.name for spec in species])
+        cache[key + "table"] = np.array([(spec.charge, spec.g, spec.s, spec.DGaq, spec.Selem,
+                                          spec.sg, spec.ss, spec.sDGaq)
+                                         for spec in species], dtype=float).reshape(-1, 8)
+        cache[key + "elem"] = np.array([";".join("{0},{1}".format(*item) for item in spec.elem)
+                                        for spec in species])
+    cache["db_name"] = np.array(dbnames)
+    cache["db_title"] = np.array(dbtitles)
+    cache["sha1"] = np.array([fileHash(filnam) for filnam in files])
+    return cache
+
+
+def loadCache():
+    """ Return the cache of the database files
+
+        The cache is rebuilt when the size or the modification time of a
+        database file has changed, or when a database was added or removed.
+
+    :return: a dict of arrays or None if the database files can't be parsed.
+    """
+    global DBcache
+    files = dataFiles()
+    try:
+        stamps = fileStamps(files)
+    except OSError:
+        return None
+    if DBcache is not None and str(DBcache["stamps"]) == stamps:
+        return DBcache
+    cache = readCache(files, stamps)
+    if cache is not None:
+        DBcache = cache
+    return cache
 
 
-# - QHLine class ------------------------------------------------------------
+def readCache(files, stamps):
+    """ Read the cache file, or build it if it is not up to date
 
-class QHLine(QtWidgets.QFrame):
-    def __init__(self):
-        super(QHLine, self).__init__()
-        self.setFrameShape(QtWidgets.QFrame.HLine)
-        self.setFrameShadow(QtWidgets.QFrame.Sunken)
-
-
-# - initDlg class ------------------------------------------------------------
-
-class initDlg(QtWidgets.QDialog):
-    def __init__(self, parent=None):
-        """ Init dialog.
-
-            self.label.setFont(QFont('Arial', 10))
-            self.label.setFont.setStyleSheet("font-weight: bold")
-            label.setText("x<sub>1</sub><sup>2</sup>")
-        """
-        super (initDlg, self).__init__(parent)
-        self.setWindowTitle(appName)
-        self.seldbno = 0
-
-        L1Llab = QtWidgets.QLabel("ThermAP")
-        font = QtGui.QFont('Arial', 24, QtGui.QFont.Bold)
-        font.setItalic(True)
-        L1Llab.setFont(font)
-
-        L1Rlab = QtWidgets.QLabel("Version {} - April 2021".format(version))
-        L1Rlab.setFont(QtGui.QFont('Arial', 14))
-        L1Rlab.setAlignment(Qt.AlignRight | Qt.AlignVCenter)
-        L2lab = QtWidgets.QLabel("Applied Predictive Thermodynamics")
-        L2lab.setFont(QtGui.QFont('Arial', 16))
-
-        Welcome1lab = QtWidgets.QLabel("Welcome to the ThermAP program!")
-        Welcome1lab.setFont(QtGui.QFont('Arial', 16, QtGui.QFont.Bold))
-        Welcome1lab.setStyleSheet("color: blue;")
-        Welcome1lab.setAlignment(Qt.AlignCenter | Qt.AlignVCenter)
-
-        sWelcome2 = " Predicting standard thermodynamic properties for complex oxides (298 K, 1 bar) \n"
-        sWelcome2 += " from their chemical composition using ion-refined contributions "
-        Welcome2lab = QtWidgets.QLabel(sWelcome2)
-        font = QtGui.QFont('Arial', 14)
-        font.setItalic(True)
-        Welcome2lab.setFont(font)
-        Welcome2lab.setAlignment(Qt.AlignCenter | Qt.AlignVCenter)
-        #Welcome2lab.setWordWrap(True)
-
-        sAuthorsL = "All rights reserved\n"
-        sAuthorsL += "Copyright: Christophe Drouet, Pierre Alphonse\n"
-        sAuthorsL += "CIRIMAT (UMR CNRS 5085), University of Toulouse, France"
-        AuthorsLlab =  QtWidgets.QLabel(sAuthorsL)
-        AuthorsLlab.setWordWrap(True)
-
-        sAuthorsR = 'Contact: <span style="color:blue; text-decoration:underline">christophe.drouet@cirimat.fr</span>'
-        AuthorsRlab = QtWidgets.QLabel(sAuthorsR)
-        AuthorsRlab.setAlignment(Qt.AlignRight | Qt.AlignBottom)
-
-        sCitation1 = "<u>Program citation:</u> C. Drouet, P. Alphonse, ThermAP, "
-        sCitation1 += '<span style="color:blue; text-decoration:underline">www.christophedrouet.com/thermAP.html</span>'
-        sCitation1 += ", Toulouse, France (2015)"
-        sCitation2 = "<u>Initial reference:</u> C. Drouet, Journal of Chemical Thermodynamics 81 (2015) 143-159."
-        Citationlab1 = QtWidgets.QLabel(sCitation1)
-        Citationlab1.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)
-        Citationlab2 = QtWidgets.QLabel(sCitation2)
-        Citationlab2.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)
-
-        aboutbut = QtWidgets.QPushButton("ThermAP overview")
-        aboutbut.setFont(QtGui.QFont('Arial', 16, QtGui.QFont.Bold))
-        dbButtons = []
-        for dbnam in DBnames:
-            butnam = " Access the {} database ".format(dbnam)
-            but = QtWidgets.QPushButton(butnam)
-            but.setFont(QtGui.QFont('Arial', 16))
-            dbButtons.append(but)
-
-        # set the layout
-        tophbox = QtWidgets.QHBoxLayout()
-        tophbox.addWidget(L1Llab)
-        tophbox.addWidget(L1Rlab)
-        l2hbox = QtWidgets.QHBoxLayout()
-        l2hbox.addWidget(L2lab)
-        welcomevbox = QtWidgets.QVBoxLayout()
-        welcomevbox.addWidget(Welcome1lab)
-        welcomevbox.addSpacing(20)
-        welcomevbox.addWidget(Welcome2lab)
-
-        buttonvbox = QtWidgets.QVBoxLayout()
-        buttonhbox = QtWidgets.QHBoxLayout()
-        buttonhbox.addStretch(1)
-        buttonhbox.addWidget(aboutbut)
-        buttonhbox.addStretch(1)
-        buttonvbox.addLayout(buttonhbox)
-        for but in dbButtons:
-            buttonhbox = QtWidgets.QHBoxLayout()
-            buttonhbox.addStretch(1)
-            buttonhbox.addWidget(but)
-            buttonhbox.addStretch(1)
-            buttonvbox.addLayout(buttonhbox)
-
-        authorhbox = QtWidgets.QHBoxLayout()
-        authorhbox.addWidget(AuthorsLlab)
-        authorhbox.addWidget(AuthorsRlab)
-        citationvbox = QtWidgets.QVBoxLayout()
-        citationvbox.addWidget(Citationlab1)
-        citationvbox.addWidget(Citationlab2)
-        vbox = QtWidgets.QVBoxLayout()
-        vbox.addLayout(tophbox)
-        vbox.addLayout(l2hbox)
-        vbox.addSpacing(20)
-        vbox.addLayout(welcomevbox)
-        vbox.addSpacing(20)
-        vbox.addLayout(buttonvbox)
-        vbox.addSpacing(20)
-        vbox.addLayout(authorhbox)
-        vbox.addSpacing(10)
-        vbox.addLayout(citationvbox)
-        self.setLayout(vbox)
-
-        aboutbut.clicked.connect(aboutThermAP)
-        for but in dbButtons:
-            but.clicked.connect(self.setdbno)
-
-
-    def setdbno(self):
-        source = self.sender()
-        for i, dbnam in enumerate(DBnames):
-            if dbnam in source.text():
-                self.seldbno = i+1
-                break
-        self.accept()
-
-
-
-# - inputDlg class ------------------------------------------------------------
-
-class inputDlg(QtWidgets.QDialog):
-    def __init__(self, parent=None):
-        """ Input dialog.
-        """
-        super (inputDlg, self).__init__(parent)
-        self.setWindowTitle(appName)
-
-        # Save current values of species in 'currdata.txt'
-        fo = open('currdata.txt', 'w')
-        fo.write('Name\tcharge\t   g(i)\t   s(i)\t   DG(aq)\tElements\n')
-        for specie in Species:
-            lin = ""
-            lin += '{:7s}\t'.format(specie.name)
-            lin += '{:>+3.0f}\t'.format(specie.charge)
-            lin += '{:>+7.2f}\t'.format(specie.g/1000.0)
-            lin += '{:>+7.2f}\t'.format(specie.s)
-            lin += '{:>+9.2f}\t'.format(specie.DGaq/1000.0)
-            for i, item in enumerate(specie.elem):
-                lin += '{0},{1}'.format(item[0], item[1])
-                if i < len(specie.elem)-1:
-                    lin +='; '
-            lin += '\n'
-            fo.write(lin)
-        fo.close()
-
-        titlelab = QtWidgets.QLabel(DBtitles[curDBidx])
-        titlelab.setFont(QtGui.QFont('Arial', 14, QtGui.QFont.Bold))
-        titlelab.setAlignment(Qt.AlignCenter | Qt.AlignVCenter)
-        titlelab.setWordWrap(True)
-
-        font = QtGui.QFont('Arial', 12)
-        regex = QRegExp("[0-9][.0-9][0-9][0-9]")
-        validator = QtGui.QRegExpValidator(regex)
-
-        lablst = []
-        self.inputlst = []
-        for i, spec in enumerate(Species):
-            if spec.name.endswith("4+"):
-                sSpec = spec.name[:-2] + "<sup>4+</sup>"
-            if spec.name.endswith("3+"):
-                sSpec = spec.name[:-2] + "<sup>3+</sup>"
-            elif spec.name.endswith("2+"):
-                sSpec = spec.name[:-2] + "<sup>2+</sup>"
-            elif spec.name.endswith("+"):
-                sSpec = spec.name[:-1] + "<sup>+</sup>"
-            elif spec.name.endswith("-"):
-                sSpec = spec.name[:-1] + "<sup>-</sup>"
-            else:
-                sSpec = spec.name
-                if spec.name == "PO4":
-                    sSpec += "<sup>3-</sup>"
-                elif spec.name == "H+":
-                    sSpec = "HPO<sub>4</sub><sup>2-</sup>  (<sup>*</sup>)"
-                elif spec.name == "H2O":
-                    sSpec = "H<sub>2</sub>O"
-                else:
-                    sSpec = "?"
-            lab = QtWidgets.QLabel(sSpec)
-            lab.setFont(font)
-            lablst.append(lab)
-            inp = QtWidgets.QLineEdit(self)
-            inp.setFont(font)
-            inp.setValidator(validator)
-            inp.setText("")
-            #inp.setText(str(Species[i].coef))
-            self.inputlst.append(inp)
-
-        sfoot = "<sup>*</sup>the HPO<sub>4</sub><sup>2-</sup> ion being treated in "
-        sfoot += "this additive model as the sum PO<sub>4</sub><sup>3-</sup>  +  H<sup>+</sup>"
-        footlab = QtWidgets.QLabel(sfoot)
-
-        computeButton = QtWidgets.QPushButton("Compute")
-        computeButton.setFont(font)
-        clearButton = QtWidgets.QPushButton("Clear")
-        clearButton.setFont(font)
-        homeButton = QtWidgets.QPushButton("HOME")
-        homeButton.setFont(QtGui.QFont('Arial', 12, QtGui.QFont.Bold))
-        aboutButton = QtWidgets.QPushButton("About")
-        aboutButton.setFont(font)
-        quitButton = QtWidgets.QPushButton("Quit")
-        quitButton.setFont(font)
-
-        # set the layout
-        titlevbox = QtWidgets.QVBoxLayout()
-        titlevbox.addWidget(titlelab)
-        titlevbox.addWidget(QHLine())
-
-        # These Grids contain the label and input text for each specie
-        gridbox1 = QtWidgets.QGridLayout()
-        gridbox2 = QtWidgets.QGridLayout()
-        gridbox3 = QtWidgets.QGridLayout()
-        # addWidget (widget, row, column[, alignment=0])
-        n1 = n2 = n3 = 0
-        for i, spec in enumerate(Species):
-            # First column
-            if spec.col == 1:
-                gridbox1.addWidget(lablst[i], i, 0)
-                gridbox1.addWidget(self.inputlst[i], i, 1)
-                n1 += 1
-            # 2nd column
-            if spec.col == 2:
-                gridbox2.addWidget(lablst[i], n2, 0)
-                gridbox2.addWidget(self.inputlst[i], n2, 1)
-                n2 += 1
-            # 3rd column
-            if spec.col == 3:
-                if spec.name == "H2O":
-                    # Separate H2O from anions with an empty line
-                    emptylab = QtWidgets.QLabel(" ")
-                    gridbox3.addWidget(emptylab, n3, 0)
-                    gridbox3.addWidget(lablst[i], n3+1, 0)
-                    gridbox3.addWidget(self.inputlst[i], n3+1, 1)
-                else:
-                    gridbox3.addWidget(lablst[i], n3, 0)
-                    gridbox3.addWidget(self.inputlst[i], n3, 1)
-                n3 += 1
-
-        gridbox1.setContentsMargins(20, 0, 50, 0)
-        gridbox2.setContentsMargins(20, 0, 50, 0)
-        gridbox3.setContentsMargins(0, 0, 20, 0)
-        col1vbox = QtWidgets.QVBoxLayout()
-        col1vbox.addLayout(gridbox1)
-        col1vbox.addStretch()
-        col2vbox = QtWidgets.QVBoxLayout()
-        col2vbox.addLayout(gridbox2)
-        col2vbox.addStretch()
-        col3vbox = QtWidgets.QVBoxLayout()
-        col3vbox.addLayout(gridbox3)
-        col3vbox.addStretch()
-
-        colshbox = QtWidgets.QHBoxLayout()
-        colshbox.addLayout(col1vbox)
-        colshbox.addStretch()
-        colshbox.addLayout(col2vbox)
-        colshbox.addStretch()
-        colshbox.addLayout(col3vbox)
-
-        btnhbox = QtWidgets.QHBoxLayout()
-        btnhbox.addWidget(computeButton)
-        btnhbox.addWidget(clearButton)
-        btnhbox.addWidget(homeButton)
-        btnhbox.addWidget(aboutButton)
-        btnhbox.addWidget(quitButton)
-
-        footvbox = QtWidgets.QVBoxLayout()
-        footvbox.addSpacing(20)
-        footvbox.addWidget(footlab)
-        footvbox.addWidget(QHLine())
-
-        mainvbox = QtWidgets.QVBoxLayout()
-        mainvbox.addLayout(titlevbox)
-        mainvbox.addLayout(colshbox)
-        mainvbox.addLayout(footvbox)
-        mainvbox.addLayout(btnhbox)
-        self.setLayout(mainvbox)
-
-        computeButton.clicked.connect(self.compute)
-        clearButton.clicked.connect(self.clear)
-        homeButton.clicked.connect(self.accept)
-        aboutButton.clicked.connect(self.about)
-        quitButton.clicked.connect(self.reject)
-
-
-    def getSoElem(self, name):
-        for elem in Elems:
-            if elem.name == name:
-                return elem.So_298
+    :param files: the list of the database files returned by dataFiles().
+    :param stamps: their stamps returned by fileStamps().
+    :return: a dict of arrays or None if the database files can't be parsed.
+    """
+    path = os.path.join(progpath, CacheName)
+    try:
+        with np.load(path) as npz:
+            cache = dict((key, npz[key]) for key in npz.files)
+        if str(cache["stamps"]) == stamps and int(cache["version"]) == CacheVersion:
+            return cache
+    except (IOError, OSError, KeyError, ValueError):
+        pass
+    cache = buildCache(files)
+    if cache is None:
         return None
+    cache["stamps"] = np.array(stamps)
+    cache["version"] = np.array(CacheVersion)
+    try:
+        # Write a temporary file, then rename it, in case of concurrent processes
+        tmpnam = "{0}.{1}.tmp.npz".format(path, os.getpid())
+        np.savez(tmpnam, **cache)
+        os.replace(tmpnam, path)
+    except OSError:
+        pass
+    return cache
+
+
+def setFromCache(cache, idx):
+    """ Set Elems and Species from the cache for the database 'idx' """
+    global Elems, Species
+    Elems, Species = cacheDataBase(cache, idx)
+    indexElems()
+    indexSpecies()
+
+
+def cacheDataBase(cache, idx):
+    """ Return the elements and species of the database 'idx' of the cache
+
+    :return: a tuple (list of Element, list of Specie).
+    """
+    elems = [Element(str(nam), str(state), float(So)) for nam, state, So in
+             zip(cache["elem_name"], cache["elem_state"], cache["elem_So"])]
+    key = "sp{}_".format(idx)
+    species = []
+    for col, nam, row, elem in zip(cache[key + "col"], cache[key + "name"],
+                                   cache[key + "table"], cache[key + "elem"]):
+        elemlst = []
+        for item in str(elem).split(";"):
+            if item:
+                elnam, n = item.split(",")
+                elemlst.append((elnam, int(n)))
+        charge, g, s, DGaq, Selem, sg, ss, sDGaq = [float(v) for v in row]
+        species.append(Specie(int(col), str(nam), charge, g, s, DGaq, elemlst, Selem, sg, ss, sDGaq))
+    return elems, species
+
+
+def dbFingerprint(sha1):
+    """ Return the fingerprint of a database from the SHA-1 of its files """
+    import hashlib
+    return hashlib.sha1(":".join(sha1).encode()).hexdigest()
+
 
+# - Estimator class ----------------------------------------------------------
 
-    def clear(self):
-        """ Clear all the coefficient values
+class Estimator(object):
+    """ Vectorized estimation of the thermodynamic properties
 
-        :return: Nothing
+        The tables of a database (charge, g, s, sum of element S°, DGaq)
+        are stored as the columns of a (M species x 5) array, so that
+        evaluating N compositions is a single (N x M) . (M x 5) product.
+    """
+    def __init__(self, species, fingerprint=""):
+        """
+        :param species: list of Specie, decomposed by addElem2Specie.
+        :param fingerprint: the fingerprint of the database files (DBfingerprint).
         """
-        for inp in self.inputlst:
-            inp.setText("")
+        self.fingerprint = fingerprint
+        self.names = [spec.name for spec in species]
+        self.nameidx = dict((nam, i) for i, nam in enumerate(self.names))
+        self.col = np.array([spec.col for spec in species], dtype=int)
+        self.table = np.array([(spec.charge, spec.g, spec.s, spec.Selem, spec.DGaq)
+                               for spec in species], dtype=float).reshape(-1, 5)
+        self.charge, self.g, self.s, self.Selem, self.DGaq = self.table.T
+        # Uncertainties (standard deviations) of g, s and DGaq
+        self.sigma = np.array([(spec.sg, spec.ss, spec.sDGaq) for spec in species],
+                              dtype=float).reshape(-1, 3)
+        # DGdisso is only calculated when there is no H+ (HPO4) in the formula
+        # and when the database gives the DG of the species dissolved in water
+        self.aqdata = bool(np.any(self.DGaq != 0.0))
+        if "H+" in self.nameidx:
+            self.hidx = self.nameidx["H+"]
+        else:
+            self.hidx = -1
+
 
+    def index(self, name):
+        """ Return the column of the Specie 'name' in the coefficient matrix """
+        return self.nameidx[name]
 
-    def about(self):
-        aboutThermAP()
 
+    def linearForm(self, prop):
+        """ Return the vector 'a' such as the property 'prop' is a.coefs
 
+            This holds for pKsp only for the formulas without H+ (HPO4).
 
-    def compute(self, event):
+        :param prop: a property of 'Properties'.
+        :return: a M-array.
         """
-            Expected results for fluorapatite Ca(10)PO4(6)F(2):
-            DGf = -12836 kJ/mol
-            DHf = -13598 kJ/mol
-            DSf =  -2557 J/mol/K
-            So  =    770 J/mol.K
-            pKsp = 109
+        if prop == "DGf":
+            return self.g / 1000.0
+        if prop == "DHf":
+            return (self.g + T0 * (self.s - self.Selem)) / 1000.0
+        if prop == "DSf":
+            return self.s - self.Selem
+        if prop == "So":
+            return self.s.copy()
+        if prop == "pKsp":
+            return (self.DGaq - self.g) / (LN10 * R * T0)
+        raise ValueError("Unknown property {}".format(prop))
+
+
+    def validate(self, charge, tol=EPSCHARGE):
+        """ Return the electroneutrality mask of the charge imbalances 'charge'
+
+        :param charge: the charge imbalances.
+        :param tol: the tolerance, a number or an array (see tolerance).
         """
-        errmsg = ''
-        # Retrieve the value of coefficients
-        for i, spec in enumerate(Species):
-            if IsNumber(self.inputlst[i].text()):
-                spec.coef = float(self.inputlst[i].text())
-            else:
-                spec.coef = 0.0
-        # Check electroneutrality
-        S = 0.0
-        for specie in Species:
-            if specie.coef != 0.0:
-                S += specie.coef * specie.charge
-        if abs(S) > 1e-10:
-            errmsg = 'Check the electroneutrality !'
+        return np.abs(charge) <= tol
+
+
+    def chargeBalance(self, coefs):
+        """ Return the charge imbalance and the electroneutrality mask of a batch
+
+        :param coefs: (N x M) array of coefficients.
+        :return: a tuple (N-array of the charge imbalances, N-array mask of
+                 the electroneutral compositions).
+        """
+        A = np.asarray(coefs)
+        C = np.asarray(A, dtype=float)
+        if C.ndim == 1:
+            C = C.reshape(1, -1)
+        charge = C @ self.charge
+        return charge, self.validate(charge, self.tolerance(C, A.dtype))
+
+
+    def tolerance(self, C, dtype):
+        """ Return the tolerance of the electroneutrality of coefficients read as 'dtype'
+
+            The coefficients given in single precision are not exact (9.9 is
+            9.8999996 in float32), so that the charge of an electroneutral
+            composition can be far from 0; the tolerance then follows the
+            rounding errors of the coefficients.
+
+        :param C: (N x M) array of the coefficients, in double precision.
+        :param dtype: the type of the coefficients given.
+        :return: EPSCHARGE or an N-array of tolerances.
+        """
+        if not np.issubdtype(dtype, np.floating) or np.finfo(dtype).eps <= np.finfo(float).eps:
+            return EPSCHARGE
+        return np.maximum(EPSCHARGE, 8 * np.finfo(dtype).eps * (np.abs(C) @ np.abs(self.charge)))
+
+
+    def balance(self, coefs, species, bounds=None):
+        """ Close the charge imbalance of a batch on compensating species
+
+            For each composition which is not electroneutral, the coefficient
+            of the first species of 'species' giving a coefficient within its
+            bounds is changed so that the charge is 0.
+
+        :param coefs: (N x M) array of coefficients.
+        :param species: the names of the compensating species, in order of preference.
+        :param bounds: the (min, max) of the coefficient of each compensating
+                       species, (0, inf) by default.
+        :return: a tuple (balanced copy of the coefficients, N-array of the
+                 index in 'species' of the species changed, -1 if none, N-array
+                 mask of the electroneutral compositions).
+        """
+        C = np.array(coefs, dtype=float, ndmin=2)
+        if bounds is None:
+            bounds = [(0.0, np.inf)] * len(species)
+        charge, valid = self.chargeBalance(C)
+        used = np.full(len(C), -1, dtype=int)
+        for j, (nam, (lo, hi)) in enumerate(zip(species, bounds)):
+            k = self.index(nam)
+            if self.charge[k] == 0.0:
+                raise ValueError("{} has no charge and can't balance the compositions".format(nam))
+            rows = np.nonzero(~valid)[0]
+            if not len(rows):
+                break
+            new = C[rows, k] - charge[rows] / self.charge[k]
+            ok = (new >= lo - EPSCHARGE) & (new <= hi + EPSCHARGE)
+            rows = rows[ok]
+            C[rows, k] = np.clip(new[ok], lo, hi)
+            used[rows] = j
+            charge[rows], valid[rows] = self.chargeBalance(C[rows])
+        return C, used, valid
+
+
+    def evaluate(self, comp):
+        """ Compute the properties of one composition
+
+            Nothing is modified, so that several threads may evaluate
+            compositions with the same Estimator.
+
+        :param comp: a dict {species name: coefficient} or a M-vector.
+        :return: a dict of floats with the keys of 'Properties' (NaN if not
+                 computed), 'charge' and 'valid'.
+        """
+        if isinstance(comp, dict):
+            coefs = np.zeros(len(self.names))
+            for nam, coef in comp.items():
+                if nam not in self.nameidx:
+                    raise ValueError("Unknown species {}".format(nam))
+                coefs[self.nameidx[nam]] = coef
         else:
-            Sg = 0.0  # Sum of G for species
-            Ss = 0.0  # Sum of S for species
-            SSelem = 0.0  # Sum of S for elements
-            SDGaq = 0.0
-            aqflag = False  # if True DGdisso is calculated
-            for specie in Species:
-                if aqflag == False and specie.coef == 0:
-                    if specie.name == 'H+':
-                        aqflag = True
-                Sg += specie.coef * specie.g
-                Ss += specie.coef * specie.s
-                SDGaq += specie.coef * specie.DGaq
-                S = 0.0
-                for elem in specie.elem:
-                    Selm = self.getSoElem(elem[0])
-                    if Selm is not None:
-                        S += Selm * elem[1]
-                    else:
-                        errmsg = 'Unknown element: ' + elem[0]
-                        break
-                if errmsg:
-                    break
-                else:
-                    SSelem += specie.coef * S
-            DS = Ss - SSelem
-            DH = Sg + 298 * DS
-            if aqflag:
-                DGdisso = SDGaq - Sg
-                logKsp = -1.0 * DGdisso / (2.303 * 8.314 * 298)
-
-        if errmsg:
-            QtWidgets.QMessageBox.critical(self, appName, errmsg)
+            coefs = comp
+        res = self.compute(coefs)
+        out = dict((key, float(res[key][0])) for key in Properties + ("charge",))
+        out["valid"] = bool(res["valid"][0])
+        return out
+
+
+    def compute(self, coefs, dtype=None):
+        """ Compute the properties of a batch of compositions
+
+            Rows which are not electroneutral get NaN for all the properties.
+            pKsp is NaN if the formula contains H+ (HPO4).
+
+        :param coefs: (N x M) array of coefficients, the columns following
+                      the order of the species in the database.
+        :param dtype: the type in which the coefficients were given, for the
+                      tolerance of the electroneutrality, coefs.dtype by default.
+        :return: a dict of N-arrays with the keys of 'Properties'
+                 (DGf, DHf in kJ/mol; DSf, So in J/mol/K), 'charge' (the
+                 charge imbalance) and 'valid' (electroneutrality mask).
+        """
+        A = np.asarray(coefs)
+        C = np.asarray(A, dtype=float)
+        if C.ndim == 1:
+            C = C.reshape(1, -1)
+        if C.ndim != 2 or C.shape[1] != len(self.names):
+            raise ValueError("The coefficient matrix must have {} columns".format(len(self.names)))
+        if self.hidx >= 0:
+            hcoef = C[:, self.hidx]
         else:
-            # Build stresults
-            st = '<TABLE BORDER=0 CELLSPACING=5 CELLPADDING=1>'
-            st += '<TR>'
-            st += '<TD WIDTH=150>  Estimated &Delta;G<sub>f</sub><sup>o</sup> :</TD>'
-            st += '<TD ALIGN="right"> {:.0f}</TD>'.format(Sg/1000.0)
-            st += '<TD> kJ.mol<sup>-1</sup></TD>'
-            st += '</TR>'
-            st += '<TR>'
-            st += '<TD>   Estimated &Delta;H<sub>f</sub><sup>o</sup> : </TD>'
-            st += '<TD ALIGN="right"> {:.0f}</TD>'.format(DH/1000.0)
-            st += '<TD> kJ.mol<sup>-1</sup></TD>'
-            st += '</TR>'
-            st += '<TR>'
-            st += '<TD>   Estimated &Delta;S<sub>f</sub><sup>o</sup> : </TD>'
-            st += '<TD ALIGN="right"> {:.0f}</TD>'.format(DS)
-            st += '<TD> J.mol<sup>-1</sup>.K<sup>-1</sup></TD>'
-            st += '</TR>'
-            st += '<TR>'
-            st += '<TD>   Estimated S<sup>o</sup> : </TD>'
-            st += '<TD ALIGN="right"> {:.0f}</TD>'.format(Ss)
-            st += '<TD> J.mol<sup>-1</sup>.K<sup>-1</sup></TD>'
-            st += '</TR>'
-            if DBnames[curDBidx] != "Apatites":
-                st += '</TABLE>'
-                st += '<br><br>'
-            else:
-                if aqflag:
-                    st += '<TR>'
-                    st += '<TD>  </TD>'
-                    st += '</TR>'
-                    st += '<TR>'
-                    st += '<TD>   Estimated pK<sub>sp</sub><sup>*</sup> : </TD>'
-                    st += '<TD ALIGN="right"> {:.0f}</TD>'.format(-1 * logKsp)
-                    st += '</TR>'
-                    st += '</TABLE>'
-                    st += '<br><br><br>'
-                    st += '<sup>*</sup>Considering equation of the type : <br><br>'
-                    st += '&nbsp;&nbsp; M<sub>10</sub>(PO<sub>4</sub>)<sub>6</sub> X<sub>2</sub>  &#x2192;'
-                    st += ' 10 M<sup>2+</sup>(aq) + 6 PO<sub>4</sub><sup>3-</sup>(aq) + 2 X<sup>-</sup>(aq)'
-                    st += '<br><br>'
-                    st += 'These K<sub>sp</sub> estimates should be considered only as first '
-                    st += 'approximation taking into account propagated uncertainties.'
+            hcoef = np.zeros(len(C))
+        return self.properties(C @ self.table, hcoef, self.tolerance(C, A.dtype if dtype is None else dtype))
+
+
+    def computeSparse(self, coefs):
+        """ Compute the properties of a batch of compositions in sparse form
+
+            The cost is proportional to the number of nonzero coefficients,
+            not to the number of rows times the number of species.
+
+        :param coefs: a CSR matrix, i.e. a tuple (indptr, indices, data) or an
+                      object with these attributes (e.g. scipy.sparse.csr_matrix),
+                      or a list of rows, each one a list of (species name or
+                      index, coefficient).
+        :return: the dict of Estimator.compute.
+        """
+        if isinstance(coefs, tuple) and len(coefs) == 3:
+            indptr, indices, data = coefs
+        elif hasattr(coefs, "indptr"):
+            indptr, indices, data = coefs.indptr, coefs.indices, coefs.data
+        else:
+            indptr, indices, data = self.sparseRows(coefs)
+        indptr = np.asarray(indptr, dtype=int)
+        indices = np.asarray(indices, dtype=int)
+        data = np.asarray(data, dtype=float)
+        N = len(indptr) - 1
+        if len(indices) and (indices.min() < 0 or indices.max() >= len(self.names)):
+            raise ValueError("The species indexes must be lower than {}".format(len(self.names)))
+        # Row of each nonzero coefficient
+        rows = np.repeat(np.arange(N), np.diff(indptr))
+        contrib = data[:, None] * self.table[indices]
+        sums = np.column_stack([np.bincount(rows, contrib[:, j], minlength=N) for j in range(5)])
+        hcoef = np.bincount(rows, np.where(indices == self.hidx, data, 0.0), minlength=N)
+        return self.properties(sums.reshape(N, 5), hcoef)
+
+
+    def sparseRows(self, rows):
+        """ Convert rows of (species name or index, coefficient) in a CSR matrix
+
+        :return: a tuple (indptr, indices, data), a ValueError being raised
+                 for an unknown species.
+        """
+        indptr = [0]
+        indices = []
+        data = []
+        for r, row in enumerate(rows):
+            for spec, coef in row:
+                if isinstance(spec, str):
+                    if spec not in self.nameidx:
+                        raise ValueError("Unknown species {0} in row {1}".format(spec, r + 1))
+                    spec = self.nameidx[spec]
+                indices.append(spec)
+                data.append(coef)
+            indptr.append(len(indices))
+        return indptr, indices, data
+
+
+    def properties(self, sums, hcoef, tol=EPSCHARGE):
+        """ Compute the properties from the sums over the species of a batch
+
+        :param sums: (N x 5) array of the sums of the coefficients times
+                     the columns of 'table' (charge, g, s, Selem, DGaq).
+        :param hcoef: N-array of the coefficients of H+ (HPO4).
+        :param tol: the tolerance of the electroneutrality (see tolerance).
+        :return: the dict of Estimator.compute.
+        """
+        charge, Sg, Ss, SSelem, SDGaq = sums.T
+        valid = self.validate(charge, tol)
+        if instrument is not None:
+            instrument.count("rows", len(valid))
+            instrument.count("invalid_rows", len(valid) - int(np.count_nonzero(valid)))
+        DS = Ss - SSelem
+        DH = Sg + T0 * DS
+        if self.aqdata and self.hidx >= 0:
+            aqflag = hcoef == 0.0
+        else:
+            aqflag = np.zeros(len(sums), dtype=bool)
+        pKsp = np.where(aqflag, (SDGaq - Sg) / (LN10 * R * T0), np.nan)
+        res = {"DGf": Sg / 1000.0, "DHf": DH / 1000.0, "DSf": DS, "So": Ss, "pKsp": pKsp}
+        for key in Properties:
+            res[key] = np.where(valid, res[key], np.nan)
+        res["charge"] = charge
+        res["valid"] = valid
+        return res
+
+
+    def computeT(self, coefs, temps, DSdisso=0.0, chunksize=10000):
+        """ Compute DGf and log Ksp of a batch of compositions at several temperatures
+
+            Ulich approximation: DHf and DSf are taken as independent of
+            the temperature, DGf(T) = DHf - T.DSf, and the same for the
+            dissolution. The databases give no enthalpy of the dissolved
+            species, so the entropy of dissolution 'DSdisso' is 0 by default,
+            i.e. DGdisso is taken as constant.
+
+            The compositions are computed by chunks of 'chunksize' rows, so
+            that the memory used, besides the two (N x T) results, is
+            proportional to chunksize * T.
+
+        :param coefs: (N x M) array of coefficients.
+        :param temps: the T temperatures (K).
+        :param DSdisso: the entropy of dissolution (J/mol/K), a scalar or a N-array.
+        :param chunksize: the number of compositions computed at once.
+        :return: a dict with the (N x T) arrays 'DGf' (kJ/mol) and 'logKsp',
+                 and the N-array 'valid'.
+        """
+        temps = np.asarray(temps, dtype=float).reshape(1, -1)
+        res = self.compute(coefs)
+        N = len(res["valid"])
+        DSd = np.broadcast_to(np.asarray(DSdisso, dtype=float).reshape(-1, 1), (N, 1))
+        out = {"DGf": np.empty((N, temps.shape[1])), "logKsp": np.empty((N, temps.shape[1])),
+               "valid": res["valid"]}
+        for start in range(0, N, chunksize):
+            rows = slice(start, start + chunksize)
+            # DGdisso(298) = -LN10.R.T0.logKsp(298) = DHdisso - T0.DSdisso
+            DHd = LN10 * R * T0 * res["pKsp"][rows, None] + T0 * DSd[rows]
+            out["DGf"][rows] = res["DHf"][rows, None] - temps * res["DSf"][rows, None] / 1000.0
+            out["logKsp"][rows] = -(DHd - temps * DSd[rows]) / (LN10 * R * temps)
+        return out
+
+
+# - RunningSums class --------------------------------------------------------
+
+class RunningSums(object):
+    """ Properties of one composition updated coefficient by coefficient
+
+        The sums (charge, g, s, sum of element S°, DGaq) are updated with the
+        contribution of the changed species only, in O(1). They are computed
+        again from all the coefficients every 'resync' updates, so that the
+        rounding errors do not pile up.
+    """
+    def __init__(self, estimator, resync=1000):
+        """
+        :param estimator: the Estimator of the current database.
+        :param resync: the number of updates between two full computations.
+        """
+        self.estimator = estimator
+        self.resync = resync
+        self.coefs = np.zeros(len(estimator.names))
+        self.sums = np.zeros(5)
+        self.nupdate = 0
+
+
+    def reset(self):
+        """ Set all the coefficients to 0 """
+        self.coefs[:] = 0.0
+        self.sums[:] = 0.0
+        self.nupdate = 0
+
+
+    def setCoef(self, idx, coef):
+        """ Change the coefficient of the species 'idx'
+
+        :param idx: the index of the species in the database.
+        :param coef: the new coefficient.
+        :return: True if the coefficient has changed.
+        """
+        delta = coef - self.coefs[idx]
+        if delta == 0.0:
+            return False
+        self.coefs[idx] = coef
+        self.nupdate += 1
+        if self.nupdate >= self.resync or not np.any(self.coefs):
+            self.sums = self.coefs @ self.estimator.table
+            self.nupdate = 0
+        else:
+            self.sums += delta * self.estimator.table[idx]
+        return True
+
+
+    def values(self):
+        """ Return the properties of the current composition
+
+        :return: a dict of floats with the keys of 'Properties', 'charge'
+                 and 'valid', as returned by Estimator.compute for one row.
+        """
+        est = self.estimator
+        charge, Sg, Ss, SSelem, SDGaq = self.sums
+        valid = abs(charge) <= EPSCHARGE
+        DS = Ss - SSelem
+        if est.aqdata and est.hidx >= 0 and self.coefs[est.hidx] == 0.0:
+            pKsp = (SDGaq - Sg) / (LN10 * R * T0)
+        else:
+            pKsp = np.nan
+        res = {"DGf": Sg / 1000.0, "DHf": (Sg + T0 * DS) / 1000.0, "DSf": DS, "So": Ss, "pKsp": pKsp}
+        if not valid:
+            for key in Properties:
+                res[key] = np.nan
+        res["charge"] = charge
+        res["valid"] = valid
+        return res
+
+
+# - ResultCache class --------------------------------------------------------
+
+class ResultCache(object):
+    """ Memoization of the results of an Estimator
+
+        The results are kept in a LRU dict in memory and, optionally, in a
+        SQLite file shared by several processes. They are keyed by the
+        fingerprint of the database files and the coefficient vector, so that
+        the results computed with an older version of a database are never
+        used. A ResultCache is used like its Estimator.
+    """
+    Columns = Properties + ("charge",)
+
+    def __init__(self, estimator, size=100000, path=None):
+        """
+        :param estimator: the Estimator of the current database.
+        :param size: the maximum number of results kept in memory.
+        :param path: the name of the SQLite file, or None.
+        """
+        self.estimator = estimator
+        self.size = size
+        self.path = path
+        # The counters are numbers of rows, the duplicated rows of a
+        # batch counting as the first one: computed or found
+        self.hits = 0          # rows found in memory
+        self.diskhits = 0      # rows found in the SQLite file
+        self.misses = 0        # rows computed
+        self.evictions = 0     # results removed from memory
+        self.open()
+
+
+    def open(self):
+        import collections, threading
+        self.lru = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.db = None
+        if self.path is not None:
+            import sqlite3
+            self.db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS results (fingerprint TEXT, coefs BLOB, "
+                            "{}, PRIMARY KEY (fingerprint, coefs))".format(
+                            ", ".join(key + " REAL" for key in self.Columns)))
+            self.db.commit()
+
+
+    def __getstate__(self):
+        # Only the parameters are sent to the worker processes
+        return {"estimator": self.estimator, "size": self.size, "path": self.path}
+
+
+    def __setstate__(self, state):
+        self.__init__(state["estimator"], state["size"], state["path"])
+
+
+    def __getattr__(self, name):
+        if name == "estimator":
+            raise AttributeError(name)
+        return getattr(self.estimator, name)
+
+
+    def stats(self):
+        """ Return the counters of the cache as a dict, in numbers of rows """
+        return {"hits": self.hits, "diskhits": self.diskhits, "misses": self.misses,
+                "evictions": self.evictions, "size": len(self.lru)}
+
+
+    def purge(self):
+        """ Remove from the SQLite file the results of other database versions
+
+        :return: the number of results removed.
+        """
+        if self.db is None:
+            return 0
+        with self.lock:
+            cur = self.db.execute("DELETE FROM results WHERE fingerprint != ?",
+                                  (self.estimator.fingerprint,))
+            self.db.commit()
+        return cur.rowcount
+
+
+    def store(self, key, values):
+        self.lru[key] = values
+        if len(self.lru) > self.size:
+            self.lru.popitem(last=False)
+            self.evictions += 1
+
+
+    def compute(self, coefs, dtype=None):
+        """ Compute the properties of a batch of compositions, as Estimator.compute """
+        A = np.asarray(coefs)
+        C = np.asarray(A, dtype=float)
+        if C.ndim == 1:
+            C = C.reshape(1, -1)
+        if C.ndim != 2 or C.shape[1] != len(self.estimator.names):
+            raise ValueError("The coefficient matrix must have {} columns".format(len(self.estimator.names)))
+        dtype = A.dtype if dtype is None else np.dtype(dtype)
+        tol = self.estimator.tolerance(C, dtype)
+        # Canonical key: the coefficients rounded, -0.0 being replaced by 0.0; the
+        # results of less precise coefficients, with another tolerance, have their own keys
+        tag = b"" if np.ndim(tol) == 0 else dtype.str.encode()
+        keys = [row.tobytes() + tag for row in np.round(C, 9) + 0.0]
+        out = np.empty((len(C), len(self.Columns)))
+        with self.lock:
+            miss = {}          # rows not found, by key
+            for i, key in enumerate(keys):
+                values = self.lru.get(key)
+                if values is None:
+                    miss.setdefault(key, []).append(i)
                 else:
-                    st += '</TABLE>'
-                    st += '<br><br>'
-                    st += 'In the case of non-stoichiometric samples, the existence of a '
-                    st += 'metastable equilibrium solubility (MSE) behavior has been <br>'
-                    st += 'evidenced at least in some cases, leading to a non-fixed value '
-                    st += 'of the solubility product.<br>'
-                    st += 'Therefore, in such cases, K<sub>sp</sub> was not calculated.'
-
-            dlg = resultDlg(self)
-            dlg.text.setText(st)
-            dlg.exec_()
-            if dlg.ok != True:
-                self.close()
-
-
-
-# - resultDlg class ------------------------------------------------------------
-
-class resultDlg(QtWidgets.QDialog):
-    def __init__(self, parent=None):
-        """ Result dialog.
-        """
-        super(resultDlg, self).__init__(parent)
-        self.setWindowTitle(appName)
-        self.ok = False
-        self.ini = True
-        self.text = QtWidgets.QTextEdit()
-        self.text.setReadOnly(True)
-        self.font = QtGui.QFont('Arial', 12)
-        self.text.setFont(self.font)
-        newCalcButton = QtWidgets.QPushButton("Back to chemical composition")
-        newCalcButton.setFont(self.font)
-        quitButton = QtWidgets.QPushButton("Quit")
-        quitButton.setFont(self.font)
-
-        # Set layout
-        mainvbox = QtWidgets.QVBoxLayout()
-        texthbox = QtWidgets.QHBoxLayout()
-        texthbox.addWidget(self.text)
-        mainvbox.addLayout(texthbox)
-        buttonhbox = QtWidgets.QHBoxLayout()
-        buttonhbox.addWidget(newCalcButton)
-        buttonhbox.addWidget(quitButton)
-        mainvbox.addLayout(buttonhbox)
-        self.setLayout(mainvbox)
-
-        self.text.textChanged.connect(self.onChanged)
-        newCalcButton.clicked.connect(self.onNewCalc)
-        quitButton.clicked.connect(self.onExit)
-
-
-    def onChanged(self):
-        if self.ini:
-            self.ini = False
-            self.fontMetrics = QtGui.QFontMetrics(self.font)
-            textSize = self.fontMetrics.size(0, self.text.toPlainText())
-            sampletxt = "-- Estimated DGfo:\t -10000 kJ.mol-1 ---"
-            mintextSize = self.fontMetrics.size(0, sampletxt)
-            if textSize.width() < mintextSize.width():
-                width = int(mintextSize.width())
-            else:
-                width = int(textSize.width())
-            w = width + 50
-            h = int(textSize.height() * 0.7)
-            self.text.setMinimumSize(w, h)
-            self.text.setMaximumSize(w, h)
-            self.text.resize(w, h)
+                    self.lru.move_to_end(key)
+                    out[i] = values
+                    self.hits += 1
+            if len(miss) and self.db is not None:
+                fp = self.estimator.fingerprint
+                sub = list(miss)
+                for k in range(0, len(sub), 500):
+                    sql = "SELECT coefs, {0} FROM results WHERE fingerprint = ? AND coefs IN ({1})".format(
+                          ", ".join(self.Columns), ", ".join("?" * len(sub[k:k + 500])))
+                    for row in self.db.execute(sql, [fp] + sub[k:k + 500]):
+                        key = bytes(row[0])
+                        values = tuple(np.nan if v is None else v for v in row[1:])
+                        rows = miss.pop(key)
+                        out[rows] = values
+                        self.store(key, values)
+                        self.diskhits += len(rows)
+            if len(miss):
+                sub = list(miss)
+                res = self.estimator.compute(C[[miss[key][0] for key in sub]], dtype)
+                values = np.column_stack([res[key] for key in self.Columns])
+                for key, v in zip(sub, values):
+                    out[miss[key]] = v
+                    self.store(key, tuple(v))
+                self.misses += sum(len(miss[key]) for key in sub)
+                if self.db is not None:
+                    fp = self.estimator.fingerprint
+                    rows = [(fp, key) + tuple(None if np.isnan(x) else float(x) for x in v)
+                            for key, v in zip(sub, values)]
+                    self.db.executemany("INSERT OR REPLACE INTO results VALUES ({})".format(
+                                        ", ".join("?" * (len(self.Columns) + 2))), rows)
+                    self.db.commit()
+        res = dict((key, out[:, j]) for j, key in enumerate(self.Columns))
+        res["valid"] = np.abs(res["charge"]) <= tol
+        return res
+
+
+def openDataBase(idx):
+    """ Load the elements and species of the database 'idx'
+
+    :param idx: index of the database in DBnames.
+    :return: True, a DataBaseError being raised if error.
+    """
+    global curDBidx, DBfingerprint
+    curDBidx = idx
+    dbfilnam = "SpeciesDB{}.txt".format(idx+1)
+    cache = loadCache()
+    if cache is not None and idx < len(cache["db_name"]):
+        setFromCache(cache, idx)
+        sha1 = [str(cache["sha1"][0]), str(cache["sha1"][idx+1])]
+    else:
+        loadElems(os.path.join(progpath, "ElemDB.txt"))
+        loadSpecies(os.path.join(progpath, dbfilnam))
+        initDataBase()
+        sha1 = [fileHash("ElemDB.txt"), fileHash(dbfilnam)]
+    DBfingerprint = dbFingerprint(sha1)
+    return True
 
 
-    def onExit(self, evt):
-        self.ok = False
-        self.close()
+# - ChargeBalancer class -----------------------------------------------------
 
-    def onNewCalc(self, evt):
-        self.ok = True
-        self.close()
+class ChargeBalancer(object):
+    """ Estimator balancing the charge of the compositions before computing
+
+        The compositions which are not electroneutral are balanced with
+        Estimator.balance; the results have the additional keys 'balanced'
+        (index of the species changed, -1 if none) and 'newcoef' (its new
+        coefficient). A ChargeBalancer is used like its Estimator.
+    """
+    def __init__(self, estimator, species, bounds=None):
+        """
+        :param estimator: the Estimator (or ResultCache) of the current database.
+        :param species: the names of the compensating species, in order of preference.
+        :param bounds: the (min, max) of their coefficients, (0, inf) by default.
+        """
+        self.estimator = estimator
+        self.species = list(species)
+        self.bounds = bounds
+        for nam in self.species:
+            if nam not in estimator.nameidx:
+                raise ValueError("Unknown species {}".format(nam))
+            if estimator.charge[estimator.index(nam)] == 0.0:
+                raise ValueError("{} has no charge and can't balance the compositions".format(nam))
+
+
+    def __getattr__(self, name):
+        if name == "estimator":
+            raise AttributeError(name)
+        return getattr(self.estimator, name)
+
+
+    def compute(self, coefs):
+        C, used, valid = self.estimator.balance(coefs, self.species, self.bounds)
+        res = self.estimator.compute(C)
+        res["balanced"] = used
+        idx = np.array([self.estimator.index(nam) for nam in self.species] + [0], dtype=int)
+        res["newcoef"] = C[np.arange(len(C)), idx[used]]
+        return res
+
+
+    def note(self, res, r):
+        """ Return the note of the row 'r' of the results 'res', e.g. 'OH-=1.5' """
+        j = res["balanced"][r]
+        if j < 0:
+            return ""
+        return "{0}={1:g}".format(self.species[j], res["newcoef"][r])
+
+
+def parseBalance(specs):
+    """ Parse the compensating species 'NAME' or 'NAME=MIN:MAX'
+
+    :return: a tuple (list of names, list of (min, max)).
+    """
+    names = []
+    bounds = []
+    for spec in specs:
+        if '=' in spec:
+            nam, lo, hi = parseRange(spec)
+        else:
+            nam, lo, hi = spec.strip(), 0.0, np.inf
+        names.append(nam)
+        bounds.append((lo, hi))
+    return names, bounds
+
+
+# - Database registry --------------------------------------------------------
+
+registry = None                          # The Registry of the process, see getRegistry()
+registryLock = _thread.allocate_lock()   # Lock of the loading of the registry
+
+
+class DataBase(object):
+    """ Read-only snapshot of a database
+
+        The tables of the species are the read-only arrays of its Estimator,
+        so that a DataBase can be shared by several threads.
+    """
+    def __init__(self, idx, name, title, elems, species, fingerprint):
+        """
+        :param idx: the index of the database in the registry.
+        :param name: the name of the database.
+        :param title: the title of the database.
+        :param elems: the list of Element.
+        :param species: the list of Specie, decomposed by addElem2Specie.
+        :param fingerprint: the fingerprint of the database files.
+        """
+        from types import MappingProxyType
+        estimator = Estimator(species, fingerprint)
+        for arr in (estimator.col, estimator.table, estimator.charge, estimator.g, estimator.s,
+                    estimator.Selem, estimator.DGaq, estimator.sigma):
+            arr.flags.writeable = False
+        data = {"idx": idx, "name": name, "title": title, "fingerprint": fingerprint,
+                "elems": tuple(elems), "species": tuple(species),
+                "elemIndex": MappingProxyType(dict((elem.name, elem) for elem in elems)),
+                "speciesIndex": MappingProxyType(dict((spec.name, i) for i, spec in enumerate(species))),
+                "estimator": estimator}
+        for key, value in data.items():
+            object.__setattr__(self, key, value)
+
+
+    def __setattr__(self, name, value):
+        raise AttributeError("The database {} is read-only".format(self.name))
+
+
+    def __repr__(self):
+        return "<DataBase {0}: {1} species>".format(self.name, len(self.species))
+
+
+class Registry(object):
+    """ All the databases, loaded once
+
+        A database is got by its index or its name (case insensitive),
+        without reading any file.
+    """
+    def __init__(self, databases=(), stamps=""):
+        """
+        :param databases: the list of DataBase.
+        :param stamps: the stamps of the database files (fileStamps) when they were read.
+        """
+        self.databases = tuple(databases)
+        self.byname = dict((db.name.lower(), db) for db in self.databases)
+        self.stamps = stamps
+
+
+    @classmethod
+    def load(cls):
+        """ Load all the databases found in progpath
+
+            The files are parsed in local lists, the module variables of
+            the current database (Species, curDBidx...) being unchanged.
+
+        :return: the Registry, a DataBaseError being raised if error.
+        """
+        files = dataFiles()
+        stamps = fileStamps(files)
+        cache = readCache(files, stamps)
+        databases = []
+        if cache is not None:
+            for i, (name, title) in enumerate(zip(cache["db_name"], cache["db_title"])):
+                elems, species = cacheDataBase(cache, i)
+                sha1 = [str(cache["sha1"][0]), str(cache["sha1"][i+1])]
+                databases.append(DataBase(i, str(name), str(title), elems, species, dbFingerprint(sha1)))
+            return cls(databases, stamps)
+        # Read the text files, which reports the errors
+        dbs = findDataBases()
+        elems = readElems(os.path.join(progpath, "ElemDB.txt"))
+        elemindex = dict((elem.name, elem) for elem in elems)
+        trie = buildTrie(elemindex)
+        for i, (name, title) in enumerate(dbs):
+            dbfilnam = "SpeciesDB{}.txt".format(i+1)
+            species = readSpecies(os.path.join(progpath, dbfilnam))
+            if len(elems):
+                decomposeSpecies(species, elemindex, trie)
+            sha1 = [fileHash("ElemDB.txt"), fileHash(dbfilnam)]
+            databases.append(DataBase(i, name, title, elems, species, dbFingerprint(sha1)))
+        return cls(databases, stamps)
+
+
+    def get(self, name):
+        """ Return the database 'name', a DataBaseError being raised if unknown """
+        db = self.byname.get(name.strip().lower())
+        if db is None:
+            raise DataBaseError("Unknown database {0}, available: {1}".format(name, ", ".join(self.names())))
+        return db
+
+
+    def names(self):
+        return [db.name for db in self.databases]
+
+
+    def __getitem__(self, idx):
+        return self.databases[idx]
+
+
+    def __iter__(self):
+        return iter(self.databases)
+
+
+    def __len__(self):
+        return len(self.databases)
+
+
+def getRegistry():
+    """ Return the Registry of the process, loading all the databases the first time
+
+    :return: the Registry, a DataBaseError being raised if error.
+    """
+    global registry
+    with registryLock:
+        if registry is None:
+            registry = Registry.load()
+    return registry
+
+
+def useDataBase(db):
+    """ Make the database 'db' the current one (curDB, curDBidx, Elems, Species...)
+
+        Elems and Species are copies of the records of the DataBase, which
+        can't be changed through them.
+
+    :param db: a DataBase of the registry.
+    :return: the DataBase.
+    """
+    import copy
+    global curDB, curDBidx, Elems, Species, DBfingerprint
+    curDB = db
+    curDBidx = db.idx
+    Elems = [copy.copy(elem) for elem in db.elems]
+    Species = [copy.copy(spec) for spec in db.species]
+    DBfingerprint = db.fingerprint
+    indexElems()
+    indexSpecies()
+    return db
+
+
+def checkDataBase(db):
+    """ Check the values of a database, a DataBaseError being raised if error """
+    if not len(db.species):
+        raise DataBaseError("No species in the database {}".format(db.name))
+    if len(db.speciesIndex) != len(db.species):
+        raise DataBaseError("Duplicated species in the database {}".format(db.name))
+    est = db.estimator
+    if not (np.all(np.isfinite(est.table)) and np.all(np.isfinite(est.sigma))):
+        raise DataBaseError("Values which are not finite in the database {}".format(db.name))
+
+
+def reloadRegistry():
+    """ Read again the database files and swap the registry if they are valid
+
+        The new databases are read and checked before replacing the registry,
+        which is a single assignment: the evaluations which have got a
+        DataBase or an Estimator go on with it. If a file is not valid, the
+        error is reported and the current registry is kept.
+
+    :return: the new Registry or None if it was not replaced.
+    """
+    global registry
+    try:
+        # Registry.load does not change the current database of the GUI
+        new = Registry.load()
+        for db in new:
+            checkDataBase(db)
+    except (DataBaseError, OSError) as err:
+        errorMessage("The databases are not reloaded: {}".format(err))
+        return None
+    with registryLock:
+        registry = new
+    return new
+
+
+# - Watcher class ------------------------------------------------------------
+
+class Watcher(object):
+    """ Reload the registry when the database files change
+
+        A thread waits for the changes of the directory of the files with
+        inotify (Linux), or polls their size and modification time every
+        'interval' seconds.
+    """
+    def __init__(self, interval=1.0, settle=0.2):
+        """
+        :param interval: the period (s) of the checks of the files.
+        :param settle: the time (s) the files must stay unchanged before reloading.
+        """
+        import threading
+        self.interval = interval
+        self.settle = settle
+        self.rejected = None       # stamps of files which failed to load
+        self.reloads = 0           # number of reloads of the registry
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="Watcher", daemon=True)
+
+
+    def start(self):
+        self.thread.start()
+        return self
+
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+    def check(self):
+        """ Reload the registry if the files have changed
+
+        :return: True if the registry was replaced.
+        """
+        import time
+        try:
+            stamps = fileStamps(dataFiles())
+        except OSError:
+            return False
+        if registry is not None and stamps == registry.stamps or stamps == self.rejected:
+            return False
+        # Wait for the end of the writing of the files
+        while True:
+            time.sleep(self.settle)
+            try:
+                new = fileStamps(dataFiles())
+            except OSError:
+                return False
+            if new == stamps:
+                break
+            stamps = new
+        if reloadRegistry() is None:
+            self.rejected = stamps
+            return False
+        self.reloads += 1
+        return True
+
+
+    def inotify(self):
+        """ Return an inotify file descriptor watching progpath, or -1 """
+        try:
+            import ctypes, ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK)
+        except (OSError, AttributeError, TypeError):
+            return -1
+        # IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        if fd >= 0 and libc.inotify_add_watch(fd, progpath.encode(), 0x8 | 0x80 | 0x100 | 0x200) < 0:
+            os.close(fd)
+            fd = -1
+        return fd
+
+
+    def run(self):
+        import select
+        fd = self.inotify()
+        try:
+            while not self.stopped.is_set():
+                if fd >= 0:
+                    if select.select([fd], [], [], self.interval)[0]:
+                        try:
+                            while os.read(fd, 65536):
+                                pass
+                        except BlockingIOError:
+                            pass
+                else:
+                    self.stopped.wait(self.interval)
+                if not self.stopped.is_set():
+                    self.check()
+        finally:
+            if fd >= 0:
+                os.close(fd)
+
+
+# - Audit log ----------------------------------------------------------------
+
+auditLog = None       # The AuditLog of the process, or None
+
+
+class AuditLog(object):
+    """ Append-only JSON Lines log of the computed estimates
+
+        record() only puts the arrays of a computation in a bounded queue;
+        a background thread formats the records, writes them by batches and
+        rotates the file when it exceeds 'maxsize' bytes (file.1, file.2...).
+        When the queue is full, record() waits for the writer, so that no
+        estimate is lost.
+
+        Each file begins, for every database used, with a record
+        {"type": "database", "db": fingerprint, "species": [names...],
+         "charge": [...], "g": [...], "s": [...], "Selem": [...], "DGaq": [...]}
+        giving the order of the coefficients of the following records and the
+        data of the species, so that the estimates can be computed again;
+        then come the records {"type": "estimate", "t": time, "src": source,
+        "db": fingerprint, "coefs": [...], "DGf": ..., ..., "charge": ...}.
+    """
+    def __init__(self, path, maxsize=100*1024*1024, backups=5, queuesize=1000, flushtime=1.0):
+        """
+        :param path: the name of the log file.
+        :param maxsize: the size (bytes) of the file triggering a rotation.
+        :param backups: the number of rotated files kept.
+        :param queuesize: the maximum number of computations waiting in the queue.
+        :param flushtime: the maximum delay (s) before the records are written.
+        """
+        import queue, threading
+        self.path = path
+        self.maxsize = maxsize
+        self.backups = backups
+        self.flushtime = flushtime
+        self.queue = queue.Queue(queuesize)
+        self.nrecord = 0          # number of estimates written
+        self.f = None
+        self.databases = set()    # fingerprints described in the current file
+        self.thread = threading.Thread(target=self.run, name="AuditLog", daemon=True)
+        self.thread.start()
+
+
+    def record(self, source, estimator, coefs, res, errors=None):
+        """ Log the results of a computation
+
+        :param source: what produced the estimates, e.g. "batch".
+        :param estimator: the Estimator which computed them.
+        :param coefs: the (N x M) array of coefficients.
+        :param res: the dict returned by Estimator.compute.
+        :param errors: the N error messages of the rows which could not be
+                       read, "" if none; these rows are not logged.
+        """
+        import time
+        C = np.array(coefs, dtype=float, ndmin=2)
+        values = np.column_stack([res[key] for key in Properties + ("charge",)])
+        if errors is not None:
+            keep = np.array([not err for err in errors], dtype=bool)
+            C, values = C[keep], values[keep]
+            if not len(C):
+                return
+        self.queue.put((time.time(), source, estimator.fingerprint, estimator.names,
+                        estimator.table, C, values))
+
+
+    def flush(self):
+        """ Wait until the records waiting in the queue are written """
+        if self.thread.is_alive():
+            self.queue.join()
+
+
+    def close(self):
+        """ Write the records waiting in the queue and close the file """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+
+    def openFile(self):
+        self.f = open(self.path, 'a')
+        self.databases = set()
+
+
+    def rotate(self):
+        self.f.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists("{0}.{1}".format(self.path, i)):
+                os.replace("{0}.{1}".format(self.path, i), "{0}.{1}".format(self.path, i+1))
+        if self.backups > 0:
+            os.replace(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+        self.openFile()
+
+
+    def format(self, item):
+        """ Return the JSON lines of a queued computation """
+        import json
+        t, source, fingerprint, names, table, C, values = item
+        out = []
+        if fingerprint not in self.databases:
+            self.databases.add(fingerprint)
+            db = {"type": "database", "db": fingerprint, "species": names}
+            for key, col in zip(("charge", "g", "s", "Selem", "DGaq"), table.T):
+                db[key] = col.tolist()
+            out.append(json.dumps(db) + '\n')
+        head = '{{"type": "estimate", "t": {0:.6f}, "src": {1}, "db": "{2}", "coefs": ['.format(
+               t, json.dumps(source), fingerprint)
+        fmt = head + ", ".join(["%.10g"] * C.shape[1]) + "], "
+        fmt += ", ".join('"{}": %.10g'.format(key) for key in Properties + ("charge",)) + "}\n"
+        for row in np.hstack([C, values]).tolist():
+            out.append((fmt % tuple(row)).replace("nan", "null"))
+        self.nrecord += len(C)
+        return "".join(out)
+
+
+    def run(self):
+        """ Write the queued records, by batches, until close() """
+        import queue
+        self.openFile()
+        done = False
+        while not done:
+            items = [self.queue.get()]
+            # Take all the records waiting, and those arriving meanwhile
+            try:
+                while len(items) < 1000:
+                    items.append(self.queue.get(timeout=self.flushtime if len(items) == 1 else 0))
+            except queue.Empty:
+                pass
+            if None in items:
+                done = True
+                items = [item for item in items if item is not None]
+            for item in items:
+                self.f.write(self.format(item))
+                if self.f.tell() > self.maxsize:
+                    self.rotate()
+            self.f.flush()
+            for i in range(len(items) + done):
+                self.queue.task_done()
+        self.f.close()
+
+
+def openAuditLog(path):
+    """ Log all the estimates computed by the process in the file 'path'
+
+    :param path: the name of the log file, None to stop logging.
+    """
+    import atexit
+    global auditLog
+    if auditLog is not None:
+        auditLog.close()
+        auditLog = None
+    if path:
+        auditLog = AuditLog(path)
+        atexit.register(auditLog.close)
+
+
+def audit(source, estimator, coefs, res, errors=None):
+    """ Log a computation in the audit log of the process, if any (see AuditLog.record) """
+    if auditLog is not None:
+        auditLog.record(source, estimator, coefs, res, errors)
+
+
+# - Instrumentation ----------------------------------------------------------
+
+instrument = None     # The Instrument of the process, or None
+
+
+class Instrument(object):
+    """ Timers and counters of the stages of a run
+
+        The functions of the stages are replaced by timed wrappers only when
+        the instrumentation is enabled, so that it costs nothing otherwise.
+    """
+    # Stage name: (module attribute or class, method name)
+    Stages = ("findDataBases", "readCache", "readElems", "readSpecies", "decomposeSpecies",
+              "cacheDataBase", "parseRows", "Estimator.compute", "Estimator.validate",
+              "Estimator.computeT", "ResultCache.compute", "computeChunk", "formatRows",
+              "computeLines")
+
+    def __init__(self):
+        import threading
+        self.timers = {}      # name: [number of calls, total time, maximum time]
+        self.counters = {}    # name: value
+        self.lock = threading.Lock()
+
+
+    def add(self, name, dt):
+        """ Add a duration 'dt' (s) to the timer 'name' """
+        with self.lock:
+            t = self.timers.setdefault(name, [0, 0.0, 0.0])
+            t[0] += 1
+            t[1] += dt
+            t[2] = max(t[2], dt)
+
+
+    def count(self, name, n=1):
+        """ Add 'n' to the counter 'name' """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+
+    def merge(self, summary):
+        """ Add the timers and counters of a summary, e.g. of a worker process """
+        with self.lock:
+            for name, t in summary["timers"].items():
+                cur = self.timers.setdefault(name, [0, 0.0, 0.0])
+                cur[0] += t["calls"]
+                cur[1] += t["total"]
+                cur[2] = max(cur[2], t["max"])
+            for name, v in summary["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + v
+
+
+    def reset(self):
+        """ Set all the timers and counters to 0 """
+        with self.lock:
+            self.timers.clear()
+            self.counters.clear()
+
+
+    def wrap(self, obj, attr, name=None):
+        """ Replace the function 'attr' of the module or class 'obj' by a timed one """
+        import time, functools
+        func = getattr(obj, attr)
+        if getattr(func, "timed", False):
+            return
+        name = name or attr
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            t = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - t)
+        timed.timed = True
+        setattr(obj, attr, timed)
+
+
+    def summary(self):
+        """ Return the timers and counters as a dict """
+        with self.lock:
+            timers = dict((name, {"calls": n, "total": total, "mean": total / n, "max": tmax})
+                          for name, (n, total, tmax) in self.timers.items())
+            return {"program": appName, "version": version, "pid": os.getpid(),
+                    "timers": timers, "counters": dict(self.counters)}
+
+
+    def toJSON(self):
+        import json
+        return json.dumps(self.summary(), indent=1) + '\n'
+
+
+    def toPrometheus(self):
+        """ Return the timers and counters in the Prometheus text format """
+        summary = self.summary()
+        lines = ["# HELP thermap_stage_seconds_total Time spent in the stage.",
+                 "# TYPE thermap_stage_seconds_total counter"]
+        lines += ['thermap_stage_seconds_total{{stage="{0}"}} {1:.9f}'.format(name, t["total"])
+                  for name, t in summary["timers"].items()]
+        lines += ["# HELP thermap_stage_calls_total Number of runs of the stage.",
+                  "# TYPE thermap_stage_calls_total counter"]
+        lines += ['thermap_stage_calls_total{{stage="{0}"}} {1}'.format(name, t["calls"])
+                  for name, t in summary["timers"].items()]
+        lines += ["# HELP thermap_stage_seconds_max Longest run of the stage.",
+                  "# TYPE thermap_stage_seconds_max gauge"]
+        lines += ['thermap_stage_seconds_max{{stage="{0}"}} {1:.9f}'.format(name, t["max"])
+                  for name, t in summary["timers"].items()]
+        for name, v in summary["counters"].items():
+            lines += ["# TYPE thermap_{}_total counter".format(name),
+                      "thermap_{0}_total {1}".format(name, v)]
+        return "\n".join(lines) + '\n'
+
+
+    def write(self, path):
+        """ Write the summary in 'path': Prometheus format if it ends with .prom,
+            else JSON; '-' for stderr.
+        """
+        if path == '-':
+            sys.stderr.write(self.toJSON())
+            return
+        text = self.toPrometheus() if path.endswith(".prom") else self.toJSON()
+        with open(path, 'w') as f:
+            f.write(text)
+
+
+def enableTimings(path=None):
+    """ Time the stages of the run and write the summary at exit
+
+    :param path: the file of the summary (see Instrument.write), or None.
+    :return: the Instrument.
+    """
+    import atexit
+    global instrument
+    if instrument is None:
+        instrument = Instrument()
+        module = sys.modules[__name__]
+        for stage in Instrument.Stages:
+            if '.' in stage:
+                cls, attr = stage.split('.')
+                instrument.wrap(getattr(module, cls), attr, stage)
+            else:
+                instrument.wrap(module, stage)
+    if path:
+        atexit.register(instrument.write, path)
+    return instrument
+
+
+def profileRun(path, func, *args):
+    """ Run func(*args) under cProfile and dump the statistics in 'path'
+
+    :return: the value returned by 'func'.
+    """
+    import cProfile
+    prof = cProfile.Profile()
+    try:
+        return prof.runcall(func, *args)
+    finally:
+        prof.dump_stats(path)
+
+
+# - Batch mode ---------------------------------------------------------------
+
+def formatValue(v):
+    """ Format a result for the batch output, NaN giving an empty field """
+    if np.isnan(v):
+        return ""
+    return "{:.2f}".format(v)
+
+
+def formatRows(A, sep, fmt="%.2f"):
+    """ Format the rows of the 2D array 'A', NaN giving empty fields
+
+    :return: the list of the formatted rows.
+    """
+    fmt = sep.join([fmt] * A.shape[1])
+    return [(fmt % tuple(row)).replace("nan", "") for row in A.tolist()]
+
+
+def parseRows(rows, cols, nfield, estimator):
+    """ Build the coefficient matrix of rows read from a composition file
+
+    :param rows: list of rows, each one a list of fields.
+    :param cols: list of (field index, species index) for the species columns.
+    :param nfield: the number of fields of the header.
+    :param estimator: the Estimator of the current database.
+    :return: a tuple (coefficient matrix, list of error messages, "" if no error).
+    """
+    C = np.zeros((len(rows), len(estimator.names)))
+    errors = [""] * len(rows)
+    for r, items in enumerate(rows):
+        if len(items) > nfield:
+            errors[r] = "Expected {0} fields, found {1}".format(nfield, len(items))
+            continue
+        for j, k in cols:
+            # Missing trailing fields are empty coefficients
+            item = items[j].strip() if j < len(items) else ""
+            if item == "":
+                continue
+            if IsNumber(item):
+                C[r, k] = float(item)
+            else:
+                errors[r] = "Bad format for {0}".format(estimator.names[k])
+                break
+    return C, errors
+
+
+def readHeader(fin):
+    """ Return the header of a composition file
+
+        The header is the first line which is not empty nor a comment ('#').
+
+    :param fin: the input text file.
+    :return: the header line, a ValueError being raised if not found.
+    """
+    for line in fin:
+        lin = line.strip()
+        if len(lin) and lin[0] != '#':
+            return line
+    raise ValueError("No header found in the composition file")
+
+
+def readLines(lines, chunksize):
+    """ Yield the lines of a file by chunks, the empty and comment lines excluded
+
+    :param lines: an iterable of text lines (header excluded).
+    :param chunksize: the number of lines of a chunk.
+    :return: a generator of lists of lines, without end of line.
+    """
+    chunk = []
+    for line in lines:
+        lin = line.rstrip("\r\n")
+        if len(lin.strip()) and lin.lstrip()[0] != '#':
+            chunk.append(lin)
+            if len(chunk) >= chunksize:
+                yield chunk
+                chunk = []
+    if len(chunk):
+        yield chunk
+
+
+def readRows(lines, sep, chunksize):
+    """ Split the lines of a composition file and yield them by chunks
+
+    :param lines: an iterable of text lines (header excluded).
+    :param sep: the field separator.
+    :param chunksize: the number of rows of a chunk.
+    :return: a generator of lists of rows (lists of fields).
+    """
+    for chunk in readLines(lines, chunksize):
+        yield [lin.split(sep) for lin in chunk]
+
+
+def computeChunk(rows, cols, extra, estimator):
+    """ Compute a chunk of rows read from a composition file
+
+    :param rows: list of rows, each one a list of fields.
+    :param cols: list of (field index, species index) for the species columns.
+    :param extra: list of the field indexes copied to the output.
+    :param estimator: the Estimator of the current database.
+    :return: the list of output rows (lists of strings).
+    """
+    C, errors = parseRows(rows, cols, len(cols) + len(extra), estimator)
+    res = estimator.compute(C)
+    audit("batch", estimator, C, res, errors)
+    balancer = estimator if isinstance(estimator, ChargeBalancer) else None
+    out = []
+    for r, items in enumerate(rows):
+        lin = [items[j] if j < len(items) else "" for j in extra]
+        if errors[r] == "" and not res["valid"][r]:
+            errors[r] = "Check the electroneutrality ! (charge = {:+g})".format(res["charge"][r])
+            if balancer is not None:
+                errors[r] = "Can't balance the charge (charge = {:+g})".format(res["charge"][r])
+        if errors[r]:
+            lin += [""] * len(Properties)
+        else:
+            lin += [formatValue(res[key][r]) for key in Properties]
+        if balancer is not None:
+            lin.append("" if errors[r] else balancer.note(res, r))
+        lin.append(errors[r])
+        out.append(lin)
+    return out
+
+
+def parseHeader(header, estimator):
+    """ Parse the header line of a composition file
+
+        The fields are separated by tabs if there is a tab in the header,
+        else by commas.
+
+    :param header: the header line.
+    :param estimator: the Estimator of the current database.
+    :return: a tuple (sep, cols, extra, outheader) where 'cols' lists the
+             (field index, species index) of the species columns, 'extra'
+             the field indexes copied to the output and 'outheader' is the
+             header line of the output.
+    """
+    header = header.rstrip("\r\n")
+    sep = '\t' if '\t' in header else ','
+    names = [item.strip() for item in header.split(sep)]
+    cols = []
+    extra = []
+    for j, nam in enumerate(names):
+        if nam in estimator.nameidx:
+            cols.append((j, estimator.index(nam)))
+        else:
+            extra.append(j)
+    if not len(cols):
+        raise ValueError("No column matches a species of the database")
+    balance = ["balance"] if isinstance(estimator, ChargeBalancer) else []
+    outheader = sep.join([names[j] for j in extra] + list(Properties) + balance + ["error"]) + '\n'
+    return sep, cols, extra, outheader
+
+
+def computeLines(lines, fout, layout, estimator, chunksize=10000):
+    """ Compute the composition lines and write the results in 'fout'
+
+    :param lines: an iterable of text lines (header excluded).
+    :param fout: the output text file.
+    :param layout: the tuple (sep, cols, extra) returned by parseHeader.
+    :param estimator: the Estimator of the current database.
+    :param chunksize: the number of rows computed at once.
+    :return: a tuple (number of rows, number of rows in error).
+    """
+    sep, cols, extra = layout
+    nrow = nerr = 0
+    for rows in readRows(lines, sep, chunksize):
+        out = computeChunk(rows, cols, extra, estimator)
+        fout.write("".join([sep.join(lin) + '\n' for lin in out]))
+        nrow += len(out)
+        nerr += sum(1 for lin in out if lin[-1])
+    return nrow, nerr
+
+
+def batchCompute(fin, fout, estimator, chunksize=10000):
+    """ Stream the compositions read in 'fin' and write the results in 'fout'
+
+        The first line which is not empty nor a comment ('#') is the header,
+        the names of its columns being the names of the species.
+        Unknown columns (e.g. sample names) are copied to the output.
+        Rows are read and computed 'chunksize' at a time.
+
+    :param fin: the input text file.
+    :param fout: the output text file.
+    :param estimator: the Estimator of the current database.
+    :param chunksize: the number of rows computed at once.
+    :return: a tuple (number of rows, number of rows in error).
+    """
+    header = readHeader(fin)
+    sep, cols, extra, outheader = parseHeader(header, estimator)
+    fout.write(outheader)
+    return computeLines(fin, fout, (sep, cols, extra), estimator, chunksize)
+
+
+# - Columnar export ----------------------------------------------------------
+
+ExportFormats = ("csv", "parquet", "arrow", "npy")
+
+
+def computeColumns(rows, cols, extra, names, estimator):
+    """ Compute a chunk of rows read from a composition file, by columns
+
+    :param rows: list of rows, each one a list of fields.
+    :param cols: list of (field index, species index) for the species columns.
+    :param extra: list of the field indexes copied to the output.
+    :param names: the names of the fields of the header.
+    :param estimator: the Estimator of the current database.
+    :return: a dict {column name: array}, the extra columns and 'error' being
+             arrays of strings, the properties float arrays (NaN if error).
+    """
+    C, errors = parseRows(rows, cols, len(cols) + len(extra), estimator)
+    res = estimator.compute(C)
+    audit("batch", estimator, C, res, errors)
+    balancer = estimator if isinstance(estimator, ChargeBalancer) else None
+    msg = "Check the electroneutrality ! (charge = {:+g})"
+    if balancer is not None:
+        msg = "Can't balance the charge (charge = {:+g})"
+    for r in np.nonzero(~res["valid"])[0]:
+        if errors[r] == "":
+            errors[r] = msg.format(res["charge"][r])
+    bad = np.array([err != "" for err in errors], dtype=bool)
+    out = {}
+    for j in extra:
+        out[names[j]] = np.array([items[j] if j < len(items) else "" for items in rows], dtype=str)
+    for key in Properties:
+        out[key] = np.where(bad, np.nan, res[key])
+    if balancer is not None:
+        out["balance"] = np.array(["" if bad[r] else balancer.note(res, r) for r in range(len(rows))],
+                                  dtype=str)
+    out["error"] = np.array(errors, dtype=str)
+    return out
+
+
+class CSVExport(object):
+    """ Export of the results in a CSV file
+
+        The metadata are written in comment lines ('#') before the header.
+    """
+    def __init__(self, path, columns, meta):
+        """
+        :param path: the file name, '-' for stdout.
+        :param columns: the list of the column names.
+        :param meta: a dict of metadata.
+        """
+        self.f = sys.stdout if path == '-' else open(path, 'w')
+        self.columns = columns
+        for key, value in meta.items():
+            self.f.write("# {0}: {1}\n".format(key, value))
+        self.f.write(",".join(columns) + '\n')
+
+
+    def write(self, chunk):
+        # The columns are the extra ones, the properties, 'balance' and 'error';
+        # repr gives the shortest text read back as the same double
+        values = formatRows(np.column_stack([chunk[key] for key in Properties]), ",", "%r")
+        texts = [[self.quote(item) for item in chunk[key].tolist()]
+                 for key in self.columns if key not in Properties]
+        out = []
+        nextra = self.columns.index(Properties[0])
+        for r, lin in enumerate(values):
+            items = [text[r] for text in texts]
+            items.insert(nextra, lin)
+            out.append(",".join(items) + '\n')
+        self.f.write("".join(out))
+
+
+    def quote(self, item):
+        if ',' in item or '"' in item or '\n' in item:
+            return '"{}"'.format(item.replace('"', '""'))
+        return item
+
+
+    def close(self):
+        if self.f is not sys.stdout:
+            self.f.close()
+
+
+class ArrowExport(object):
+    """ Export of the results in a Parquet or Arrow IPC file (pyarrow)
+
+        Each chunk is written as a row group (record batch), the metadata
+        being those of the schema.
+    """
+    def __init__(self, path, columns, meta, parquet=True):
+        import pyarrow
+        fields = [pyarrow.field(key, pyarrow.float64() if key in Properties else pyarrow.string())
+                  for key in columns]
+        self.schema = pyarrow.schema(fields, metadata=dict((k, str(v)) for k, v in meta.items()))
+        if parquet:
+            import pyarrow.parquet
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        else:
+            import pyarrow.ipc
+            self.writer = pyarrow.ipc.new_file(path, self.schema)
+
+
+    def write(self, chunk):
+        import pyarrow
+        arrays = []
+        for field in self.schema:
+            if field.name in Properties:
+                values = chunk[field.name]
+                arrays.append(pyarrow.array(values, mask=np.isnan(values)))
+            else:
+                arrays.append(pyarrow.array(chunk[field.name].tolist(), pyarrow.string()))
+        batch = pyarrow.RecordBatch.from_arrays(arrays, schema=self.schema)
+        if hasattr(self.writer, "write_batch"):
+            self.writer.write_batch(batch)
+        else:
+            self.writer.write(batch)
+
+
+    def close(self):
+        self.writer.close()
+
+
+class NpyExport(object):
+    """ Export of the results in a directory of column files, without pyarrow
+
+        The properties are written in .npy files (float64, NaN if not
+        computed) which are completed chunk by chunk, the text columns
+        in .txt files (one value per line), the metadata in metadata.json.
+    """
+    HeaderSize = 128         # Size of the header of the .npy files
+
+    def __init__(self, path, columns, meta):
+        import json
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.files = {}
+        self.nrow = 0
+        for key in columns:
+            if key in Properties:
+                f = open(os.path.join(path, key + ".npy"), 'wb')
+                f.write(self.header(0))
+            else:
+                f = open(os.path.join(path, key + ".txt"), 'w', encoding="utf-8")
+            self.files[key] = f
+        meta = dict(meta, columns=columns)
+        with open(os.path.join(path, "metadata.json"), 'w') as f:
+            json.dump(meta, f, indent=1)
+
+
+    def header(self, nrow):
+        """ Return the header of a .npy file of 'nrow' float64, padded to HeaderSize """
+        d = "{{'descr': '<f8', 'fortran_order': False, 'shape': ({},), }}".format(nrow)
+        n = self.HeaderSize - 10
+        return b"\x93NUMPY\x01\x00" + n.to_bytes(2, "little") + d.ljust(n - 1).encode() + b"\n"
+
+
+    def write(self, chunk):
+        for key, f in self.files.items():
+            if key in Properties:
+                f.write(np.ascontiguousarray(chunk[key], dtype='<f8').tobytes())
+            else:
+                f.write("".join(item.replace("\n", " ") + '\n' for item in chunk[key].tolist()))
+        self.nrow += len(chunk["error"])
+
+
+    def close(self):
+        for key, f in self.files.items():
+            if key in Properties:
+                # The number of rows is known at the end
+                f.seek(0)
+                f.write(self.header(self.nrow))
+            f.close()
+
+
+def openExport(path, fmt, columns, meta):
+    """ Open an export of the results
+
+    :param path: the file (directory for npy) name.
+    :param fmt: a format of ExportFormats; parquet and arrow fall back to
+                npy if pyarrow is not installed.
+    :param columns: the list of the column names.
+    :param meta: a dict of metadata.
+    :return: the export object, with the methods write(chunk) and close().
+    """
+    if fmt == "csv":
+        return CSVExport(path, columns, meta)
+    if fmt in ("parquet", "arrow"):
+        if importlib.util.find_spec("pyarrow") is not None:
+            return ArrowExport(path, columns, meta, fmt == "parquet")
+        errorMessage("pyarrow is not installed, the columns are written in the directory {}".format(path))
+    return NpyExport(path, columns, meta)
+
+
+def exportBatch(fin, path, fmt, estimator, dbname="", chunksize=100000):
+    """ Compute the compositions read in 'fin' and export the results by columns
+
+        The file is read as by batchCompute and the results are written
+        'chunksize' rows at a time (a row group for Parquet).
+
+    :param fin: the input text file.
+    :param path: the output file or directory.
+    :param fmt: a format of ExportFormats.
+    :param estimator: the Estimator of the current database.
+    :param dbname: the name of the database, for the metadata.
+    :param chunksize: the number of rows computed at once.
+    :return: a tuple (number of rows, number of rows in error).
+    """
+    header = readHeader(fin)
+    sep, cols, extra, outheader = parseHeader(header, estimator)
+    names = [item.strip() for item in header.rstrip("\r\n").split(sep)]
+    columns = [names[j] for j in extra] + list(Properties)
+    if isinstance(estimator, ChargeBalancer):
+        columns.append("balance")
+    columns.append("error")
+    meta = {"program": appName, "version": version, "database": dbname,
+            "fingerprint": estimator.fingerprint}
+    nrow = nerr = 0
+    out = openExport(path, fmt, columns, meta)
+    try:
+        for rows in readRows(fin, sep, chunksize):
+            chunk = computeColumns(rows, cols, extra, names, estimator)
+            out.write(chunk)
+            nrow += len(rows)
+            nerr += int(np.count_nonzero(chunk["error"] != ""))
+    finally:
+        out.close()
+    return nrow, nerr
+
+
+# - Binary mode --------------------------------------------------------------
+
+def openCompositions(path, estimator):
+    """ Open a binary file of compositions without reading it in memory
+
+        The file is a .npy file, either a structured array whose fields are
+        named after the species, or a 2D array whose columns are named in
+        the text file 'path.species' (one name per line). Without this file,
+        the columns must be all the species of the database, in its order.
+
+    :param path: the name of the .npy file.
+    :param estimator: the Estimator of the current database.
+    :return: a tuple (memory-mapped array, species index of each column).
+    """
+    A = np.load(path, mmap_mode='r')
+    if A.dtype.names is not None:
+        names = list(A.dtype.names)
+        if A.ndim != 1 or any(A.dtype[nam].kind not in "fiu" for nam in names):
+            raise ValueError("The fields of {} must be numbers".format(path))
+    else:
+        if A.ndim != 2 or A.dtype.kind not in "fiu":
+            raise ValueError("{} must be a 2D array of numbers".format(path))
+        if os.path.exists(path + ".species"):
+            with open(path + ".species") as f:
+                names = [lin.strip() for lin in f if lin.strip()]
+        elif A.shape[1] == len(estimator.names):
+            names = list(estimator.names)
+        else:
+            raise ValueError("{0} has {1} columns but the database {2} species, "
+                             "name them in {3}.species".format(path, A.shape[1],
+                                                                len(estimator.names), path))
+        if len(names) != A.shape[1]:
+            raise ValueError("{0} columns are named in {1}.species, {2} are expected".format(
+                             len(names), path, A.shape[1]))
+    unknown = [nam for nam in names if nam not in estimator.nameidx]
+    if unknown:
+        raise ValueError("Unknown species {}".format(", ".join(unknown)))
+    if len(set(names)) != len(names):
+        raise ValueError("Duplicated species in {}".format(path))
+    return A, np.array([estimator.index(nam) for nam in names], dtype=int)
+
+
+def binaryCompute(path, outpath, estimator, window=100000):
+    """ Compute a binary file of compositions by windows of rows
+
+        Only one window of the input is in memory at a time. The results
+        are written in the memory-mapped .npy file 'outpath', a structured
+        array of the same number of rows, with the fields of 'Properties'
+        and 'charge' (NaN if not electroneutral).
+
+    :param path: the name of the .npy file of compositions (see openCompositions).
+    :param outpath: the name of the .npy file of the results.
+    :param estimator: the Estimator of the current database.
+    :param window: the number of rows computed at once.
+    :return: a tuple (number of rows, number of rows which are not electroneutral).
+    """
+    A, idx = openCompositions(path, estimator)
+    N = len(A)
+    keys = Properties + ("charge",)
+    out = np.lib.format.open_memmap(outpath, mode='w+', shape=(N,),
+                                    dtype=[(key, '<f8') for key in keys])
+    # The columns are the species of the database in its order
+    same = np.array_equal(idx, np.arange(len(estimator.names)))
+    # The fields are stacked in double precision, the tolerance of the
+    # electroneutrality following the least precise one
+    dtype = A.dtype
+    if A.dtype.names is not None:
+        floats = [A.dtype[nam] for nam in A.dtype.names if A.dtype[nam].kind == 'f']
+        dtype = max(floats, key=lambda t: np.finfo(t).eps) if len(floats) else np.dtype(float)
+    nbad = 0
+    for start in range(0, N, window):
+        W = A[start:start + window]
+        if A.dtype.names is not None:
+            W = np.column_stack([W[nam] for nam in A.dtype.names])
+        if same:
+            C = W
+        else:
+            C = np.zeros((len(W), len(estimator.names)), dtype=W.dtype)
+            C[:, idx] = W
+        res = estimator.compute(C, dtype)
+        audit("binary", estimator, C, res)
+        for key in keys:
+            out[key][start:start + window] = res[key]
+        nbad += len(C) - int(np.count_nonzero(res["valid"]))
+    out.flush()
+    del out
+    return N, nbad
+
+
+# - Sparse mode --------------------------------------------------------------
+
+def parseSparse(lines, estimator):
+    """ Parse lines of compositions in sparse form
+
+        Each line is '[ID<tab>]NAME:COEF NAME:COEF ...', only the species
+        of the composition being given.
+
+    :param lines: a list of text lines (without comments).
+    :param estimator: the Estimator of the current database.
+    :return: a tuple (ids, (indptr, indices, data), errors).
+    """
+    ids = []
+    errors = []
+    indptr = [0]
+    indices = []
+    data = []
+    for line in lines:
+        lin = line.rstrip("\r\n")
+        if '\t' in lin:
+            ident, lin = lin.split('\t', 1)
+        else:
+            ident = ""
+        ids.append(ident)
+        err = ""
+        row = []
+        for item in lin.split():
+            nam, sep, coef = item.rpartition(':')
+            if nam not in estimator.nameidx:
+                err = "Unknown species {}".format(nam or item)
+                break
+            if not IsNumber(coef):
+                err = "Bad format for {}".format(nam)
+                break
+            row.append((estimator.index(nam), float(coef)))
+        if err == "":
+            for k, coef in row:
+                indices.append(k)
+                data.append(coef)
+        errors.append(err)
+        indptr.append(len(indices))
+    return ids, (indptr, indices, data), errors
+
+
+def formatSparse(coefs, names):
+    """ Write a composition in sparse form, as read by parseSparse
+
+    :param coefs: the coefficients of the species.
+    :param names: the names of the species.
+    :return: the text 'NAME:COEF NAME:COEF ...' of the non-zero coefficients.
+    """
+    return " ".join("{0}:{1:g}".format(names[k], coefs[k]) for k in np.flatnonzero(coefs))
+
+
+def sparseCompute(fin, fout, estimator, chunksize=10000):
+    """ Stream the sparse compositions read in 'fin' and write the results in 'fout'
+
+        The output is a TSV file with the columns ID, the properties and error.
+
+    :param fin: the input text file (see parseSparse).
+    :param fout: the output text file.
+    :param estimator: the Estimator of the current database.
+    :param chunksize: the number of rows computed at once.
+    :return: a tuple (number of rows, number of rows in error).
+    """
+    fout.write("\t".join(["id"] + list(Properties) + ["error"]) + '\n')
+    nrow = nerr = 0
+
+    def flush(lines):
+        ids, csr, errors = parseSparse(lines, estimator)
+        res = estimator.computeSparse(csr)
+        values = formatRows(np.column_stack([res[key] for key in Properties]), '\t')
+        empty = '\t' * (len(Properties) - 1)
+        out = []
+        for r, ident in enumerate(ids):
+            if errors[r] == "" and not res["valid"][r]:
+                errors[r] = "Check the electroneutrality ! (charge = {:+g})".format(res["charge"][r])
+            out.append("{0}\t{1}\t{2}\n".format(ident, empty if errors[r] else values[r], errors[r]))
+        fout.write("".join(out))
+        return sum(1 for err in errors if err)
+
+    for lines in readLines(fin, chunksize):
+        nerr += flush(lines)
+        nrow += len(lines)
+    return nrow, nerr
+
+
+# - Parallel batch mode ------------------------------------------------------
+
+workerState = {}      # Data sent once to each worker of the process pool
+
+
+def initWorker(estimator, path, layout, chunksize, tmpdir, auditpath=None, timings=False):
+    """ Initialize a worker process of the pool
+
+        The Estimator is pickled once per worker, not once per shard.
+        Each worker has its own audit log, 'auditpath.PID'.
+        With 'timings', the worker has its own Instrument, whose summary is
+        sent back with each shard.
+    """
+    global auditLog
+    # The writer thread of the parent is not copied in the worker
+    auditLog = None
+    if auditpath:
+        openAuditLog("{0}.{1}".format(auditpath, os.getpid()))
+    if timings:
+        # A forked worker starts with a copy of the timers of the parent
+        enableTimings().reset()
+    workerState["estimator"] = estimator
+    workerState["path"] = path
+    workerState["layout"] = layout
+    workerState["chunksize"] = chunksize
+    workerState["tmpdir"] = tmpdir
+
+
+def shardLines(f, start, end):
+    """ Yield the decoded lines of the binary file 'f' in [start, end[ """
+    f.seek(start)
+    pos = start
+    while pos < end:
+        line = f.readline()
+        if not line:
+            break
+        pos += len(line)
+        yield line.decode("utf-8")
+
+
+def computeShard(shard):
+    """ Compute a shard of the composition file in a worker process
+
+    :param shard: a tuple (shard number, start offset, end offset).
+    :return: a tuple (shard file name, number of rows, number of rows in error,
+             summary of the Instrument of the worker for the shard or None).
+    """
+    n, start, end = shard
+    tmpnam = os.path.join(workerState["tmpdir"], "shard{}.txt".format(n))
+    with open(workerState["path"], 'rb') as fin, open(tmpnam, 'w') as fout:
+        nrow, nerr = computeLines(shardLines(fin, start, end), fout, workerState["layout"],
+                                  workerState["estimator"], workerState["chunksize"])
+    # The workers are terminated without running atexit
+    if auditLog is not None:
+        auditLog.flush()
+    summary = None
+    if instrument is not None:
+        summary = instrument.summary()
+        instrument.reset()
+    return tmpnam, nrow, nerr, summary
+
+
+def splitFile(path, start, nshard):
+    """ Split a file in shards of about the same size, starting at line boundaries
+
+    :param path: the file name.
+    :param start: offset of the first line to split.
+    :param nshard: the number of shards.
+    :return: the list of (start offset, end offset).
+    """
+    size = os.path.getsize(path)
+    bounds = [start]
+    with open(path, 'rb') as f:
+        for i in range(1, nshard):
+            pos = start + (size - start) * i // nshard
+            if pos <= bounds[-1]:
+                continue
+            f.seek(pos - 1)
+            f.readline()          # go to the beginning of the next line
+            pos = f.tell()
+            if pos > bounds[-1] and pos < size:
+                bounds.append(pos)
+    bounds.append(size)
+    return [(bounds[i], bounds[i+1]) for i in range(len(bounds) - 1)]
+
+
+def parallelBatch(path, fout, estimator, workers=0, chunksize=10000, nshard=0):
+    """ Compute a composition file with a pool of processes
+
+        The file is split in shards which are computed by the workers,
+        each one writing its results in a temporary file.
+        These files are then appended to 'fout' in the order of the shards,
+        and the timers of the workers are added to those of the process.
+
+    :param path: the name of the composition file.
+    :param fout: the output text file.
+    :param estimator: the Estimator of the current database.
+    :param workers: the number of processes (0 = number of CPUs).
+    :param chunksize: the number of rows computed at once by a worker.
+    :param nshard: the number of shards (0 = 4 per worker).
+    :return: a tuple (number of rows, number of rows in error).
+    """
+    import multiprocessing, tempfile, shutil
+    if workers <= 0:
+        workers = multiprocessing.cpu_count()
+    if nshard <= 0:
+        nshard = 4 * workers
+    header = None
+    start = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            start += len(line)
+            lin = line.decode("utf-8").strip()
+            if len(lin) and lin[0] != '#':
+                header = line.decode("utf-8")
+                break
+    if header is None:
+        raise ValueError("No header found in the composition file")
+    sep, cols, extra, outheader = parseHeader(header, estimator)
+    fout.write(outheader)
+    shards = splitFile(path, start, nshard)
+
+    nrow = nerr = 0
+    tmpdir = tempfile.mkdtemp(prefix="thermap")
+    try:
+        auditpath = auditLog.path if auditLog is not None else None
+        initargs = (estimator, path, (sep, cols, extra), chunksize, tmpdir, auditpath,
+                    instrument is not None)
+        pool = multiprocessing.Pool(workers, initWorker, initargs)
+        try:
+            tasks = [(n, s, e) for n, (s, e) in enumerate(shards)]
+            # imap returns the results in the order of the shards
+            for tmpnam, n, e, summary in pool.imap(computeShard, tasks):
+                with open(tmpnam) as f:
+                    shutil.copyfileobj(f, fout)
+                os.remove(tmpnam)
+                nrow += n
+                nerr += e
+                if summary is not None and instrument is not None:
+                    instrument.merge(summary)
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return nrow, nerr
+
+
+# - Screening mode -----------------------------------------------------------
+
+def gridValues(vmin, vmax, step):
+    """ Return the values of the grid vmin, vmin+step, ..., up to vmax """
+    import math
+    if vmax < vmin or step <= 0:
+        raise ValueError("Bad grid {0}:{1}:{2}".format(vmin, vmax, step))
+    # No value beyond vmax, the rounding errors of the division aside
+    n = int(math.floor((vmax - vmin) / step + 1e-9))
+    return [round(vmin + i * step, 10) for i in range(n + 1)]
+
+
+def enumerateSite(grids, total=None):
+    """ Enumerate the coefficients of the species of a site
+
+    :param grids: the list of the grid values of each species of the site.
+    :param total: the sum of the coefficients, or None if free.
+    :return: a generator of tuples of coefficients.
+    """
+    lo = [min(g) for g in grids]
+    hi = [max(g) for g in grids]
+    # Bounds of the sum of the remaining species, used to prune the search
+    remlo = [sum(lo[i:]) for i in range(len(grids) + 1)]
+    remhi = [sum(hi[i:]) for i in range(len(grids) + 1)]
+    eps = 1e-9
+
+    def walk(i, acc, coefs):
+        if i == len(grids):
+            yield tuple(coefs)
+            return
+        for v in grids[i]:
+            if total is not None:
+                if acc + v + remlo[i+1] > total + eps:
+                    break
+                if acc + v + remhi[i+1] < total - eps:
+                    continue
+            coefs.append(v)
+            for t in walk(i + 1, acc + v, coefs):
+                yield t
+            coefs.pop()
+
+    for g in grids:
+        g.sort()
+    return walk(0, 0.0, [])
+
+
+def screenBlocks(estimator, grids, totals, chunksize=100000):
+    """ Generate the candidate compositions by blocks
+
+        The compositions of each site (species of the same 'col') are
+        enumerated separately and read 'chunksize' at a time; the blocks
+        are made of the combinations of all the sites, built by
+        broadcasting, so that the whole enumeration is never stored.
+
+    :param estimator: the Estimator of the current database.
+    :param grids: a dict {species name: list of values}.
+    :param totals: a dict {col: sum of the coefficients of the site}.
+    :param chunksize: the approximate number of rows of a block.
+    :return: a generator of (n x M) coefficient arrays.
+    """
+    import itertools
+    M = len(estimator.names)
+    sites = []          # (species indexes, total) of each site
+    for col in sorted(set(estimator.col[estimator.index(nam)] for nam in grids) | set(totals)):
+        idx = [estimator.index(nam) for nam in grids if estimator.col[estimator.index(nam)] == col]
+        if not len(idx):
+            raise ValueError("No species given for the site of column {}".format(col))
+        sites.append((idx, totals.get(col)))
+
+    def siteCoefs(site):
+        idx, total = site
+        return enumerateSite([list(grids[estimator.names[k]]) for k in idx], total)
+
+    def blocks(site):
+        coefs = siteCoefs(site)
+        while True:
+            batch = list(itertools.islice(coefs, chunksize))
+            if not len(batch):
+                break
+            A = np.zeros((len(batch), M))
+            A[:, site[0]] = batch
+            yield A
+
+    def rows(j, row):
+        # Combinations of the outer sites, one coefficient vector at a time
+        if j == len(outer):
+            yield row
+            return
+        for coefs in siteCoefs(outer[j]):
+            nxt = row.copy()
+            nxt[outer[j][0]] = coefs
+            for t in rows(j + 1, nxt):
+                yield t
+
+    for site in sites:
+        if next(siteCoefs(site), None) is None:
+            col = estimator.col[site[0][0]]
+            raise ValueError("No composition of the site of column {} fits its total".format(col))
+    inner = sites[-1]
+    outer = sites[:-1]
+    # A small inner site is kept in memory, a large one is enumerated again for each outer row
+    first = next(blocks(inner))
+    inners = [first] if len(first) < chunksize else None
+    nout = max(1, chunksize // len(first))
+    combos = rows(0, np.zeros(M))
+    while True:
+        batch = list(itertools.islice(combos, nout))
+        if not len(batch):
+            break
+        O = np.array(batch)
+        for B in inners if inners is not None else blocks(inner):
+            yield (O[:, None, :] + B[None, :, :]).reshape(-1, M)
+
+
+def screenCompositions(estimator, grids, totals, prop="DGf", top=10, largest=False,
+                       chunksize=100000):
+    """ Screen the compositions and keep the 'top' best ones
+
+        Only the electroneutral compositions are computed. The best ones
+        are kept in a heap of size 'top'.
+
+    :param estimator: the Estimator of the current database.
+    :param grids: a dict {species name: list of values}.
+    :param totals: a dict {col: sum of the coefficients of the site}.
+    :param prop: the property used to rank the compositions (in Properties).
+    :param top: the number of compositions kept.
+    :param largest: True to keep the largest values, else the lowest.
+    :param chunksize: the approximate number of rows computed at once.
+    :return: a tuple (best, stats), 'best' being the list of (value, coef
+             vector) sorted from the best, 'stats' a dict with the number of
+             enumerated and electroneutral compositions.
+    """
+    import heapq, itertools
+    if prop not in Properties:
+        raise ValueError("Unknown property {}".format(prop))
+    heap = []          # (key, seq, coefs), heap[0] being the worst kept
+    seq = itertools.count()
+    stats = {"enumerated": 0, "electroneutral": 0}
+    for C in screenBlocks(estimator, grids, totals, chunksize):
+        stats["enumerated"] += len(C)
+        C = C[np.abs(C @ estimator.charge) <= EPSCHARGE]
+        stats["electroneutral"] += len(C)
+        if not len(C):
+            continue
+        vals = estimator.compute(C)[prop]
+        keys = vals if largest else -vals
+        sel = np.flatnonzero(~np.isnan(keys))
+        if len(heap) == top:
+            sel = sel[keys[sel] > heap[0][0]]
+        if len(sel) > top:
+            sel = sel[np.argpartition(keys[sel], -top)[-top:]]
+        for i in sel:
+            item = (keys[i], next(seq), C[i].copy())
+            if len(heap) < top:
+                heapq.heappush(heap, item)
+            elif item[0] > heap[0][0]:
+                heapq.heappushpop(heap, item)
+    best = [(key if largest else -key, coefs) for key, n, coefs in sorted(heap, reverse=True)]
+    return best, stats
+
+
+def parseGrid(spec, step):
+    """ Parse a species grid 'NAME=VALUE' or 'NAME=MIN:MAX[:STEP]'
+
+    :return: a tuple (name, list of values).
+    """
+    if '=' not in spec:
+        raise ValueError("Bad species grid {}, expected NAME=MIN:MAX".format(spec))
+    nam, rng = spec.rsplit('=', 1)
+    items = rng.split(':')
+    if len(items) > 3 or not all(IsNumber(item) for item in items):
+        raise ValueError("Bad species grid {}, expected NAME=MIN:MAX".format(spec))
+    vals = [float(item) for item in items]
+    if len(vals) == 1:
+        return nam.strip(), vals
+    if len(vals) == 3:
+        step = vals[2]
+    return nam.strip(), gridValues(vals[0], vals[1], step)
+
+
+# - Inverse design -----------------------------------------------------------
+
+def simplex(c, A_ub, b_ub, A_eq, b_eq, lb, ub):
+    """ Minimize c.x with A_ub.x <= b_ub, A_eq.x = b_eq and lb <= x <= ub
+
+        Dense two-phase simplex, with the Bland rule to avoid cycling.
+        It is only used when scipy is not installed.
+
+    :return: x or None if the problem is infeasible or unbounded.
+    """
+    eps = 1e-9
+    n = len(c)
+    lb = np.asarray(lb, dtype=float)
+    # x = lb + y, y >= 0; the finite upper bounds are added as inequalities
+    fin = np.flatnonzero(np.isfinite(ub))
+    Aub = np.vstack([A_ub.reshape(-1, n), np.eye(n)[fin]])
+    bub = np.concatenate([b_ub - A_ub.reshape(-1, n) @ lb, np.asarray(ub, dtype=float)[fin] - lb[fin]])
+    Aeq = A_eq.reshape(-1, n)
+    beq = b_eq - Aeq @ lb
+    nub = len(Aub)
+    m = nub + len(Aeq)
+    A = np.zeros((m, n + nub))
+    A[:nub, :n] = Aub
+    A[:nub, n:] = np.eye(nub)
+    A[nub:, :n] = Aeq
+    b = np.concatenate([bub, beq])
+    neg = b < 0
+    A[neg] *= -1
+    b[neg] *= -1
+    ncol = n + nub
+    # Tableau with an artificial variable for each row, the last row being the costs
+    T = np.zeros((m + 1, ncol + m + 1))
+    T[:m, :ncol] = A
+    T[:m, ncol:ncol + m] = np.eye(m)
+    T[:m, -1] = b
+    T[-1, :ncol] = -A.sum(axis=0)
+    T[-1, -1] = -b.sum()
+    basis = list(range(ncol, ncol + m))
+
+    def solve(nenter):
+        while True:
+            cols = np.flatnonzero(T[-1, :nenter] < -eps)
+            if not len(cols):
+                return True
+            j = cols[0]
+            col = T[:m, j]
+            pos = np.flatnonzero(col > eps)
+            if not len(pos):
+                return False
+            ratios = T[pos, -1] / col[pos]
+            rows = pos[ratios <= ratios.min() + eps]
+            r = min(rows, key=lambda i: basis[i])
+            T[r] /= T[r, j]
+            for i in range(m + 1):
+                if i != r and T[i, j] != 0.0:
+                    T[i] -= T[i, j] * T[r]
+            basis[r] = j
+
+    solve(ncol)
+    if T[-1, -1] < -1e-7 * max(1.0, np.abs(b).max()):
+        return None
+    # Drive the artificial variables out of the basis
+    for r in range(m):
+        if basis[r] >= ncol:
+            nz = np.flatnonzero(np.abs(T[r, :ncol]) > eps)
+            if len(nz):
+                j = nz[0]
+                T[r] /= T[r, j]
+                for i in range(m + 1):
+                    if i != r:
+                        T[i] -= T[i, j] * T[r]
+                basis[r] = j
+    cost = np.zeros(ncol + m)
+    cost[:n] = c
+    T[-1, :] = 0.0
+    T[-1, :ncol + m] = cost
+    for r in range(m):
+        T[-1] -= cost[basis[r]] * T[r]
+    if not solve(ncol):
+        return None
+    y = np.zeros(ncol + m)
+    for r in range(m):
+        y[basis[r]] = T[r, -1]
+    return lb + y[:n]
+
+
+def solveLP(c, A_ub, b_ub, A_eq, b_eq, lb, ub):
+    """ Minimize c.x with A_ub.x <= b_ub, A_eq.x = b_eq and lb <= x <= ub
+
+        scipy.optimize.linprog is used if scipy is installed, else simplex().
+
+    :return: x or None if the problem is infeasible or unbounded.
+    """
+    try:
+        from scipy.optimize import linprog
+    except ImportError:
+        return simplex(c, A_ub, b_ub, A_eq, b_eq, lb, ub)
+    bounds = [(l, None if np.isinf(u) else u) for l, u in zip(lb, ub)]
+    res = linprog(c, A_ub=A_ub if len(A_ub) else None, b_ub=b_ub if len(b_ub) else None,
+                  A_eq=A_eq, b_eq=b_eq, bounds=bounds, method="highs")
+    if res.status != 0:
+        return None
+    return res.x
+
+
+class DesignProblem(object):
+    """ Linear program of the compositions fitting a window of properties
+
+        All the properties are linear in the coefficients, so are the
+        electroneutrality, the bounds of the coefficients and the sums of
+        the coefficients of each site (species of the same 'col').
+    """
+    def __init__(self, estimator, bounds, totals=None, targets=None):
+        """
+        :param estimator: the Estimator of the current database.
+        :param bounds: a dict {species name: (min, max)}, the other species being absent.
+        :param totals: a dict {col: (min, max)} of the sums of the coefficients of the sites.
+        :param targets: a dict {property: (min, max)}, the bounds may be infinite.
+        """
+        self.estimator = estimator
+        self.names = list(bounds)
+        self.idx = [estimator.index(nam) for nam in self.names]
+        self.lb = np.array([bounds[nam][0] for nam in self.names], dtype=float)
+        self.ub = np.array([bounds[nam][1] for nam in self.names], dtype=float)
+        self.rows = []            # A_ub rows and b_ub
+        self.rhs = []
+        totals = totals or {}
+        targets = targets or {}
+        for col, (lo, hi) in totals.items():
+            a = (estimator.col[self.idx] == col).astype(float)
+            if not a.any():
+                raise ValueError("No species given for the site of column {}".format(col))
+            self.addWindow(a, lo, hi)
+        for prop, (lo, hi) in targets.items():
+            self.addWindow(self.form(prop), lo, hi)
+
+
+    def form(self, prop):
+        """ Return the linear form of 'prop' on the variables of the problem """
+        if prop == "pKsp":
+            if not self.estimator.aqdata:
+                raise ValueError("The database gives no DG(aq), pKsp can't be computed")
+            # Ksp is only defined without H+
+            if "H+" in self.names:
+                self.ub[self.names.index("H+")] = 0.0
+        return self.estimator.linearForm(prop)[self.idx]
+
+
+    def addWindow(self, a, lo, hi):
+        """ Add the constraint lo <= a.x <= hi """
+        if hi < np.inf:
+            self.rows.append(a)
+            self.rhs.append(hi)
+        if lo > -np.inf:
+            self.rows.append(-a)
+            self.rhs.append(-lo)
+
+
+    def solve(self, prop=None, largest=False, extra=()):
+        """ Find a composition, optimizing 'prop' if given
+
+        :param prop: the property to optimize, or None for any feasible composition.
+        :param largest: True to maximize 'prop', else it is minimized.
+        :param extra: additional constraints (a, lo, hi).
+        :return: the M-array of coefficients or None if infeasible.
+        """
+        c = np.zeros(len(self.names))
+        if prop is not None:
+            c = self.form(prop) * (-1.0 if largest else 1.0)
+        rows = list(self.rows)
+        rhs = list(self.rhs)
+        for a, lo, hi in extra:
+            if hi < np.inf:
+                rows.append(a)
+                rhs.append(hi)
+            if lo > -np.inf:
+                rows.append(-a)
+                rhs.append(-lo)
+        n = len(self.names)
+        A_ub = np.array(rows, dtype=float).reshape(-1, n)
+        b_ub = np.array(rhs, dtype=float)
+        A_eq = self.estimator.charge[self.idx].reshape(1, n)
+        x = solveLP(c, A_ub, b_ub, A_eq, np.zeros(1), self.lb, self.ub)
+        if x is None:
+            return None
+        coefs = np.zeros(len(self.estimator.names))
+        coefs[self.idx] = np.round(x, 9) + 0.0
+        return coefs
+
+
+    def pareto(self, prop1, largest1, prop2, largest2, npoint=10):
+        """ Return compositions of the Pareto front of two properties
+
+            The front is sampled by the epsilon-constraint method: 'prop1' is
+            optimized with 'prop2' bounded, for 'npoint' bounds in its range.
+
+        :return: the list of coefficient arrays, sorted by 'prop2'.
+        """
+        a2 = self.form(prop2)
+        x1 = self.solve(prop2, False)
+        x2 = self.solve(prop2, True)
+        if x1 is None or x2 is None:
+            return []
+        lo = a2 @ x1[self.idx]
+        hi = a2 @ x2[self.idx]
+        front = []
+        seen = set()
+        for e in np.linspace(lo, hi, npoint):
+            if largest2:
+                x = self.solve(prop1, largest1, [(a2, e, np.inf)])
+            else:
+                x = self.solve(prop1, largest1, [(a2, -np.inf, e)])
+            if x is not None and x.tobytes() not in seen:
+                seen.add(x.tobytes())
+                front.append(x)
+        return front
+
+
+def parseRange(spec):
+    """ Parse 'NAME=VALUE' or 'NAME=MIN:MAX', MIN or MAX may be empty
+
+    :return: a tuple (name, min, max).
+    """
+    if '=' not in spec:
+        raise ValueError("Bad range {}, expected NAME=MIN:MAX".format(spec))
+    nam, rng = spec.rsplit('=', 1)
+    items = rng.split(':')
+    if len(items) == 1 and IsNumber(items[0]):
+        return nam.strip(), float(items[0]), float(items[0])
+    if len(items) != 2 or not all(item.strip() == "" or IsNumber(item) for item in items):
+        raise ValueError("Bad range {}, expected NAME=MIN:MAX".format(spec))
+    lo = float(items[0]) if items[0].strip() else -np.inf
+    hi = float(items[1]) if items[1].strip() else np.inf
+    return nam.strip(), lo, hi
+
+
+# - Monte Carlo mode ---------------------------------------------------------
+
+def sampleProperties(estimator, C, G, S, D):
+    """ Compute the properties for parameter samples
+
+    :param estimator: the Estimator of the current database.
+    :param C: the (N x M) coefficient matrix.
+    :param G, S, D: the (K x M) samples of g, s and DGaq.
+    :return: a dict of (N x K) arrays with the keys of 'Properties'.
+    """
+    Sg = C @ G.T
+    Ss = C @ S.T
+    DS = Ss - (C @ estimator.Selem)[:, None]
+    res = {"DGf": Sg / 1000.0, "DHf": (Sg + T0 * DS) / 1000.0, "DSf": DS, "So": Ss,
+           "pKsp": (C @ D.T - Sg) / (LN10 * R * T0)}
+    return res
+
+
+def propertyStd(estimator, C):
+    """ Return the standard deviations of the properties due to the uncertainties
+
+        The properties being linear in g, s and DGaq, these are exact for
+        independent uncertainties.
+
+    :return: a dict of N-arrays with the keys of 'Properties'.
+    """
+    C2 = C * C
+    vg = C2 @ estimator.sigma[:, 0] ** 2
+    vs = C2 @ estimator.sigma[:, 1] ** 2
+    vd = C2 @ estimator.sigma[:, 2] ** 2
+    return {"DGf": np.sqrt(vg) / 1000.0, "DHf": np.sqrt(vg + T0 * T0 * vs) / 1000.0,
+            "DSf": np.sqrt(vs), "So": np.sqrt(vs), "pKsp": np.sqrt(vd + vg) / (LN10 * R * T0)}
+
+
+def monteCarlo(estimator, coefs, nsample=1000, seed=0, quantiles=(0.025, 0.5, 0.975),
+               block=1000, nbins=1000, chunksize=1000):
+    """ Propagate the uncertainties of g, s and DGaq by Monte Carlo
+
+        The parameters are drawn from normal distributions, by blocks of
+        'block' samples, block k using the seed (seed, k), so that the
+        results do not depend on the compositions computed together.
+        Mean and standard deviation are accumulated with the Welford
+        (Chan) update. The quantiles are read on a histogram of 'nbins' bins
+        per composition covering +/- 8 standard deviations.
+
+        The compositions are computed by chunks of 'chunksize' rows, the
+        memory used being proportional to chunksize * max(block, nbins),
+        whatever the number of compositions.
+
+    :param estimator: the Estimator of the current database.
+    :param coefs: the (N x M) coefficient matrix.
+    :param nsample: the number of samples.
+    :param seed: the seed of the random generator.
+    :param quantiles: the probabilities of the quantiles.
+    :param block: the number of samples computed at once.
+    :param nbins: the number of bins of the histograms.
+    :param chunksize: the number of compositions computed at once.
+    :return: a dict {property: {"mean": N-array, "std": N-array, "q": (N x nq) array}},
+             NaN for the compositions which can't be computed.
+    """
+    C = np.asarray(coefs, dtype=float)
+    if C.ndim == 1:
+        C = C.reshape(1, -1)
+    N = len(C)
+    res = {key: {"mean": np.empty(N), "std": np.empty(N), "q": np.empty((N, len(quantiles)))}
+           for key in Properties}
+    for start in range(0, N, chunksize):
+        part = monteCarloRows(estimator, C[start:start + chunksize], nsample, seed, quantiles, block, nbins)
+        for key in Properties:
+            for nam, values in part[key].items():
+                res[key][nam][start:start + chunksize] = values
+    return res
+
+
+def monteCarloRows(estimator, C, nsample, seed, quantiles, block, nbins):
+    """ Monte Carlo of a chunk of compositions, see monteCarlo
+
+    :param C: the (N x M) coefficient matrix.
+    :return: the dict of monteCarlo.
+    """
+    N = len(C)
+    nominal = estimator.compute(C)
+    sd = propertyStd(estimator, C)
+    stats = {}
+    for key in Properties:
+        mask = np.isnan(nominal[key])
+        center = np.where(mask, 0.0, nominal[key])
+        width = 16.0 * sd[key] / nbins
+        width = np.where(width > 0, width, 1e-12 * np.maximum(1.0, np.abs(center)))
+        stats[key] = {"mask": mask, "lo": center - 8.0 * sd[key], "width": width,
+                      "n": 0, "mean": np.zeros(N), "M2": np.zeros(N),
+                      "hist": np.zeros((N, nbins + 2), dtype=np.int64)}
+    offsets = (np.arange(N) * (nbins + 2))[:, None]
+    for k, start in enumerate(range(0, nsample, block)):
+        K = min(block, nsample - start)
+        rng = np.random.default_rng([seed, k])
+        G = estimator.g + estimator.sigma[:, 0] * rng.standard_normal((K, len(estimator.g)))
+        S = estimator.s + estimator.sigma[:, 1] * rng.standard_normal((K, len(estimator.g)))
+        D = estimator.DGaq + estimator.sigma[:, 2] * rng.standard_normal((K, len(estimator.g)))
+        samples = sampleProperties(estimator, C, G, S, D)
+        for key in Properties:
+            st = stats[key]
+            X = np.where(st["mask"][:, None], 0.0, samples[key])
+            bmean = X.mean(axis=1)
+            bM2 = ((X - bmean[:, None]) ** 2).sum(axis=1)
+            n = st["n"] + K
+            delta = bmean - st["mean"]
+            st["mean"] += delta * K / n
+            st["M2"] += bM2 + delta * delta * st["n"] * K / n
+            st["n"] = n
+            # Bin 0 and nbins+1 count the samples out of the range
+            b = np.floor((X - st["lo"][:, None]) / st["width"][:, None]) + 1
+            b = np.clip(b, 0, nbins + 1).astype(np.int64)
+            st["hist"] += np.bincount((b + offsets).ravel(), minlength=N * (nbins + 2)).reshape(N, nbins + 2)
+    res = {}
+    for key in Properties:
+        st = stats[key]
+        cum = np.cumsum(st["hist"], axis=1)
+        q = np.zeros((N, len(quantiles)))
+        for j, p in enumerate(quantiles):
+            target = p * st["n"]
+            b = np.argmax(cum >= target, axis=1)
+            prev = np.where(b > 0, cum[np.arange(N), b - 1], 0)
+            count = st["hist"][np.arange(N), b]
+            frac = np.where(count > 0, (target - prev) / np.maximum(count, 1), 0.0)
+            pos = np.clip(b - 1 + frac, 0, nbins)
+            q[:, j] = st["lo"] + pos * st["width"]
+        mean = np.where(st["mask"], np.nan, st["mean"])
+        std = np.where(st["mask"], np.nan, np.sqrt(st["M2"] / max(st["n"] - 1, 1)))
+        q[st["mask"]] = np.nan
+        res[key] = {"mean": mean, "std": std, "q": q}
+    return res
+
+
+def openFiles(input, output=None):
+    """ Open the input and output files of a command, '-' being stdin and stdout
+
+    :param input: the name of the input file.
+    :param output: the name of the output file, None if there is none.
+    :return: the input file and the output file (None if there is none).
+    :raise OSError: if a file can't be opened, the files already opened being closed.
+    """
+    fin = sys.stdin if input == '-' else open(input)
+    try:
+        fout = None if output is None else sys.stdout if output == '-' else open(output, 'w')
+    except OSError:
+        if fin is not sys.stdin:
+            fin.close()
+        raise
+    return fin, fout
+
+
+def openOutput(path):
+    """ Open the output file 'path' for a 'with' statement, '-' being stdout, which is not closed """
+    import contextlib
+    if path == '-':
+        return contextlib.nullcontext(sys.stdout)
+    return open(path, 'w')
+
+
+def loadEstimator(dbname):
+    """ Return the Estimator of the database 'dbname' of the registry
+
+    :param dbname: the database name, e.g. "Apatite".
+    :return: the Estimator, a DataBaseError being raised if error.
+    """
+    return useDataBase(getRegistry().get(dbname)).estimator
+
+
+def runBatch(args):
+    """ Run the 'batch' command
+
+    :param args: the parsed command line arguments.
+    :return: the exit status.
+    """
+    estimator = loadEstimator(args.db)
+    if args.cache > 0 or args.cachedb:
+        estimator = ResultCache(estimator, args.cache, args.cachedb)
+    if args.balance:
+        try:
+            estimator = ChargeBalancer(estimator, *parseBalance(args.balance))
+        except ValueError as err:
+            errorMessage(str(err))
+            return 1
+    try:
+        fin, fout = openFiles(args.input, args.output)
+    except OSError as err:
+        errorMessage(str(err))
+        return 1
+    try:
+        if args.workers != 1 and fin is not sys.stdin:
+            fin.close()
+            nrow, nerr = parallelBatch(args.input, fout, estimator, args.workers, args.chunksize)
+        else:
+            nrow, nerr = batchCompute(fin, fout, estimator, args.chunksize)
+    except (IOError, ValueError) as err:
+        errorMessage(str(err))
+        return 1
+    finally:
+        if fin is not sys.stdin:
+            fin.close()
+        if fout is not sys.stdout:
+            fout.close()
+    if nerr:
+        errorMessage("{0} of {1} rows in error".format(nerr, nrow))
+    if hasattr(estimator, "stats") and args.workers == 1:
+        errorMessage("cache: {hits} hits, {diskhits} disk hits, {misses} misses, "
+                     "{evictions} evictions".format(**estimator.stats()))
+    return 0
+
+
+def runExport(args):
+    """ Run the 'export' command
+
+    :param args: the parsed command line arguments.
+    :return: the exit status.
+    """
+    fmt = args.format
+    if fmt is None:
+        ext = os.path.splitext(args.output)[1].lstrip('.').lower()
+        fmt = ext if ext in ExportFormats else "csv" if args.output == '-' else "npy"
+    if args.output == '-' and fmt != "csv":
+        errorMessage("The {} format can't be written on stdout".format(fmt))
+        return 1
+    db = getRegistry().get(args.db)
+    estimator = db.estimator
+    if args.cache > 0 or args.cachedb:
+        estimator = ResultCache(estimator, args.cache, args.cachedb)
+    if args.balance:
+        try:
+            estimator = ChargeBalancer(estimator, *parseBalance(args.balance))
+        except ValueError as err:
+            errorMessage(str(err))
+            return 1
+    try:
+        fin, fout = openFiles(args.input)
+    except OSError as err:
+        errorMessage(str(err))
+        return 1
+    try:
+        nrow, nerr = exportBatch(fin, args.output, fmt, estimator, db.name, args.chunksize)
+    except (IOError, ValueError) as err:
+        errorMessage(str(err))
+        return 1
+    finally:
+        if fin is not sys.stdin:
+            fin.close()
+    if nerr:
+        errorMessage("{0} of {1} rows in error".format(nerr, nrow))
+    return 0
+
+
+def runBinary(args):
+    """ Run the 'binary' command
+
+    :param args: the parsed command line arguments.
+    :return: the exit status.
+    """
+    estimator = loadEstimator(args.db)
+    try:
+        nrow, nbad = binaryCompute(args.input, args.output, estimator, args.window)
+    except (IOError, ValueError) as err:
+        errorMessage(str(err))
+        return 1
+    if nbad:
+        errorMessage("{0} of {1} rows are not electroneutral".format(nbad, nrow))
+    return 0
+
+
+def runSparse(args):
+    """ Run the 'sparse' command
+
+    :param args: the parsed command line arguments.
+    :return: the exit status.
+    """
+    estimator = loadEstimator(args.db)
+    try:
+        fin, fout = openFiles(args.input, args.output)
+    except OSError as err:
+        errorMessage(str(err))
+        return 1
+    try:
+        nrow, nerr = sparseCompute(fin, fout, estimator, args.chunksize)
+    except (IOError, ValueError) as err:
+        errorMessage(str(err))
+        return 1
+    finally:
+        if fin is not sys.stdin:
+            fin.close()
+        if fout is not sys.stdout:
+            fout.close()
+    if nerr:
+        errorMessage("{0} of {1} rows in error".format(nerr, nrow))
+    return 0
+
+
+def runScreen(args):
+    """ Run the 'screen' command
+
+    :param args: the parsed command line arguments.
+    :return: the exit status.
+    """
+    estimator = loadEstimator(args.db)
+    try:
+        grids = {}
+        for spec in args.species:
+            nam, vals = parseGrid(spec, args.step)
+            if nam not in estimator.nameidx:
+                raise ValueError("Unknown species {}".format(nam))
+            grids[nam] = vals
+        totals = {}
+        for spec in args.site or []:
+            col, total = spec.split('=')
+            totals[int(col)] = float(total)
+        best, stats = screenCompositions(estimator, grids, totals, args.by, args.top,
+                                         args.largest, args.chunksize)
+    except ValueError as err:
+        errorMessage(str(err))
+        return 1
+    names = list(grids)
+    idx = [estimator.index(nam) for nam in names]
+    try:
+        output = openOutput(args.output)
+    except OSError as err:
+        errorMessage(str(err))
+        return 1
+    with output as fout:
+        fout.write("\t".join(names + list(Properties)) + '\n')
+        if len(best):
+            res = estimator.compute(np.array([coefs for val, coefs in best]))
+            for r, (val, coefs) in enumerate(best):
+                lin = ["{:g}".format(coefs[k]) for k in idx]
+                lin += [formatValue(res[key][r]) for key in Properties]
+                fout.write("\t".join(lin) + '\n')
+    sys.stderr.write("{0}: {1} compositions enumerated, {2} electroneutral\n".format(
+        appName, stats["enumerated"], stats["electroneutral"]))
+    return 0
+
+
+def runDesign(args):
+    """ Run the 'design' command
+
+    :param args: the parsed command line arguments.
+    :return: the exit status.
+    """
+    estimator = loadEstimator(args.db)
+    objectives = [(prop, False) for prop in args.min or []] + [(prop, True) for prop in args.max or []]
+    try:
+        if len(objectives) > 2:
+            raise ValueError("At most two properties can be optimized")
+        bounds = {}
+        for spec in args.species:
+            nam, lo, hi = parseRange(spec)
+            if nam not in estimator.nameidx:
+                raise ValueError("Unknown species {}".format(nam))
+            bounds[nam] = (max(lo, 0.0), hi)
+        totals = {}
+        for spec in args.site or []:
+            col, lo, hi = parseRange(spec)
+            totals[int(col)] = (lo, hi)
+        targets = {}
+        for spec in args.target or []:
+            prop, lo, hi = parseRange(spec)
+            if prop not in Properties:
+                raise ValueError("Unknown property {}".format(prop))
+            targets[prop] = (lo, hi)
+        problem = DesignProblem(estimator, bounds, totals, targets)
+        if len(objectives) == 2:
+            (prop1, largest1), (prop2, largest2) = objectives
+            sols = problem.pareto(prop1, largest1, prop2, largest2, args.points)
+        else:
+            prop, largest = objectives[0] if len(objectives) else (None, False)
+            x = problem.solve(prop, largest)
+            sols = [] if x is None else [x]
+    except ValueError as err:
+        errorMessage(str(err))
+        return 1
+    if not len(sols):
+        errorMessage("No composition fits the constraints")
+        return 1
+    names = list(bounds)
+    idx = [estimator.index(nam) for nam in names]
+    try:
+        output = openOutput(args.output)
+    except OSError as err:
+        errorMessage(str(err))
+        return 1
+    with output as fout:
+        fout.write("\t".join(names + list(Properties)) + '\n')
+        res = estimator.compute(np.array(sols))
+        for r, coefs in enumerate(sols):
+            lin = ["{:g}".format(coefs[k]) for k in idx]
+            lin += [formatValue(res[key][r]) for key in Properties]
+            fout.write("\t".join(lin) + '\n')
+    return 0
+
+
+def runMonteCarlo(args):
+    """ Run the 'montecarlo' command
+
+    :param args: the parsed command line arguments.
+    :return: the exit status.
+    """
+    estimator = loadEstimator(args.db)
+    if not estimator.sigma.any():
+        errorMessage("The database gives no uncertainties")
+    try:
+        quantiles = [float(q) for q in args.quantiles.split(',')]
+    except ValueError:
+        errorMessage("Bad quantiles {}".format(args.quantiles))
+        return 1
+    try:
+        fin, fout = openFiles(args.input, args.output)
+    except OSError as err:
+        errorMessage(str(err))
+        return 1
+    try:
+        header = readHeader(fin)
+        sep, cols, extra, outheader = parseHeader(header, estimator)
+        names = [item.strip() for item in header.rstrip("\r\n").split(sep)]
+        outnames = [names[j] for j in extra]
+        for key in Properties:
+            outnames += [key + "_mean", key + "_std"] + ["{0}_q{1:g}".format(key, q) for q in quantiles]
+        fout.write(sep.join(outnames + ["error"]) + '\n')
+        for rows in readRows(fin, sep, args.chunksize):
+            C, errors = parseRows(rows, cols, len(cols) + len(extra), estimator)
+            res = monteCarlo(estimator, C, args.samples, args.seed, quantiles, args.block, args.bins,
+                             args.chunksize)
+            valid = estimator.compute(C)["valid"]
+            out = []
+            for r, items in enumerate(rows):
+                lin = [items[j] if j < len(items) else "" for j in extra]
+                if errors[r] == "" and not valid[r]:
+                    errors[r] = "Check the electroneutrality !"
+                for key in Properties:
+                    vals = [res[key]["mean"][r], res[key]["std"][r]] + list(res[key]["q"][r])
+                    lin += [""] * len(vals) if errors[r] else [formatValue(v) for v in vals]
+                lin.append(errors[r])
+                out.append(sep.join(lin) + '\n')
+            fout.write("".join(out))
+    except (IOError, ValueError) as err:
+        errorMessage(str(err))
+        return 1
+    finally:
+        if fin is not sys.stdin:
+            fin.close()
+        if fout is not sys.stdout:
+            fout.close()
+    return 0
+
+
+def parseTemperatures(spec):
+    """ Parse a list of temperatures 'T1,T2,...' or a grid 'MIN:MAX:STEP' (K)
+
+    :return: the list of temperatures, a ValueError being raised if one is not positive.
+    """
+    items = spec.split(':')
+    if len(items) == 3 and all(IsNumber(item) for item in items):
+        temps = gridValues(float(items[0]), float(items[1]), float(items[2]))
+    else:
+        items = spec.split(',')
+        if not all(IsNumber(item) for item in items):
+            raise ValueError("Bad temperatures {}".format(spec))
+        temps = [float(item) for item in items]
+    if min(temps) <= 0.0:
+        raise ValueError("The temperatures must be positive, got {}".format(spec))
+    return temps
+
+
+def runTemperature(args):
+    """ Run the 'temperature' command
+
+    :param args: the parsed command line arguments.
+    :return: the exit status.
+    """
+    estimator = loadEstimator(args.db)
+    try:
+        fin, fout = openFiles(args.input, args.output)
+    except OSError as err:
+        errorMessage(str(err))
+        return 1
+    try:
+        temps = args.temps
+        header = readHeader(fin)
+        sep, cols, extra, outheader = parseHeader(header, estimator)
+        names = [item.strip() for item in header.rstrip("\r\n").split(sep)]
+        outnames = [names[j] for j in extra]
+        outnames += ["DGf_{:g}".format(T) for T in temps]
+        outnames += ["logKsp_{:g}".format(T) for T in temps]
+        fout.write(sep.join(outnames + ["error"]) + '\n')
+        for rows in readRows(fin, sep, args.chunksize):
+            C, errors = parseRows(rows, cols, len(cols) + len(extra), estimator)
+            res = estimator.computeT(C, temps)
+            values = formatRows(np.hstack([res["DGf"], res["logKsp"]]), sep)
+            empty = sep * (2 * len(temps) - 1)
+            out = []
+            for r, items in enumerate(rows):
+                lin = [items[j] if j < len(items) else "" for j in extra]
+                if errors[r] == "" and not res["valid"][r]:
+                    errors[r] = "Check the electroneutrality !"
+                lin.append(empty if errors[r] else values[r])
+                lin.append(errors[r])
+                out.append(sep.join(lin) + '\n')
+            fout.write("".join(out))
+    except (IOError, ValueError) as err:
+        errorMessage(str(err))
+        return 1
+    finally:
+        if fin is not sys.stdin:
+            fin.close()
+        if fout is not sys.stdout:
+            fout.close()
+    return 0
+
+
+def runServe(args):
+    """ Run the 'serve' command
+
+    :param args: the parsed command line arguments.
+    :return: the exit status.
+    """
+    import ThermAPserver
+    return ThermAPserver.serve(args.host, args.port, args.poll)
+
+
+def runCommand(argv):
+    """ Run ThermAP from the command line, without GUI
+
+    :param argv: the command line arguments (without the program name).
+    :return: the exit status.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog=appName, description="{} command line".format(appName))
+    parser.add_argument("--audit", default=os.environ.get("THERMAP_AUDIT"),
+                        help="JSON Lines file logging all the estimates ($THERMAP_AUDIT)")
+    parser.add_argument("--timings", default=os.environ.get("THERMAP_TIMINGS"),
+                        help="file of the times of the stages, .prom for Prometheus, "
+                             "'-' for stderr ($THERMAP_TIMINGS)")
+    parser.add_argument("--profile", default=os.environ.get("THERMAP_PROFILE"),
+                        help="cProfile statistics file of the run ($THERMAP_PROFILE)")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+    p = subparsers.add_parser("batch", help="compute a file of compositions")
+    p.add_argument("input", help="TSV or CSV file of compositions, '-' for stdin")
+    p.add_argument("--db", required=True, help="database name, e.g. Apatite")
+    p.add_argument("-o", "--output", default='-', help="output file, stdout by default")
+    p.add_argument("--chunksize", type=int, default=10000, help="number of rows computed at once")
+    p.add_argument("--workers", type=int, default=1, help="number of processes, 0 for all the CPUs")
+    p.add_argument("--cache", type=int, default=0, help="number of results kept in memory")
+    p.add_argument("--cachedb", help="SQLite file where the results are kept")
+    p.add_argument("--balance", action="append",
+                   help="species balancing the charge, NAME or NAME=MIN:MAX, tried in order")
+    p.set_defaults(func=runBatch)
+    p = subparsers.add_parser("export", help="compute a file of compositions and export the results by columns")
+    p.add_argument("input", help="TSV or CSV file of compositions, '-' for stdin")
+    p.add_argument("--db", required=True, help="database name, e.g. Apatite")
+    p.add_argument("-o", "--output", required=True, help="output file (directory for npy), '-' for CSV on stdout")
+    p.add_argument("--format", choices=ExportFormats,
+                   help="output format, from the extension of the output by default")
+    p.add_argument("--chunksize", type=int, default=100000, help="number of rows computed and written at once")
+    p.add_argument("--cache", type=int, default=0, help="number of results kept in memory")
+    p.add_argument("--cachedb", help="SQLite file where the results are kept")
+    p.add_argument("--balance", action="append",
+                   help="species balancing the charge, NAME or NAME=MIN:MAX, tried in order")
+    p.set_defaults(func=runExport)
+    p = subparsers.add_parser("binary", help="compute a .npy file of compositions")
+    p.add_argument("input", help=".npy file of compositions, the columns named in INPUT.species")
+    p.add_argument("--db", required=True, help="database name, e.g. Apatite")
+    p.add_argument("-o", "--output", required=True, help=".npy file of the results")
+    p.add_argument("--window", type=int, default=100000, help="number of rows computed at once")
+    p.set_defaults(func=runBinary)
+    p = subparsers.add_parser("sparse", help="compute a file of compositions in sparse form")
+    p.add_argument("input", help="file of lines [ID<tab>]NAME:COEF NAME:COEF ..., '-' for stdin")
+    p.add_argument("--db", required=True, help="database name, e.g. Apatite")
+    p.add_argument("-o", "--output", default='-', help="output file, stdout by default")
+    p.add_argument("--chunksize", type=int, default=10000, help="number of rows computed at once")
+    p.set_defaults(func=runSparse)
+    p = subparsers.add_parser("screen", help="screen substituted compositions")
+    p.add_argument("species", nargs='+', help="species grid NAME=VALUE or NAME=MIN:MAX[:STEP]")
+    p.add_argument("--db", required=True, help="database name, e.g. Apatite")
+    p.add_argument("--site", action="append", help="total of the coefficients of a column, COL=TOTAL")
+    p.add_argument("--step", type=float, default=0.1, help="default step of the grids")
+    p.add_argument("--by", default="DGf", choices=Properties, help="property used to rank")
+    p.add_argument("--largest", action="store_true", help="keep the largest values instead of the lowest")
+    p.add_argument("--top", type=int, default=10, help="number of compositions kept")
+    p.add_argument("-o", "--output", default='-', help="output file, stdout by default")
+    p.add_argument("--chunksize", type=int, default=100000, help="number of rows computed at once")
+    p.set_defaults(func=runScreen)
+    p = subparsers.add_parser("design", help="find compositions fitting a window of properties")
+    p.add_argument("species", nargs='+', help="species bounds NAME=VALUE or NAME=MIN:MAX")
+    p.add_argument("--db", required=True, help="database name, e.g. Apatite")
+    p.add_argument("--site", action="append", help="bounds of the sum of the coefficients of a column, COL=MIN:MAX")
+    p.add_argument("--target", action="append", help="window of a property, PROP=MIN:MAX")
+    p.add_argument("--min", action="append", choices=Properties, help="property to minimize")
+    p.add_argument("--max", action="append", choices=Properties, help="property to maximize")
+    p.add_argument("--points", type=int, default=10, help="number of points of a Pareto front")
+    p.add_argument("-o", "--output", default='-', help="output file, stdout by default")
+    p.set_defaults(func=runDesign)
+    p = subparsers.add_parser("montecarlo", help="propagate the uncertainties of the database")
+    p.add_argument("input", help="TSV or CSV file of compositions, '-' for stdin")
+    p.add_argument("--db", required=True, help="database name, e.g. Apatite")
+    p.add_argument("-o", "--output", default='-', help="output file, stdout by default")
+    p.add_argument("--samples", type=int, default=10000, help="number of samples")
+    p.add_argument("--seed", type=int, default=0, help="seed of the random generator")
+    p.add_argument("--quantiles", default="0.025,0.5,0.975", help="probabilities of the quantiles")
+    p.add_argument("--block", type=int, default=1000, help="number of samples computed at once")
+    p.add_argument("--bins", type=int, default=1000, help="number of bins of the histograms")
+    p.add_argument("--chunksize", type=int, default=1000, help="number of compositions computed at once")
+    p.set_defaults(func=runMonteCarlo)
+    p = subparsers.add_parser("temperature", help="compute DGf and log Ksp at several temperatures")
+    p.add_argument("input", help="TSV or CSV file of compositions, '-' for stdin")
+    p.add_argument("--db", required=True, help="database name, e.g. Apatite")
+    p.add_argument("--temps", required=True, type=parseTemperatures, help="temperatures (K), T1,T2,... or MIN:MAX:STEP")
+    p.add_argument("-o", "--output", default='-', help="output file, stdout by default")
+    p.add_argument("--chunksize", type=int, default=1000, help="number of compositions computed at once")
+    p.set_defaults(func=runTemperature)
+    p = subparsers.add_parser("serve", help="run the HTTP/JSON estimation service")
+    p.add_argument("--host", default="127.0.0.1", help="address of the server, localhost by default")
+    p.add_argument("--port", type=int, default=8765, help="port of the server")
+    p.add_argument("--poll", type=float, default=1.0,
+                   help="period (s) of the checks of the database files, 0 for no reload")
+    p.set_defaults(func=runServe)
+    args = parser.parse_args(argv)
+    if args.audit:
+        openAuditLog(args.audit)
+    if args.timings:
+        enableTimings(args.timings)
+    try:
+        if args.profile:
+            return profileRun(args.profile, args.func, args)
+        return args.func(args)
+    except DataBaseError as err:
+        errorMessage(str(err))
+        return 1
+
+
+def main(argv):
+    """ Run the command 'argv', or the GUI if there is no argument
+
+    :param argv: the command line arguments (without the program name).
+    :return: the exit status.
+    """
+    if len(argv):
+        return runCommand(argv)
+    openAuditLog(os.environ.get("THERMAP_AUDIT"))
+    if os.environ.get("THERMAP_TIMINGS"):
+        enableTimings(os.environ["THERMAP_TIMINGS"])
+    # PyQt5 is only imported when the GUI is used
+    import ThermAPgui
+    if os.environ.get("THERMAP_PROFILE"):
+        return profileRun(os.environ["THERMAP_PROFILE"], ThermAPgui.run)
+    return ThermAPgui.run()
+
+
+# ------------------------------------------------------------------
+
+# Run the program
+if __name__ == '__main__':
+    # This module is also the 'ThermAP' module imported by the GUI, so that they share their data
+    sys.modules.setdefault("ThermAP", sys.modules[__name__])
+    sys.exit(main(sys.argv[1:]))
 
 
-# ------------------------------------------------------------------
- 
-# Run the program
-if __name__ == '__main__':
-    app = QtWidgets.QApplication(sys.argv)
-    path = inspect.getfile(inspect.currentframe())
-    progpath, f = os.path.split(path)
-    # Load element data from file if the file exists
-    path = os.path.join(progpath, "ElemDB.txt")
-    ok = loadElems(path)
-    if ok:
-        # Look for database files
-        ok = lookForDB()
-    while ok:
-        dlg = initDlg()
-        ok = dlg.exec_()
-        if ok:
-            curDBidx = dlg.seldbno - 1
-            DBtitle = DBtitles[curDBidx]
-            # Load element data from file if the file exists
-            path = os.path.join(progpath, "ElemDB.txt")
-            ok = loadElems(path)
-            if ok:
-                # Load species data from file if the file 'exists
-                dbfilnam = "SpeciesDB{}.txt".format(curDBidx+1)
-                path = os.path.join(progpath, dbfilnam)
-                ok = loadSpecies(path)
-            if ok:
-                if initDataBase():
-                    dlg = inputDlg()
-                    ok = dlg.exec_()
-    sys.exit()
@@ -0,0 +1,988 @@
+""" ThermAP GUI: the dialogs of the program
+
+    PyQt5 is only imported by this module, so that the computations of
+    ThermAP can be used without GUI.
+"""
+import sys, os, platform
+
+import numpy as np
+from PyQt5.QtCore import QRegExp, QTimer, Qt, QModelIndex, pyqtSignal
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+import ThermAP
+from ThermAP import appName, version, Properties, IsNumber, RunningSums, DataBaseError
+from ThermAP import formatValue, formatRows, formatSparse
+
+
+def showError(msg, parent=None):
+    """ Report an error in a message box
+
+    :param msg: the error message.
+    :param parent: the parent widget.
+    :return: nothing.
+    """
+    QtWidgets.QMessageBox.critical(parent, appName, msg)
+
+
+def aboutThermAP():
+    """ Open ThermAP_presentation.pdf in the Web Browser.
+
+    :return: nothing.
+    """
+    import webbrowser
+    url = os.path.join(ThermAP.progpath, "ThermAP_presentation.pdf")
+    if platform.system() == "Darwin":
+        webbrowser._browsers['safari'][1].open(url)
+    else:
+        webbrowser.open(url)
+
+
+# - QHLine class ------------------------------------------------------------
+
+class QHLine(QtWidgets.QFrame):
+    def __init__(self):
+        super(QHLine, self).__init__()
+        self.setFrameShape(QtWidgets.QFrame.HLine)
+        self.setFrameShadow(QtWidgets.QFrame.Sunken)
+
+
+# - initDlg class ------------------------------------------------------------
+
+class initDlg(QtWidgets.QDialog):
+    def __init__(self, parent=None):
+        """ Init dialog.
+
+            self.label.setFont(QFont('Arial', 10))
+            self.label.setFont.setStyleSheet("font-weight: bold")
+            label.setText("x<sub>1</sub><sup>2</sup>")
+        """
+        super (initDlg, self).__init__(parent)
+        self.setWindowTitle(appName)
+        self.seldbno = 0
+        self.registry = ThermAP.getRegistry()
+
+        L1Llab = QtWidgets.QLabel("ThermAP")
+        font = QtGui.QFont('Arial', 24, QtGui.QFont.Bold)
+        font.setItalic(True)
+        L1Llab.setFont(font)
+
+        L1Rlab = QtWidgets.QLabel("Version {} - April 2021".format(version))
+        L1Rlab.setFont(QtGui.QFont('Arial', 14))
+        L1Rlab.setAlignment(Qt.AlignRight | Qt.AlignVCenter)
+        L2lab = QtWidgets.QLabel("Applied Predictive Thermodynamics")
+        L2lab.setFont(QtGui.QFont('Arial', 16))
+
+        Welcome1lab = QtWidgets.QLabel("Welcome to the ThermAP program!")
+        Welcome1lab.setFont(QtGui.QFont('Arial', 16, QtGui.QFont.Bold))
+        Welcome1lab.setStyleSheet("color: blue;")
+        Welcome1lab.setAlignment(Qt.AlignCenter | Qt.AlignVCenter)
+
+        sWelcome2 = " Predicting standard thermodynamic properties for complex oxides (298 K, 1 bar) \n"
+        sWelcome2 += " from their chemical composition using ion-refined contributions "
+        Welcome2lab = QtWidgets.QLabel(sWelcome2)
+        font = QtGui.QFont('Arial', 14)
+        font.setItalic(True)
+        Welcome2lab.setFont(font)
+        Welcome2lab.setAlignment(Qt.AlignCenter | Qt.AlignVCenter)
+        #Welcome2lab.setWordWrap(True)
+
+        sAuthorsL = "All rights reserved\n"
+        sAuthorsL += "Copyright: Christophe Drouet, Pierre Alphonse\n"
+        sAuthorsL += "CIRIMAT (UMR CNRS 5085), University of Toulouse, France"
+        AuthorsLlab =  QtWidgets.QLabel(sAuthorsL)
+        AuthorsLlab.setWordWrap(True)
+
+        sAuthorsR = 'Contact: <span style="color:blue; text-decoration:underline">christophe.drouet@cirimat.fr</span>'
+        AuthorsRlab = QtWidgets.QLabel(sAuthorsR)
+        AuthorsRlab.setAlignment(Qt.AlignRight | Qt.AlignBottom)
+
+        sCitation1 = "<u>Program citation:</u> C. Drouet, P. Alphonse, ThermAP, "
+        sCitation1 += '<span style="color:blue; text-decoration:underline">www.christophedrouet.com/thermAP.html</span>'
+        sCitation1 += ", Toulouse, France (2015)"
+        sCitation2 = "<u>Initial reference:</u> C. Drouet, Journal of Chemical Thermodynamics 81 (2015) 143-159."
+        Citationlab1 = QtWidgets.QLabel(sCitation1)
+        Citationlab1.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)
+        Citationlab2 = QtWidgets.QLabel(sCitation2)
+        Citationlab2.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)
+
+        aboutbut = QtWidgets.QPushButton("ThermAP overview")
+        aboutbut.setFont(QtGui.QFont('Arial', 16, QtGui.QFont.Bold))
+        dbButtons = []
+        for dbnam in self.registry.names():
+            butnam = " Access the {} database ".format(dbnam)
+            but = QtWidgets.QPushButton(butnam)
+            but.setFont(QtGui.QFont('Arial', 16))
+            dbButtons.append(but)
+
+        # set the layout
+        tophbox = QtWidgets.QHBoxLayout()
+        tophbox.addWidget(L1Llab)
+        tophbox.addWidget(L1Rlab)
+        l2hbox = QtWidgets.QHBoxLayout()
+        l2hbox.addWidget(L2lab)
+        welcomevbox = QtWidgets.QVBoxLayout()
+        welcomevbox.addWidget(Welcome1lab)
+        welcomevbox.addSpacing(20)
+        welcomevbox.addWidget(Welcome2lab)
+
+        buttonvbox = QtWidgets.QVBoxLayout()
+        buttonhbox = QtWidgets.QHBoxLayout()
+        buttonhbox.addStretch(1)
+        buttonhbox.addWidget(aboutbut)
+        buttonhbox.addStretch(1)
+        buttonvbox.addLayout(buttonhbox)
+        for but in dbButtons:
+            buttonhbox = QtWidgets.QHBoxLayout()
+            buttonhbox.addStretch(1)
+            buttonhbox.addWidget(but)
+            buttonhbox.addStretch(1)
+            buttonvbox.addLayout(buttonhbox)
+
+        authorhbox = QtWidgets.QHBoxLayout()
+        authorhbox.addWidget(AuthorsLlab)
+        authorhbox.addWidget(AuthorsRlab)
+        citationvbox = QtWidgets.QVBoxLayout()
+        citationvbox.addWidget(Citationlab1)
+        citationvbox.addWidget(Citationlab2)
+        vbox = QtWidgets.QVBoxLayout()
+        vbox.addLayout(tophbox)
+        vbox.addLayout(l2hbox)
+        vbox.addSpacing(20)
+        vbox.addLayout(welcomevbox)
+        vbox.addSpacing(20)
+        vbox.addLayout(buttonvbox)
+        vbox.addSpacing(20)
+        vbox.addLayout(authorhbox)
+        vbox.addSpacing(10)
+        vbox.addLayout(citationvbox)
+        self.setLayout(vbox)
+
+        aboutbut.clicked.connect(aboutThermAP)
+        for but in dbButtons:
+            but.clicked.connect(self.setdbno)
+
+
+    def setdbno(self):
+        source = self.sender()
+        for i, dbnam in enumerate(self.registry.names()):
+            if dbnam in source.text():
+                self.seldbno = i+1
+                break
+        self.accept()
+
+
+
+def resultText(res, dbname, notes=True):
+    """ Build the HTML table of the results of a composition
+
+    :param res: a dict of the properties, as returned by RunningSums.values.
+    :param dbname: the name of the current database.
+    :param notes: if False, the notes about pKsp are not added.
+    :return: the HTML text.
+    """
+    DGf, DHf, DSf, So, pKsp = [res[key] for key in Properties]
+    aqflag = not np.isnan(pKsp)
+    st = '<TABLE BORDER=0 CELLSPACING=5 CELLPADDING=1>'
+    st += '<TR>'
+    st += '<TD WIDTH=150>  Estimated &Delta;G<sub>f</sub><sup>o</sup> :</TD>'
+    st += '<TD ALIGN="right"> {:.0f}</TD>'.format(DGf)
+    st += '<TD> kJ.mol<sup>-1</sup></TD>'
+    st += '</TR>'
+    st += '<TR>'
+    st += '<TD>   Estimated &Delta;H<sub>f</sub><sup>o</sup> : </TD>'
+    st += '<TD ALIGN="right"> {:.0f}</TD>'.format(DHf)
+    st += '<TD> kJ.mol<sup>-1</sup></TD>'
+    st += '</TR>'
+    st += '<TR>'
+    st += '<TD>   Estimated &Delta;S<sub>f</sub><sup>o</sup> : </TD>'
+    st += '<TD ALIGN="right"> {:.0f}</TD>'.format(DSf)
+    st += '<TD> J.mol<sup>-1</sup>.K<sup>-1</sup></TD>'
+    st += '</TR>'
+    st += '<TR>'
+    st += '<TD>   Estimated S<sup>o</sup> : </TD>'
+    st += '<TD ALIGN="right"> {:.0f}</TD>'.format(So)
+    st += '<TD> J.mol<sup>-1</sup>.K<sup>-1</sup></TD>'
+    st += '</TR>'
+    if dbname != "Apatites":
+        st += '</TABLE>'
+        if notes:
+            st += '<br><br>'
+    else:
+        if aqflag:
+            st += '<TR>'
+            st += '<TD>  </TD>'
+            st += '</TR>'
+            st += '<TR>'
+            st += '<TD>   Estimated pK<sub>sp</sub><sup>*</sup> : </TD>'
+            st += '<TD ALIGN="right"> {:.0f}</TD>'.format(pKsp)
+            st += '</TR>'
+            st += '</TABLE>'
+            if notes:
+                st += '<br><br><br>'
+                st += '<sup>*</sup>Considering equation of the type : <br><br>'
+                st += '&nbsp;&nbsp; M<sub>10</sub>(PO<sub>4</sub>)<sub>6</sub> X<sub>2</sub>  &#x2192;'
+                st += ' 10 M<sup>2+</sup>(aq) + 6 PO<sub>4</sub><sup>3-</sup>(aq) + 2 X<sup>-</sup>(aq)'
+                st += '<br><br>'
+                st += 'These K<sub>sp</sub> estimates should be considered only as first '
+                st += 'approximation taking into account propagated uncertainties.'
+        else:
+            st += '</TABLE>'
+            if notes:
+                st += '<br><br>'
+                st += 'In the case of non-stoichiometric samples, the existence of a '
+                st += 'metastable equilibrium solubility (MSE) behavior has been <br>'
+                st += 'evidenced at least in some cases, leading to a non-fixed value '
+                st += 'of the solubility product.<br>'
+                st += 'Therefore, in such cases, K<sub>sp</sub> was not calculated.'
+    return st
+
+
+if ThermAP.instrument is not None:
+    ThermAP.instrument.wrap(sys.modules[__name__], "resultText")
+
+
+# - speciesModel class ------------------------------------------------------------
+
+Superscripts = str.maketrans("0123456789+-", "⁰¹²³⁴⁵⁶⁷⁸⁹⁺⁻")
+Subscripts = str.maketrans("0123456789", "₀₁₂₃₄₅₆₇₈₉")
+
+
+def speciesLabel(spec):
+    """ Return the label of a species, e.g. Ca²⁺, PO₄³⁻, H₂O
+
+        The numbers of the formula are written as subscripts, and the
+        charge of the species as superscript. H+ stands for the HPO4 ion
+        (see the footnote of inputDlg).
+
+    :param spec: the Specie.
+    :return: the label.
+    """
+    name = spec.name.strip()
+    if name == "H+":
+        return "HPO₄²⁻ (*)"
+    charge = int(round(spec.charge))
+    # Remove the charge from the name
+    formula = name.rstrip("+-")
+    if formula != name and abs(charge) > 1 and formula.endswith(str(abs(charge))):
+        formula = formula[:-len(str(abs(charge)))]
+    label = formula.translate(Subscripts)
+    if charge:
+        scharge = "" if abs(charge) == 1 else str(abs(charge))
+        scharge += "+" if charge > 0 else "-"
+        label += scharge.translate(Superscripts)
+    return label
+
+
+class speciesModel(QtCore.QAbstractTableModel):
+    """ The coefficients of the species of the current database
+
+        One row per species, listed by column of the database; the species
+        are the vertical header and the coefficients the only column. The
+        coefficients are kept as typed, their values being in the RunningSums.
+    """
+    coefChanged = pyqtSignal(int)
+
+    def __init__(self, species, sums, parent=None):
+        """
+        :param species: the list of the Specie of the database.
+        :param sums: the RunningSums of the composition.
+        :param parent: the parent object.
+        """
+        super(speciesModel, self).__init__(parent)
+        self.species = species
+        self.sums = sums
+        self.rows = sorted(range(len(species)), key=lambda i: species[i].col)
+        self.labels = {}
+        self.texts = {}
+
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else 1
+
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        i = self.rows[index.row()]
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return self.texts.get(i, "")
+        if role == Qt.UserRole:
+            return self.species[i].name
+        if role == Qt.TextAlignmentRole:
+            return Qt.AlignRight | Qt.AlignVCenter
+        return None
+
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal:
+            return "Coefficient" if role == Qt.DisplayRole else None
+        i = self.rows[section]
+        if role == Qt.DisplayRole:
+            # The labels are built when the rows are shown
+            if i not in self.labels:
+                self.labels[i] = speciesLabel(self.species[i])
+            return self.labels[i]
+        if role == Qt.ToolTipRole:
+            return self.species[i].name
+        return None
+
+
+    def flags(self, index):
+        return Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsEditable
+
+
+    def setData(self, index, value, role=Qt.EditRole):
+        """ Set the coefficient of a species from the text typed
+
+        :return: True if the text has been changed.
+        """
+        if role != Qt.EditRole or not index.isValid():
+            return False
+        i = self.rows[index.row()]
+        text = str(value).strip()
+        if text == self.texts.get(i, ""):
+            return False
+        if text:
+            self.texts[i] = text
+        else:
+            self.texts.pop(i, None)
+        coef = float(text) if IsNumber(text) else 0.0
+        self.dataChanged.emit(index, index)
+        if self.sums.setCoef(i, coef):
+            self.coefChanged.emit(i)
+        return True
+
+
+    def clear(self):
+        """ Clear all the coefficients """
+        self.beginResetModel()
+        self.texts.clear()
+        self.sums.reset()
+        self.endResetModel()
+
+
+# - coefDelegate class ------------------------------------------------------------
+
+class coefDelegate(QtWidgets.QStyledItemDelegate):
+    """ Editor of the coefficients, committed at each key so that the
+        results follow the typing.
+    """
+    def __init__(self, parent=None):
+        super(coefDelegate, self).__init__(parent)
+        self.validator = QtGui.QRegExpValidator(QRegExp("[0-9][.0-9][0-9][0-9]"), self)
+
+
+    def createEditor(self, parent, option, index):
+        editor = QtWidgets.QLineEdit(parent)
+        editor.setValidator(self.validator)
+        editor.setAlignment(Qt.AlignRight | Qt.AlignVCenter)
+        editor.textEdited.connect(lambda text: self.commitData.emit(editor))
+        return editor
+
+
+    def setEditorData(self, editor, index):
+        text = index.data(Qt.EditRole)
+        if editor.text() != text:
+            editor.setText(text)
+
+
+    def setModelData(self, editor, model, index):
+        model.setData(index, editor.text(), Qt.EditRole)
+
+
+# - inputDlg class ------------------------------------------------------------
+
+class inputDlg(QtWidgets.QDialog):
+    def __init__(self, history=None, parent=None):
+        """ Input dialog.
+
+        :param history: the historyDlg where the results are added.
+        """
+        super (inputDlg, self).__init__(parent)
+        self.setWindowTitle(appName)
+        self.history = history if history is not None else historyDlg()
+        self.history.attach(self)
+        self.db = ThermAP.curDB
+        self.estimator = self.db.estimator
+
+        # Save current values of species in 'currdata.txt'
+        fo = open('currdata.txt', 'w')
+        fo.write('Name\tcharge\t   g(i)\t   s(i)\t   DG(aq)\tElements\n')
+        for specie in self.db.species:
+            lin = ""
+            lin += '{:7s}\t'.format(specie.name)
+            lin += '{:>+3.0f}\t'.format(specie.charge)
+            lin += '{:>+7.2f}\t'.format(specie.g/1000.0)
+            lin += '{:>+7.2f}\t'.format(specie.s)
+            lin += '{:>+9.2f}\t'.format(specie.DGaq/1000.0)
+            for i, item in enumerate(specie.elem):
+                lin += '{0},{1}'.format(item[0], item[1])
+                if i < len(specie.elem)-1:
+                    lin +='; '
+            lin += '\n'
+            fo.write(lin)
+        fo.close()
+
+        titlelab = QtWidgets.QLabel(self.db.title)
+        titlelab.setFont(QtGui.QFont('Arial', 14, QtGui.QFont.Bold))
+        titlelab.setAlignment(Qt.AlignCenter | Qt.AlignVCenter)
+        titlelab.setWordWrap(True)
+
+        font = QtGui.QFont('Arial', 12)
+
+        # Results updated while the coefficients are typed
+        self.sums = RunningSums(self.estimator)
+        self.model = speciesModel(self.db.species, self.sums, self)
+        self.model.coefChanged.connect(self.onEdit)
+        # The species whose name contains the text of the search box
+        self.proxy = QtCore.QSortFilterProxyModel(self)
+        self.proxy.setSourceModel(self.model)
+        self.proxy.setFilterRole(Qt.UserRole)
+        self.proxy.setFilterCaseSensitivity(Qt.CaseInsensitive)
+        self.search = QtWidgets.QLineEdit()
+        self.search.setFont(font)
+        self.search.setPlaceholderText("Search species")
+        self.search.setClearButtonEnabled(True)
+        self.search.textChanged.connect(self.proxy.setFilterFixedString)
+
+        self.table = QtWidgets.QTableView()
+        self.table.setFont(font)
+        self.table.setModel(self.proxy)
+        self.table.setItemDelegate(coefDelegate(self.table))
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.AllEditTriggers)
+        self.table.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        # Fixed row heights: only the visible rows are measured and painted
+        vheader = self.table.verticalHeader()
+        vheader.setSectionResizeMode(QtWidgets.QHeaderView.Fixed)
+        vheader.setDefaultSectionSize(QtGui.QFontMetrics(font).height() + 8)
+        vheader.setFont(font)
+        vheader.setDefaultAlignment(Qt.AlignLeft | Qt.AlignVCenter)
+        vheader.setMinimumWidth(120)
+
+        self.livetext = QtWidgets.QLabel("")
+        self.livetext.setFont(font)
+        self.livetext.setTextFormat(Qt.RichText)
+        self.livetext.setWordWrap(True)
+        # Wait for the end of the typing before rendering the results
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(150)
+        self.timer.timeout.connect(self.showResults)
+
+        sfoot = "<sup>*</sup>the HPO<sub>4</sub><sup>2-</sup> ion being treated in "
+        sfoot += "this additive model as the sum PO<sub>4</sub><sup>3-</sup>  +  H<sup>+</sup>"
+        footlab = QtWidgets.QLabel(sfoot)
+
+        computeButton = QtWidgets.QPushButton("Compute")
+        computeButton.setFont(font)
+        clearButton = QtWidgets.QPushButton("Clear")
+        clearButton.setFont(font)
+        homeButton = QtWidgets.QPushButton("HOME")
+        homeButton.setFont(QtGui.QFont('Arial', 12, QtGui.QFont.Bold))
+        aboutButton = QtWidgets.QPushButton("About")
+        aboutButton.setFont(font)
+        quitButton = QtWidgets.QPushButton("Quit")
+        quitButton.setFont(font)
+
+        # set the layout
+        titlevbox = QtWidgets.QVBoxLayout()
+        titlevbox.addWidget(titlelab)
+        titlevbox.addWidget(QHLine())
+
+        tablevbox = QtWidgets.QVBoxLayout()
+        tablevbox.addWidget(self.search)
+        tablevbox.addWidget(self.table)
+
+        btnhbox = QtWidgets.QHBoxLayout()
+        btnhbox.addWidget(computeButton)
+        btnhbox.addWidget(clearButton)
+        btnhbox.addWidget(homeButton)
+        btnhbox.addWidget(aboutButton)
+        btnhbox.addWidget(quitButton)
+
+        footvbox = QtWidgets.QVBoxLayout()
+        footvbox.addWidget(QHLine())
+        footvbox.addWidget(self.livetext)
+        footvbox.addSpacing(20)
+        footvbox.addWidget(footlab)
+        footvbox.addWidget(QHLine())
+
+        mainvbox = QtWidgets.QVBoxLayout()
+        mainvbox.addLayout(titlevbox)
+        mainvbox.addLayout(tablevbox)
+        mainvbox.addLayout(footvbox)
+        mainvbox.addLayout(btnhbox)
+        self.setLayout(mainvbox)
+
+        computeButton.clicked.connect(self.compute)
+        clearButton.clicked.connect(self.clear)
+        homeButton.clicked.connect(self.accept)
+        aboutButton.clicked.connect(self.about)
+        quitButton.clicked.connect(self.reject)
+
+
+    def clear(self):
+        """ Clear all the coefficient values
+
+        :return: Nothing
+        """
+        self.timer.stop()
+        self.model.clear()
+        self.showResults()
+
+
+    def about(self):
+        aboutThermAP()
+
+
+    def onEdit(self, i):
+        """ The coefficient of the species 'i' has changed: show the results
+            at the end of the typing
+
+        :param i: the index of the species.
+        :return: Nothing
+        """
+        self.timer.start()
+
+
+    def showResults(self):
+        """ Show the results of the current composition in the input dialog
+
+        :return: Nothing
+        """
+        if not np.any(self.sums.coefs):
+            self.livetext.setText("")
+            return
+        res = self.sums.values()
+        if not res["valid"]:
+            st = 'Charge balance : {:+.2f}  -  Check the electroneutrality !'.format(res["charge"])
+        else:
+            st = resultText(res, self.db.name, False)
+        self.livetext.setText(st)
+
+
+
+    def compute(self, event):
+        """
+            Expected results for fluorapatite Ca(10)PO4(6)F(2):
+            DGf = -12836 kJ/mol
+            DHf = -13598 kJ/mol
+            DSf =  -2557 J/mol/K
+            So  =    770 J/mol.K
+            pKsp = 109
+        """
+        self.timer.stop()
+        self.showResults()
+        res = self.sums.values()
+        ThermAP.audit("gui", self.estimator, self.sums.coefs, res)
+        if not res["valid"]:
+            showError('Check the electroneutrality !', self)
+        else:
+            self.history.add(self.db.name, self.sums.coefs,
+                             self.estimator.names, res)
+
+
+
+# - historyModel class ------------------------------------------------------------
+
+class historyModel(QtCore.QAbstractTableModel):
+    """ The results of the compositions computed during the session
+
+        The properties are stored in a NumPy array grown by blocks; the
+        rows shown, filtered and sorted, are the array 'order' of row
+        numbers, so that the view only asks for the visible rows.
+    """
+    Headers = ("Database", "Composition", "ΔGf (kJ/mol)", "ΔHf (kJ/mol)",
+               "ΔSf (J/mol/K)", "S° (J/mol/K)", "pKsp")
+
+    def __init__(self, parent=None):
+        super(historyModel, self).__init__(parent)
+        self.dbnames = []
+        self.comps = []
+        self.values = np.empty((1024, len(Properties)))
+        self.order = np.zeros(0, dtype=np.intp)
+        self.pattern = ""
+        self.sortcol = -1
+        self.sortorder = Qt.AscendingOrder
+
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.order)
+
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.Headers)
+
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        i = self.order[index.row()]
+        col = index.column()
+        if role == Qt.DisplayRole:
+            if col == 0:
+                return self.dbnames[i]
+            if col == 1:
+                return self.comps[i]
+            return formatValue(self.values[i, col - 2])
+        if role == Qt.TextAlignmentRole and col > 1:
+            return Qt.AlignRight | Qt.AlignVCenter
+        return None
+
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.Headers[section]
+        return section + 1
+
+
+    def result(self, row):
+        """ Return the database and the properties of a row shown
+
+        :param row: the row number in the view.
+        :return: a tuple (database name, dict of the properties).
+        """
+        i = self.order[row]
+        return self.dbnames[i], dict(zip(Properties, self.values[i]))
+
+
+    def append(self, dbname, comps, values):
+        """ Add a block of results, the rows shown being inserted after the others
+
+        :param dbname: the database name.
+        :param comps: the list of the compositions.
+        :param values: the (len(comps) x 5) array of the properties.
+        :return: the row numbers of the new results shown.
+        """
+        n0 = len(self.comps)
+        n = n0 + len(comps)
+        if n > len(self.values):
+            self.values = np.resize(self.values, (max(n, 2 * len(self.values)), len(Properties)))
+        self.values[n0:n] = values
+        self.dbnames.extend([dbname] * len(comps))
+        self.comps.extend(comps)
+        new = self.select(range(n0, n))
+        if self.sortcol >= 0:
+            # Sort again with the new rows
+            self.beginResetModel()
+            self.order = self.sort_(np.concatenate((self.order, new)))
+            self.endResetModel()
+            return np.flatnonzero(self.order >= n0)
+        if len(new):
+            first = len(self.order)
+            self.beginInsertRows(QModelIndex(), first, first + len(new) - 1)
+            self.order = np.concatenate((self.order, new))
+            self.endInsertRows()
+        return np.arange(len(self.order) - len(new), len(self.order))
+
+
+    def clear(self):
+        """ Remove all the results """
+        self.beginResetModel()
+        self.dbnames = []
+        self.comps = []
+        self.order = np.zeros(0, dtype=np.intp)
+        self.endResetModel()
+
+
+    def select(self, rows):
+        """ Return the rows whose database or composition contain the filter text """
+        if self.pattern == "":
+            return np.asarray(rows, dtype=np.intp)
+        pat = self.pattern
+        return np.array([i for i in rows if pat in self.comps[i].lower() or pat in self.dbnames[i].lower()],
+                        dtype=np.intp)
+
+
+    def setFilter(self, text):
+        """ Show only the results whose database or composition contain 'text' """
+        self.beginResetModel()
+        self.pattern = text.strip().lower()
+        self.order = self.sort_(self.select(range(len(self.comps))))
+        self.endResetModel()
+
+
+    def sort_(self, rows):
+        """ Return the row numbers 'rows' in the order of the sort column """
+        col = self.sortcol
+        if col < 0:
+            return np.sort(rows)
+        desc = self.sortorder == Qt.DescendingOrder
+        if col > 1:
+            # NaN (no pKsp) last in both orders
+            v = self.values[rows, col - 2]
+            idx = np.argsort(-v if desc else v, kind="stable")
+            return rows[idx]
+        keys = self.dbnames if col == 0 else self.comps
+        return np.array(sorted(rows.tolist(), key=keys.__getitem__, reverse=desc), dtype=np.intp)
+
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.beginResetModel()
+        self.sortcol = column
+        self.sortorder = order
+        self.order = self.sort_(self.order)
+        self.endResetModel()
+
+
+    def write(self, fout, sep='\t'):
+        """ Write the results shown in a text file, as the 'batch' command
+
+        :param fout: the output text file.
+        :param sep: the field separator.
+        :return: nothing.
+        """
+        fout.write(sep.join(["database", "composition"] + list(Properties)) + '\n')
+        for start in range(0, len(self.order), 10000):
+            rows = self.order[start:start + 10000]
+            lines = formatRows(self.values[rows], sep)
+            fout.writelines("{0}{3}{1}{3}{2}\n".format(self.dbnames[i], self.comps[i], line, sep)
+                            for i, line in zip(rows.tolist(), lines))
+
+
+
+def readResults(fin, dbname, chunksize=10000):
+    """ Read a file of results by blocks of rows
+
+        The file is written by historyModel.write or by the 'batch' command;
+        without 'composition' column, the composition is given by the
+        columns copied from the input file (e.g. an identifier), and the
+        rows in error are skipped.
+
+    :param fin: the input text file.
+    :param dbname: the database of the results without 'database' column.
+    :param chunksize: the number of rows of the blocks.
+    :return: an iterator of tuples (database name, compositions, values).
+    """
+    header = fin.readline().rstrip("\r\n")
+    sep = '\t' if '\t' in header else ','
+    names = [item.strip() for item in header.split(sep)]
+    if not all(key in names for key in Properties):
+        raise ValueError("The file contains no results")
+    props = [names.index(key) for key in Properties]
+    dbcol = names.index("database") if "database" in names else -1
+    errcol = names.index("error") if "error" in names else -1
+    if "composition" in names:
+        labcols = [names.index("composition")]
+    else:
+        labcols = [j for j, nam in enumerate(names) if j not in props and
+                   j != errcol and j != dbcol and nam != "balance"]
+    blocks = {}
+    for line in fin:
+        lin = line.rstrip("\r\n")
+        if not len(lin.strip()) or lin.lstrip()[0] == '#':
+            continue
+        items = lin.split(sep)
+        items += [""] * (len(names) - len(items))
+        if errcol >= 0 and items[errcol].strip():
+            continue
+        db = items[dbcol] if dbcol >= 0 else dbname
+        comps, values = blocks.setdefault(db, ([], []))
+        comps.append(" ".join(items[j] for j in labcols))
+        values.append([float(items[j]) if IsNumber(items[j]) else np.nan for j in props])
+        if len(comps) >= chunksize:
+            yield db, comps, np.array(values)
+            del blocks[db]
+    for db, (comps, values) in blocks.items():
+        yield db, comps, np.array(values)
+
+
+# - historyDlg class ------------------------------------------------------------
+
+class historyDlg(QtWidgets.QDialog):
+    def __init__(self, parent=None):
+        """ Results panel: the results computed during the session.
+
+            It stays open beside the input dialog; the notes of the
+            selected result are shown below the table.
+        """
+        super(historyDlg, self).__init__(parent)
+        self.setWindowTitle(appName + " - Results")
+        font = QtGui.QFont('Arial', 12)
+        self.model = historyModel(self)
+
+        self.search = QtWidgets.QLineEdit()
+        self.search.setFont(font)
+        self.search.setPlaceholderText("Filter by database or composition")
+        self.search.setClearButtonEnabled(True)
+        # Filter at the end of the typing
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(250)
+        self.timer.timeout.connect(lambda: self.model.setFilter(self.search.text()))
+        self.search.textChanged.connect(self.timer.start)
+
+        self.table = QtWidgets.QTableView()
+        self.table.setModel(self.model)
+        # Rows in the order of computation until a column is clicked
+        self.table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.table.setSortingEnabled(True)
+        self.table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table.verticalHeader().setSectionResizeMode(QtWidgets.QHeaderView.Fixed)
+        hheader = self.table.horizontalHeader()
+        hheader.setSectionResizeMode(QtWidgets.QHeaderView.Interactive)
+        hheader.resizeSection(1, 300)
+        self.table.selectionModel().currentRowChanged.connect(self.showNotes)
+        self.model.modelReset.connect(lambda: self.notes.setText(""))
+
+        self.notes = QtWidgets.QLabel("")
+        self.notes.setFont(font)
+        self.notes.setTextFormat(Qt.RichText)
+        self.notes.setWordWrap(True)
+        self.count = QtWidgets.QLabel("")
+
+        importButton = QtWidgets.QPushButton("Import")
+        importButton.setFont(font)
+        exportButton = QtWidgets.QPushButton("Export")
+        exportButton.setFont(font)
+        clearButton = QtWidgets.QPushButton("Clear")
+        clearButton.setFont(font)
+        closeButton = QtWidgets.QPushButton("Close")
+        closeButton.setFont(font)
+
+        # set the layout
+        btnhbox = QtWidgets.QHBoxLayout()
+        btnhbox.addWidget(self.count)
+        btnhbox.addStretch()
+        btnhbox.addWidget(importButton)
+        btnhbox.addWidget(exportButton)
+        btnhbox.addWidget(clearButton)
+        btnhbox.addWidget(closeButton)
+        mainvbox = QtWidgets.QVBoxLayout()
+        mainvbox.addWidget(self.search)
+        mainvbox.addWidget(self.table)
+        mainvbox.addWidget(self.notes)
+        mainvbox.addWidget(QHLine())
+        mainvbox.addLayout(btnhbox)
+        self.setLayout(mainvbox)
+        self.resize(900, 500)
+
+        for signal in (self.model.rowsInserted, self.model.modelReset):
+            signal.connect(self.showCount)
+        importButton.clicked.connect(self.importFile)
+        exportButton.clicked.connect(self.exportFile)
+        clearButton.clicked.connect(self.model.clear)
+        closeButton.clicked.connect(self.close)
+
+
+    def attach(self, dlg):
+        """ Make the panel a window of the modal dialog 'dlg'
+
+            The dialogs being run with exec_, the other windows would not
+            get the mouse and the keyboard.
+
+        :param dlg: the dialog.
+        :return: Nothing
+        """
+        self.setParentWindow(dlg)
+        # Keep the panel when the dialog is deleted
+        dlg.finished.connect(lambda result: self.setParentWindow(None))
+
+
+    def setParentWindow(self, parent):
+        """ Change the parent of the panel, keeping it on screen """
+        visible = self.isVisible()
+        self.setParent(parent, self.windowFlags())
+        self.setVisible(visible)
+
+
+    def add(self, dbname, coefs, names, res):
+        """ Add the result of a composition and select it
+
+        :param dbname: the database name.
+        :param coefs: the coefficients of the composition.
+        :param names: the names of the species.
+        :param res: the dict of the properties.
+        :return: Nothing
+        """
+        values = np.array([[res[key] for key in Properties]])
+        rows = self.model.append(dbname, [formatSparse(coefs, names)], values)
+        if len(rows):
+            index = self.model.index(int(rows[-1]), 0)
+            self.table.setCurrentIndex(index)
+            self.table.scrollTo(index)
+        self.show()
+        self.raise_()
+
+
+    def showNotes(self, current, previous):
+        """ Show the results of the selected row with their notes """
+        if not current.isValid():
+            self.notes.setText("")
+            return
+        dbname, res = self.model.result(current.row())
+        self.notes.setText(resultText(res, dbname))
+
+
+    def showCount(self):
+        self.count.setText("{0} / {1} results".format(self.model.rowCount(), len(self.model.comps)))
+
+
+    def importFile(self):
+        """ Add the results of a file written by Export or by the 'batch' command """
+        path, filt = QtWidgets.QFileDialog.getOpenFileName(self, "Import results", "",
+                                                           "Results (*.tsv *.txt *.csv);;All files (*)")
+        if not path:
+            return
+        try:
+            with open(path) as fin:
+                for dbname, comps, values in readResults(fin, ThermAP.curDB.name):
+                    self.model.append(dbname, comps, values)
+                    # Show the rows read so far
+                    QtWidgets.QApplication.processEvents()
+        except (OSError, ValueError) as err:
+            showError("Can't import {0}: {1}".format(path, err), self)
+
+
+    def exportFile(self):
+        """ Write the results shown in a TSV or CSV file """
+        path, filt = QtWidgets.QFileDialog.getSaveFileName(self, "Export results", "results.tsv",
+                                                           "Results (*.tsv *.txt *.csv);;All files (*)")
+        if not path:
+            return
+        try:
+            with open(path, 'w') as fout:
+                self.model.write(fout, ',' if path.lower().endswith(".csv") else '\t')
+        except OSError as err:
+            showError("Can't export {0}: {1}".format(path, err), self)
+
+
+
+# ------------------------------------------------------------------
+
+def run():
+    """ Run the GUI
+
+    :return: the exit status.
+    """
+    app = QtWidgets.QApplication(sys.argv)
+    try:
+        # Load all the databases once
+        ThermAP.getRegistry()
+        ok = True
+    except DataBaseError as err:
+        showError(str(err))
+        ok = False
+    watcher = ThermAP.Watcher()
+    # The results are kept for the whole session
+    history = historyDlg()
+    while ok:
+        # Read again the database files edited since the last time
+        watcher.check()
+        dlg = initDlg()
+        history.attach(dlg)
+        ok = dlg.exec_()
+        if ok:
+            ThermAP.useDataBase(dlg.registry[dlg.seldbno - 1])
+            dlg = inputDlg(history)
+            ok = dlg.exec_()
+    return 0
@@ -0,0 +1,444 @@
+""" ThermAP server: estimation service over HTTP/JSON
+
+    An asyncio HTTP/1.1 server, with no other dependency than ThermAP,
+    meant to run on localhost. All the databases are loaded at startup.
+
+    GET  /databases                 names, titles and species of the databases
+    GET  /stats                     counters of the service
+    POST /estimate?db=NAME          one composition {"Ca2+": 10, "PO4": 6, "F-": 2}
+    POST /batch?db=NAME             a JSON array of compositions, or NDJSON
+                                    (Content-Type: application/x-ndjson), one
+                                    composition per line, streamed in and out.
+
+    The single estimates of concurrent requests are gathered in one
+    vectorized computation. The database files are watched and reloaded
+    when they change.
+"""
+import sys
+import json
+import asyncio
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+
+import ThermAP
+from ThermAP import appName, version, Properties
+
+MaxBody = 64 * 1024 * 1024   # Maximum size of a JSON body (bytes)
+MaxBatch = 1024              # Maximum number of single estimates computed together
+StreamChunk = 1000           # Number of NDJSON lines computed at once
+
+Reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           411: "Length Required", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class RequestError(Exception):
+    """ Error in a request, answered with the HTTP status 'status' """
+    def __init__(self, status, msg):
+        super(RequestError, self).__init__(msg)
+        self.status = status
+
+
+def metadata(registry):
+    """ Return the list of the metadata of the databases of the Registry 'registry' """
+    return [{"name": db.name, "title": db.title, "fingerprint": db.fingerprint,
+             "species": [{"name": spec.name, "col": spec.col, "charge": spec.charge}
+                         for spec in db.species]}
+            for db in registry]
+
+
+def coefVector(estimator, comp):
+    """ Return the coefficient vector of the composition 'comp' {species: coef} """
+    if not isinstance(comp, dict):
+        raise ValueError("A composition must be an object {species: coefficient}")
+    coefs = np.zeros(len(estimator.names))
+    for nam, coef in comp.items():
+        if nam not in estimator.nameidx:
+            raise ValueError("Unknown species {}".format(nam))
+        if isinstance(coef, bool) or not isinstance(coef, (int, float)):
+            raise ValueError("Bad coefficient for {}".format(nam))
+        coefs[estimator.nameidx[nam]] = coef
+    return coefs
+
+
+def resultDicts(res, errors):
+    """ Convert the results of Estimator.compute in a list of dicts
+
+    :param res: the dict returned by Estimator.compute.
+    :param errors: the list of the errors of the compositions ("" if none).
+    :return: a list of dicts {property: value or None, "error": message or None}.
+    """
+    out = []
+    values = np.column_stack([res[key] for key in Properties]).tolist()
+    for r, err in enumerate(errors):
+        if err == "" and not res["valid"][r]:
+            err = "Check the electroneutrality !"
+        if err:
+            item = dict((key, None) for key in Properties)
+            item["error"] = err
+        else:
+            item = dict((key, None if v != v else v) for key, v in zip(Properties, values[r]))
+            item["error"] = None
+        out.append(item)
+    return out
+
+
+def computeCompositions(estimator, comps):
+    """ Compute a list of compositions given as dicts
+
+    :return: the list of result dicts.
+    """
+    C = np.zeros((len(comps), len(estimator.names)))
+    errors = [""] * len(comps)
+    for r, comp in enumerate(comps):
+        try:
+            C[r] = coefVector(estimator, comp)
+        except ValueError as err:
+            errors[r] = str(err)
+    res = estimator.compute(C)
+    ThermAP.audit("serve", estimator, C, res, errors)
+    return resultDicts(res, errors)
+
+
+if ThermAP.instrument is not None:
+    ThermAP.instrument.wrap(sys.modules[__name__], "resultDicts")
+
+
+# - Coalescer class ----------------------------------------------------------
+
+class Coalescer(object):
+    """ Gather the single estimates of concurrent requests
+
+        The compositions waiting when the computation task runs are
+        computed together in one call of Estimator.compute, for each
+        Estimator (a reload of the databases gives new ones).
+    """
+    def __init__(self, maxbatch=MaxBatch):
+        self.maxbatch = maxbatch
+        self.queue = asyncio.Queue()
+        self.task = None
+        self.requests = 0        # number of compositions computed
+        self.batches = 0         # number of computations
+
+
+    async def estimate(self, estimator, coefs):
+        """ Return the result dict of the coefficient vector 'coefs' """
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put((estimator, coefs, fut))
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+        return await fut
+
+
+    async def run(self):
+        while True:
+            items = [await self.queue.get()]
+            # Let the other requests which are ready add their composition
+            await asyncio.sleep(0)
+            while len(items) < self.maxbatch and not self.queue.empty():
+                items.append(self.queue.get_nowait())
+            groups = {}
+            for item in items:
+                groups.setdefault(id(item[0]), []).append(item)
+            for group in groups.values():
+                self.computeGroup(group)
+
+
+    def computeGroup(self, items):
+        estimator = items[0][0]
+        try:
+            C = np.array([coefs for est, coefs, fut in items])
+            res = estimator.compute(C)
+            ThermAP.audit("serve", estimator, C, res)
+            results = resultDicts(res, [""] * len(items))
+        except Exception as err:
+            for est, coefs, fut in items:
+                if not fut.done():
+                    fut.set_exception(err)
+            return
+        self.requests += len(items)
+        self.batches += 1
+        for (est, coefs, fut), result in zip(items, results):
+            if not fut.done():
+                fut.set_result(result)
+
+
+# - Server class -------------------------------------------------------------
+
+class Server(object):
+    """ The HTTP server of the estimation service """
+
+    def __init__(self, watcher=None):
+        """
+        :param watcher: the Watcher reloading the databases, or None.
+        """
+        self.watcher = watcher
+        self.coalescers = {}     # Coalescer of each database name
+        self.meta = (None, [])   # (Registry, its metadata)
+        self.nrequest = 0
+
+
+    def getEstimator(self, query):
+        """ Return the name and the Estimator of the database of the request
+
+            The current snapshot of the database is used until the end of
+            the request, even if the databases are reloaded meanwhile.
+        """
+        names = query.get("db", [])
+        if not len(names):
+            raise RequestError(400, "The database must be given by ?db=NAME")
+        try:
+            db = ThermAP.registry.get(names[0])
+        except ThermAP.DataBaseError as err:
+            raise RequestError(404, str(err))
+        return db.name, db.estimator
+
+
+    def metadata(self):
+        registry = ThermAP.registry
+        if self.meta[0] is not registry:
+            self.meta = (registry, metadata(registry))
+        return self.meta[1]
+
+
+    async def handle(self, reader, writer):
+        """ Serve the requests of a connection (keep-alive) """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                items = line.decode("latin-1").split()
+                if not len(items):
+                    continue
+                if len(items) != 3:
+                    await self.respond(writer, 400, {"error": "Bad request line"}, False)
+                    break
+                method, target, httpver = items
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, sep, value = line.decode("latin-1").partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                keepalive = httpver == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                self.nrequest += 1
+                try:
+                    keepalive = await self.dispatch(method, target, httpver, headers,
+                                                    reader, writer, keepalive)
+                except RequestError as err:
+                    # The body may not have been read: close the connection
+                    await self.respond(writer, err.status, {"error": str(err)}, False)
+                    break
+                except Exception as err:
+                    await self.respond(writer, 500, {"error": str(err)}, False)
+                    break
+                if not keepalive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+    async def respond(self, writer, status, obj, keepalive):
+        body = json.dumps(obj).encode()
+        head = "HTTP/1.1 {0} {1}\r\nContent-Type: application/json\r\nContent-Length: {2}\r\n".format(
+               status, Reasons.get(status, ""), len(body))
+        head += "Connection: {}\r\n\r\n".format("keep-alive" if keepalive else "close")
+        writer.write(head.encode() + body)
+        await writer.drain()
+
+
+    async def readBody(self, reader, headers):
+        """ Read a whole request body, chunked or not, of at most MaxBody bytes """
+        parts = []
+        size = 0
+        async for data in self.bodyChunks(reader, headers):
+            size += len(data)
+            if size > MaxBody:
+                raise RequestError(413, "The body is larger than {} bytes, use NDJSON".format(MaxBody))
+            parts.append(data)
+        return b"".join(parts)
+
+
+    async def bodyChunks(self, reader, headers):
+        """ Yield the body of a request by pieces, as they are received """
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                line = await reader.readline()
+                n = int(line.split(b';')[0].strip() or b"0", 16)
+                if n == 0:
+                    # Skip the trailer
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return
+                data = await reader.readexactly(n)
+                await reader.readline()
+                yield data
+        elif "content-length" in headers:
+            left = int(headers["content-length"])
+            while left > 0:
+                data = await reader.read(min(left, 65536))
+                if not data:
+                    raise asyncio.IncompleteReadError(b"", left)
+                left -= len(data)
+                yield data
+        else:
+            raise RequestError(411, "Content-Length or chunked body required")
+
+
+    async def dispatch(self, method, target, httpver, headers, reader, writer, keepalive):
+        """ Answer a request
+
+        :return: True if the connection is kept alive.
+        """
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        path = url.path.rstrip('/')
+        if path == "/databases" or path == "/stats":
+            if method != "GET":
+                raise RequestError(405, "Use GET for {}".format(path))
+            if path == "/databases":
+                obj = {"program": appName, "version": version, "databases": self.metadata()}
+            else:
+                obj = {"requests": self.nrequest,
+                       "reloads": self.watcher.reloads if self.watcher is not None else 0,
+                       "coalesced": dict((name, {"compositions": c.requests, "computations": c.batches})
+                                         for name, c in self.coalescers.items())}
+            await self.respond(writer, 200, obj, keepalive)
+        elif path == "/estimate":
+            if method != "POST":
+                raise RequestError(405, "Use POST for /estimate")
+            name, est = self.getEstimator(query)
+            body = await self.readBody(reader, headers)
+            try:
+                coefs = coefVector(est, json.loads(body.decode("utf-8")))
+            except ValueError as err:
+                await self.respond(writer, 400, {"error": str(err)}, keepalive)
+                return keepalive
+            coalescer = self.coalescers.setdefault(name, Coalescer())
+            result = await coalescer.estimate(est, coefs)
+            await self.respond(writer, 200, result, keepalive)
+        elif path == "/batch":
+            if method != "POST":
+                raise RequestError(405, "Use POST for /batch")
+            name, est = self.getEstimator(query)
+            if "ndjson" in headers.get("content-type", ""):
+                return await self.streamBatch(est, httpver, headers, reader, writer, keepalive)
+            body = await self.readBody(reader, headers)
+            try:
+                comps = json.loads(body.decode("utf-8"))
+                if not isinstance(comps, list):
+                    raise ValueError("The body must be a JSON array of compositions")
+            except ValueError as err:
+                await self.respond(writer, 400, {"error": str(err)}, keepalive)
+                return keepalive
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(None, computeCompositions, est, comps)
+            await self.respond(writer, 200, results, keepalive)
+        else:
+            raise RequestError(404, "Unknown path {}".format(url.path))
+        return keepalive
+
+
+    async def streamBatch(self, est, httpver, headers, reader, writer, keepalive):
+        """ Compute a NDJSON body by chunks, writing the results as they are computed
+
+            The body is only read as fast as the results are sent, so that a
+            large upload is slowed down by a slow client. An error once the
+            headers are sent ends the results with an error record.
+        """
+        chunked = httpver == "HTTP/1.1"
+        head = "HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+        if chunked:
+            head += "Transfer-Encoding: chunked\r\nConnection: {}\r\n\r\n".format(
+                    "keep-alive" if keepalive else "close")
+        else:
+            head += "Connection: close\r\n\r\n"
+            keepalive = False
+        writer.write(head.encode())
+        loop = asyncio.get_running_loop()
+
+        async def send(lines):
+            comps = []
+            errors = []
+            for lin in lines:
+                try:
+                    comps.append(json.loads(lin))
+                    errors.append("")
+                except ValueError as err:
+                    comps.append({})
+                    errors.append("Bad JSON: {}".format(err))
+            results = await loop.run_in_executor(None, computeCompositions, est, comps)
+            out = []
+            for result, err in zip(results, errors):
+                if err:
+                    result = dict((key, None) for key in Properties)
+                    result["error"] = err
+                out.append(json.dumps(result).encode() + b"\n")
+            # drain() waits while the client does not read the results
+            await self.writeChunk(writer, b"".join(out), chunked)
+
+        try:
+            pending = b""
+            lines = []
+            async for data in self.bodyChunks(reader, headers):
+                pending += data
+                parts = pending.split(b"\n")
+                pending = parts.pop()
+                lines.extend(lin for lin in parts if lin.strip())
+                while len(lines) >= StreamChunk:
+                    await send(lines[:StreamChunk])
+                    lines = lines[StreamChunk:]
+            if pending.strip():
+                lines.append(pending)
+            if len(lines):
+                await send(lines)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            raise
+        except Exception as err:
+            # The headers are sent: the results end with an error record,
+            # and the connection is closed as the body may not be read
+            result = dict((key, None) for key in Properties)
+            result["error"] = str(err)
+            await self.writeChunk(writer, json.dumps(result).encode() + b"\n", chunked)
+            keepalive = False
+        if chunked:
+            writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        return keepalive
+
+
+    async def writeChunk(self, writer, data, chunked):
+        if chunked:
+            writer.write("{:x}\r\n".format(len(data)).encode() + data + b"\r\n")
+        else:
+            writer.write(data)
+        await writer.drain()
+
+
+def serve(host="127.0.0.1", port=8765, interval=1.0):
+    """ Load the databases and run the server until interrupted
+
+    :param interval: the period (s) of the checks of the database files,
+                     0 for never reloading them.
+    :return: the exit status.
+    """
+    registry = ThermAP.getRegistry()
+    watcher = ThermAP.Watcher(interval).start() if interval > 0 else None
+    server = Server(watcher)
+
+    async def main():
+        srv = await asyncio.start_server(server.handle, host, port)
+        sys.stderr.write("{0}: serving {1} on http://{2}:{3}\n".format(
+                         appName, ", ".join(registry.names()), host, port))
+        async with srv:
+            await srv.serve_forever()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    return 0
@@ -0,0 +1,44 @@
+""" Benchmark of the cold import of ThermAP
+
+    Each measure is done in a new Python process, so that nothing is
+    already imported. PyQt5 must not be imported by ThermAP.
+
+    Usage: python benchmarks/bench_import.py [number of runs]
+"""
+import sys, os
+import subprocess
+
+Limit = 0.050         # Maximum time for the import (s)
+
+progpath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+code = """
+import sys, time
+t = time.perf_counter()
+import ThermAP
+t = time.perf_counter() - t
+print(t, 'PyQt5' in sys.modules)
+"""
+
+
+def importTime():
+    """ Return the import time of ThermAP in a new process and if PyQt5 was imported """
+    out = subprocess.check_output([sys.executable, "-c", code], cwd=progpath)
+    t, qt = out.decode().split()
+    return float(t), qt == "True"
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    importTime()          # compile the .pyc files
+    times = []
+    for i in range(n):
+        t, qt = importTime()
+        if qt:
+            sys.exit("PyQt5 is imported by ThermAP")
+        times.append(t)
+    times.sort()
+    print("import ThermAP: min {0:.1f} ms, median {1:.1f} ms, max {2:.1f} ms".format(
+        times[0] * 1000, times[n // 2] * 1000, times[-1] * 1000))
+    if times[n // 2] > Limit:
+        sys.exit("The median import time is longer than {:.0f} ms".format(Limit * 1000))
@@ -0,0 +1,293 @@
+""" Benchmarks of ThermAP and regression test of its results
+
+    The database functions are timed on synthetic databases of several
+    sizes, written in a temporary directory; the computations are timed on
+    synthetic batches of compositions of the Apatite database. The results
+    of known compounds are checked first, the benchmark failing if one of
+    them has changed.
+
+    Usage: python benchmarks/bench_thermap.py [-o results.json] [--compare old.json]
+                                              [--threshold 1.25] [--quick]
+"""
+import sys, os
+import json
+import time
+import shutil
+import platform
+import tempfile
+
+progpath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, progpath)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import ThermAP
+from bench_import import importTime
+
+# Known compounds (Apatite database): composition and expected properties
+Oracle = [
+    ("fluorapatite", {"Ca2+": 10, "PO4": 6, "F-": 2},
+     {"DGf": -12835.9, "DHf": -13601.748, "DSf": -2569.96, "So": 770.3, "pKsp": 109.484}),
+    ("hydroxyapatite", {"Ca2+": 10, "PO4": 6, "OH-": 2},
+     {"DGf": -12578.5, "DHf": -13376.455, "DSf": -2677.70, "So": 795.6, "pKsp": 107.907}),
+    ("Ca/Sr fluorapatite", {"Ca2+": 5, "Sr2+": 5, "PO4": 6, "F-": 2},
+     {"DGf": -12840.4, "DHf": -13603.119, "DSf": -2559.46, "So": 841.3, "pKsp": 101.335}),
+    ("Ca9.9Sr0.1 fluorapatite", {"Ca2+": 9.9, "Sr2+": 0.1, "PO4": 6, "F-": 2},
+     {"DGf": -12835.99, "DHf": -13601.776, "DSf": -2569.75, "So": 771.72, "pKsp": 109.321}),
+    ("Ca-deficient apatite", {"Ca2+": 9, "PO4": 6, "H+": 1, "OH-": 1},
+     None),
+    ("not electroneutral", {"Ca2+": 10, "PO4": 6, "F-": 1},
+     None),
+]
+Tolerance = 0.01      # Maximum difference with the expected values
+
+Sizes = (100, 1000, 10000)               # Number of species of the synthetic databases
+BatchSizes = (1, 100, 10000, 1000000)    # Number of compositions of the batches
+
+
+def oracle():
+    """ Check the results of the known compounds
+
+    :return: the list of the errors.
+    """
+    estimator = ThermAP.loadEstimator("Apatite")
+    errors = []
+    for name, comp, expected in Oracle:
+        coefs = np.zeros(len(estimator.names))
+        for nam, coef in comp.items():
+            coefs[estimator.index(nam)] = coef
+        # The same results with coefficients in single precision (.npy files)
+        for dtype in (np.float64, np.float32):
+            res = estimator.compute(coefs.astype(dtype))
+            sname = name if dtype is np.float64 else name + " (float32)"
+            if expected is None:
+                # HPO4: no pKsp; not electroneutral: no result
+                if res["valid"][0] and not np.isnan(res["pKsp"][0]):
+                    errors.append("{}: pKsp should not be computed".format(sname))
+                continue
+            for key, v in expected.items():
+                if not abs(res[key][0] - v) <= Tolerance:
+                    errors.append("{0}: {1} = {2}, expected {3}".format(sname, key, res[key][0], v))
+    return errors
+
+
+def elemNames(n):
+    """ Return 'n' element names, 'A', 'B', ... then 'Aa', 'Ab', ... """
+    upper = [chr(c) for c in range(ord('A'), ord('Z') + 1)]
+    lower = [chr(c) for c in range(ord('a'), ord('z') + 1)]
+    names = upper + [u + l for u in upper for l in lower]
+    return names[:n]
+
+
+def writeDataBase(path, nspec, ndb=1, seed=0):
+    """ Write a synthetic database in the directory 'path'
+
+        The species are random formulas of 1 to 3 elements of ElemDB.txt.
+
+    :param path: the directory.
+    :param nspec: the number of species of each database.
+    :param ndb: the number of databases SpeciesDBn.txt.
+    :param seed: the seed of the random generator.
+    """
+    rng = np.random.default_rng(seed)
+    elems = elemNames(200)
+    with open(os.path.join(path, "ElemDB.txt"), 'w') as f:
+        f.write("# Synthetic elements\n#\n")
+        for nam in elems:
+            f.write("{0}\tS\t{1:.2f}\n".format(nam, rng.uniform(5, 200)))
+    charges = ("2+", "+", "-", "3+")
+    values = {"2+": 2, "+": 1, "-": -1, "3+": 3}
+    for k in range(ndb):
+        with open(os.path.join(path, "SpeciesDB{}.txt".format(k + 1)), 'w') as f:
+            f.write("# Synthetic{0}\n# Synthetic database of {1} species\n#\n".format(k + 1, nspec))
+            f.write("# List of species\n#\n")
+            names = set()
+            while len(names) < nspec:
+                nel = rng.integers(1, 4)
+                formula = "".join(elems[j] + ("" if c == 1 else str(c)) for j, c in
+                                  zip(rng.choice(len(elems), nel, replace=False),
+                                      rng.integers(1, 7, nel)))
+                ch = charges[rng.integers(len(charges))]
+                nam = formula + ch
+                if nam in names:
+                    continue
+                names.add(nam)
+                f.write("{0}\t{1}\t{2:+d}\t{3:.2f}\t{4:+.2f}\t{5:.2f}\n".format(
+                        rng.integers(1, 4), nam, values[ch], rng.uniform(-1500, 0),
+                        rng.uniform(-50, 150), rng.uniform(-1500, 0)))
+
+
+def compositions(estimator, n, seed=0):
+    """ Return a (n x M) batch of electroneutral compositions of the Apatite database
+
+        Substituted apatites M10(PO4)6X2 with random cations M2+ and anions X-.
+    """
+    rng = np.random.default_rng(seed)
+    names = estimator.names
+    cations = [names.index(nam) for nam in names if nam.endswith("2+")]
+    anions = [names.index(nam) for nam in ("OH-", "F-", "Cl-", "Br-") if nam in names]
+    C = np.zeros((n, len(names)))
+    rows = np.arange(n)
+    frac = rng.integers(0, 11, n)
+    C[rows, rng.choice(cations, n)] += frac
+    C[rows, rng.choice(cations, n)] += 10 - frac
+    C[:, names.index("PO4")] = 6
+    frac = rng.integers(0, 3, n)
+    C[rows, rng.choice(anions, n)] += frac
+    C[rows, rng.choice(anions, n)] += 2 - frac
+    return C
+
+
+def timeit(func, repeat=5, number=1):
+    """ Time a function
+
+    :return: a dict {"min": s, "median": s, "number": number} of the time of one call.
+    """
+    times = []
+    for i in range(repeat):
+        t = time.perf_counter()
+        for j in range(number):
+            func()
+        times.append((time.perf_counter() - t) / number)
+    times.sort()
+    return {"min": times[0], "median": times[len(times) // 2], "number": number}
+
+
+def benchDataBase(sizes, repeat):
+    """ Time the loading of synthetic databases of several sizes """
+    results = {}
+    oldpath = ThermAP.progpath
+    tmpdir = tempfile.mkdtemp(prefix="thermap")
+    try:
+        ThermAP.progpath = tmpdir
+        for n in sizes:
+            writeDataBase(tmpdir, n, ndb=2)
+            elemfile = os.path.join(tmpdir, "ElemDB.txt")
+            specfile = os.path.join(tmpdir, "SpeciesDB1.txt")
+            results["loadElems"] = timeit(lambda: ThermAP.loadElems(elemfile), repeat)
+            results["loadSpecies/{}".format(n)] = timeit(lambda: ThermAP.loadSpecies(specfile), repeat)
+            results["addElem2Specie/{}".format(n)] = timeit(ThermAP.addElem2Specie, repeat)
+
+            def lookForDB(keep):
+                # lookForDB appends to DBnames when the cache is not used
+                ThermAP.DBnames[:] = []
+                ThermAP.DBtitles[:] = []
+                if keep == 0:
+                    cachefile = os.path.join(tmpdir, ThermAP.CacheName)
+                    if os.path.exists(cachefile):
+                        os.remove(cachefile)
+                if keep < 2:
+                    ThermAP.DBcache = None
+                ThermAP.lookForDB()
+            # Parse the text files and write the cache, read the cache file, use the loaded cache
+            results["lookForDB/{}/build".format(n)] = timeit(lambda: lookForDB(0), repeat)
+            results["lookForDB/{}/file".format(n)] = timeit(lambda: lookForDB(1), repeat)
+            results["lookForDB/{}/memory".format(n)] = timeit(lambda: lookForDB(2), repeat)
+            results["openDataBase/{}".format(n)] = timeit(lambda: ThermAP.openDataBase(0), repeat)
+            os.remove(os.path.join(tmpdir, ThermAP.CacheName))
+    finally:
+        ThermAP.progpath = oldpath
+        ThermAP.DBcache = None
+        ThermAP.DBnames[:] = []
+        ThermAP.DBtitles[:] = []
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return results
+
+
+def benchCompute(sizes, repeat):
+    """ Time the estimation of single compositions and batches """
+    results = {}
+    estimator = ThermAP.loadEstimator("Apatite")
+    C = compositions(estimator, max(sizes))
+    for n in sizes:
+        rows = C[:n]
+        number = max(1, 10000 // n)
+        r = timeit(lambda: estimator.compute(rows), repeat, number)
+        r["rows_per_s"] = n / r["median"]
+        results["compute/{}".format(n)] = r
+    # Single composition as typed in the GUI
+    sums = ThermAP.RunningSums(estimator)
+    coefs = C[0]
+
+    def typing():
+        for i in np.nonzero(coefs)[0]:
+            sums.setCoef(i, coefs[i])
+        sums.values()
+        sums.reset()
+    results["RunningSums/1"] = timeit(typing, repeat, 1000)
+    # Text batch, as the 'batch' command
+    import io
+    n = min(max(sizes), 100000)
+    header = "\t".join(estimator.names) + "\n"
+    text = header + "".join("\t".join("{:g}".format(v) for v in row) + "\n" for row in C[:n])
+
+    def batch():
+        ThermAP.batchCompute(io.StringIO(text), io.StringIO(), estimator)
+    r = timeit(batch, max(1, repeat // 2))
+    r["rows_per_s"] = n / r["median"]
+    results["batchCompute/{}".format(n)] = r
+    return results
+
+
+def compare(results, old, threshold):
+    """ Compare the median times with those of a previous run
+
+    :return: the list of the benchmarks slower than 'threshold' times.
+    """
+    slower = []
+    for key, r in results["benchmarks"].items():
+        if key in old["benchmarks"]:
+            ratio = r["median"] / old["benchmarks"][key]["median"]
+            if ratio > threshold:
+                slower.append("{0}: {1:.2f} times slower".format(key, ratio))
+    return slower
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="ThermAP benchmarks")
+    parser.add_argument("-o", "--output", help="JSON file of the results")
+    parser.add_argument("--compare", help="JSON file of previous results")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="ratio of the times above which a benchmark is a regression")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes, fewer runs")
+    args = parser.parse_args(argv)
+
+    errors = oracle()
+    for err in errors:
+        print("REGRESSION", err)
+    if errors:
+        return 1
+    print("oracle: {} compounds OK".format(len(Oracle)))
+
+    repeat = 3 if args.quick else 7
+    results = {"version": ThermAP.version, "python": platform.python_version(),
+               "numpy": np.__version__, "machine": platform.machine(),
+               "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "benchmarks": {}}
+    bench = results["benchmarks"]
+    bench.update(benchDataBase(Sizes[:2] if args.quick else Sizes, repeat))
+    bench.update(benchCompute(BatchSizes[:3] if args.quick else BatchSizes, repeat))
+    importTime()          # compile the .pyc files
+    times = sorted(importTime()[0] for i in range(repeat))
+    bench["import"] = {"min": times[0], "median": times[len(times) // 2], "number": 1}
+
+    for key, r in bench.items():
+        line = "{0:32s} {1:12.6f} ms".format(key, r["median"] * 1000)
+        if "rows_per_s" in r:
+            line += "  {:14,.0f} rows/s".format(r["rows_per_s"])
+        print(line)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare(results, json.load(f), args.threshold)
+        for msg in slower:
+            print("SLOWER", msg)
+        if slower:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,89 @@
+""" Tests of the inverse design of compositions
+
+    The pure Python simplex, used when scipy is not installed, is checked
+    against scipy.optimize.linprog and against an exhaustive screening.
+
+    Usage: python -m pytest benchmarks
+"""
+import sys, os
+
+progpath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, progpath)
+
+import numpy as np
+import pytest
+import ThermAP
+
+# Ca/Sr fluor-hydroxyapatites with 100 <= pKsp <= 105
+Bounds = {"Ca2+": (0.0, 10.0), "Sr2+": (0.0, 10.0), "PO4": (6.0, 6.0),
+          "F-": (0.0, 2.0), "OH-": (0.0, 2.0)}
+Totals = {1: (10.0, 10.0), 3: (2.0, 2.0)}
+Targets = {"pKsp": (100.0, 105.0)}
+Objectives = [("DGf", False), ("DGf", True), ("So", False), ("DHf", True)]
+
+
+@pytest.fixture(scope="module")
+def estimator():
+    return ThermAP.loadEstimator("Apatite")
+
+
+def optimum(estimator, prop, largest):
+    """ Return the optimal composition and value of 'prop' of the design problem """
+    problem = ThermAP.DesignProblem(estimator, Bounds, Totals, Targets)
+    x = problem.solve(prop, largest)
+    assert x is not None
+    res = estimator.compute(x)
+    assert res["valid"][0]
+    return x, res[prop][0]
+
+
+@pytest.fixture
+def noscipy(monkeypatch):
+    """ Make solveLP use the simplex fallback, as without scipy """
+    monkeypatch.setitem(sys.modules, "scipy.optimize", None)
+
+
+@pytest.mark.parametrize("prop,largest", Objectives)
+def testSimplexMatchesLinprog(estimator, monkeypatch, prop, largest):
+    pytest.importorskip("scipy.optimize")
+    x, expected = optimum(estimator, prop, largest)
+    monkeypatch.setitem(sys.modules, "scipy.optimize", None)
+    x, value = optimum(estimator, prop, largest)
+    assert value == pytest.approx(expected, abs=1e-6)
+
+
+@pytest.mark.parametrize("prop,largest", Objectives)
+def testSimplexMatchesScreening(estimator, noscipy, prop, largest):
+    x, value = optimum(estimator, prop, largest)
+    pKsp = estimator.compute(x)["pKsp"][0]
+    assert 100.0 - 1e-6 <= pKsp <= 105.0 + 1e-6
+    # The optimum of the LP can't be beaten by the compositions of a grid
+    grids = {"Ca2+": ThermAP.gridValues(0, 10, 0.05), "Sr2+": ThermAP.gridValues(0, 10, 0.05),
+             "PO4": [6.0], "F-": ThermAP.gridValues(0, 2, 0.05), "OH-": ThermAP.gridValues(0, 2, 0.05)}
+    C = np.vstack(list(ThermAP.screenBlocks(estimator, grids, {1: 10.0, 3: 2.0})))
+    res = estimator.compute(C)
+    ok = res["valid"] & (res["pKsp"] >= 100.0) & (res["pKsp"] <= 105.0)
+    vals = res[prop][ok]
+    best = vals.max() if largest else vals.min()
+    if largest:
+        assert value >= best - 1e-6
+    else:
+        assert value <= best + 1e-6
+    # and the grid is fine enough to come close to it
+    assert value == pytest.approx(best, abs=1.0)
+
+
+def testSimplexInfeasible(estimator, noscipy):
+    problem = ThermAP.DesignProblem(estimator, Bounds, Totals, {"pKsp": (200.0, 210.0)})
+    assert problem.solve("DGf") is None
+
+
+def testSimplexPareto(estimator, noscipy):
+    problem = ThermAP.DesignProblem(estimator, Bounds, Totals, Targets)
+    front = problem.pareto("DGf", False, "So", True, 5)
+    assert len(front)
+    res = estimator.compute(np.array(front))
+    assert res["valid"].all()
+    # Along the front, a larger So costs a larger DGf
+    order = np.argsort(res["So"])
+    assert np.all(np.diff(res["DGf"][order]) >= -1e-6)
@@ -0,0 +1,235 @@
+""" Tests of the estimation service
+
+    The server runs in the process, on a free port of localhost, and is
+    queried with raw HTTP/1.1 requests.
+
+    Usage: python -m pytest benchmarks
+"""
+import sys, os
+import json
+import shutil
+import asyncio
+
+progpath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, progpath)
+
+import pytest
+import ThermAP
+import ThermAPserver
+
+Fluorapatite = {"Ca2+": 10, "PO4": 6, "F-": 2}
+
+
+def run(func, *args):
+    """ Run the coroutine func(server, port, *args) with a server listening on 'port' """
+    async def main():
+        server = ThermAPserver.Server()
+        srv = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+        port = srv.sockets[0].getsockname()[1]
+        async with srv:
+            return await func(server, port, *args)
+    return asyncio.run(main())
+
+
+async def request(port, method, target, body=None, chunks=None, ctype="application/json"):
+    """ Send a request, the body being 'body' or sent by 'chunks'
+
+    :return: a tuple (status, dict of headers, body, raw response).
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    head = "{0} {1} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n".format(method, target)
+    head += "Content-Type: {}\r\n".format(ctype)
+    if chunks is not None:
+        data = b"".join("{:x}\r\n".format(len(c)).encode() + c + b"\r\n" for c in chunks) + b"0\r\n\r\n"
+        head += "Transfer-Encoding: chunked\r\n"
+    else:
+        data = body or b""
+        head += "Content-Length: {}\r\n".format(len(data))
+    writer.write(head.encode() + b"\r\n" + data)
+    raw = await reader.read()
+    writer.close()
+    resp, sep, payload = raw.partition(b"\r\n\r\n")
+    lines = resp.decode("latin-1").split("\r\n")
+    status = int(lines[0].split()[1])
+    headers = dict((key.strip().lower(), value.strip()) for key, sep, value in
+                   (lin.partition(':') for lin in lines[1:]))
+    if headers.get("transfer-encoding") == "chunked":
+        body = b""
+        while True:
+            size, sep, payload = payload.partition(b"\r\n")
+            n = int(size, 16)
+            if n == 0:
+                break
+            body += payload[:n]
+            payload = payload[n + 2:]
+    else:
+        body = payload
+    return status, headers, body, raw
+
+
+@pytest.fixture
+def apatite():
+    return ThermAP.getRegistry().get("Apatite").estimator
+
+
+def testEstimate(apatite):
+    async def test(server, port):
+        status, headers, body, raw = await request(port, "POST", "/estimate?db=Apatite",
+                                                   json.dumps(Fluorapatite).encode())
+        assert status == 200
+        res = json.loads(body)
+        assert res["error"] is None
+        assert res["DGf"] == pytest.approx(-12835.9, abs=0.01)
+        assert res["pKsp"] == pytest.approx(109.484, abs=0.01)
+        status, headers, body, raw = await request(port, "POST", "/estimate?db=Apatite",
+                                                   json.dumps({"Ca2+": 10, "PO4": 6}).encode())
+        assert status == 200
+        assert json.loads(body)["error"] == "Check the electroneutrality !"
+        status, headers, body, raw = await request(port, "POST", "/estimate?db=Nothing", b"{}")
+        assert status == 404
+    run(test)
+
+
+def testEstimateConcurrent(apatite):
+    async def test(server, port):
+        comps = [{"Ca2+": 10 - x, "Sr2+": x, "PO4": 6, "F-": 2} for x in range(11)]
+        replies = await asyncio.gather(*[request(port, "POST", "/estimate?db=Apatite",
+                                                 json.dumps(comp).encode()) for comp in comps])
+        for comp, (status, headers, body, raw) in zip(comps, replies):
+            assert status == 200
+            res = json.loads(body)
+            assert res["DGf"] == pytest.approx(apatite.evaluate(comp)["DGf"])
+        coalesced = server.coalescers["Apatite"]
+        assert coalesced.requests == len(comps)
+        assert coalesced.batches <= len(comps)
+    run(test)
+
+
+def testBatch(apatite):
+    async def test(server, port):
+        comps = [Fluorapatite, {"Ca2+": 10, "PO4": 6}, {"Xx": 1}]
+        status, headers, body, raw = await request(port, "POST", "/batch?db=Apatite",
+                                                   json.dumps(comps).encode())
+        assert status == 200
+        res = json.loads(body)
+        assert len(res) == 3
+        assert res[0]["DGf"] == pytest.approx(-12835.9, abs=0.01)
+        assert res[1]["DGf"] is None and res[1]["error"] == "Check the electroneutrality !"
+        assert res[2]["error"] == "Unknown species Xx"
+    run(test)
+
+
+def testBatchStream(apatite, monkeypatch):
+    # Several computations, and lines split between the chunks of the body
+    monkeypatch.setattr(ThermAPserver, "StreamChunk", 3)
+    comps = [{"Ca2+": 10 - x, "Sr2+": x, "PO4": 6, "F-": 2} for x in range(10)]
+    lines = [json.dumps(comp).encode() for comp in comps]
+    lines.insert(4, b"{bad json")
+    data = b"\n".join(lines) + b"\n"
+    chunks = [data[k:k + 50] for k in range(0, len(data), 50)]
+
+    async def test(server, port):
+        status, headers, body, raw = await request(port, "POST", "/batch?db=Apatite", chunks=chunks,
+                                                   ctype="application/x-ndjson")
+        assert status == 200
+        assert headers["content-type"] == "application/x-ndjson"
+        res = [json.loads(lin) for lin in body.splitlines()]
+        assert len(res) == len(lines)
+        assert res[4]["error"].startswith("Bad JSON")
+        del res[4]
+        for comp, item in zip(comps, res):
+            assert item["error"] is None
+            assert item["DGf"] == pytest.approx(apatite.evaluate(comp)["DGf"])
+    run(test)
+
+
+def testBatchStreamError(apatite, monkeypatch):
+    # An error once the headers are sent ends the results, in the same response
+    monkeypatch.setattr(ThermAPserver, "StreamChunk", 2)
+    compute = ThermAPserver.computeCompositions
+    calls = []
+
+    def failing(estimator, comps):
+        calls.append(len(comps))
+        if len(calls) > 1:
+            raise RuntimeError("computation failed")
+        return compute(estimator, comps)
+    monkeypatch.setattr(ThermAPserver, "computeCompositions", failing)
+    data = b"".join(json.dumps(Fluorapatite).encode() + b"\n" for i in range(6))
+
+    async def test(server, port):
+        status, headers, body, raw = await request(port, "POST", "/batch?db=Apatite", data,
+                                                   ctype="application/x-ndjson")
+        assert status == 200
+        assert raw.count(b"HTTP/1.1") == 1
+        res = [json.loads(lin) for lin in body.splitlines()]
+        assert len(res) == 3
+        assert res[0]["error"] is None and res[1]["error"] is None
+        assert res[2]["error"] == "computation failed"
+    run(test)
+
+
+@pytest.fixture
+def datadir(tmp_path, monkeypatch):
+    """ A copy of the database files, without their cache, used by ThermAP """
+    for filnam in os.listdir(progpath):
+        if filnam == "ElemDB.txt" or filnam.startswith("SpeciesDB"):
+            shutil.copy(os.path.join(progpath, filnam), str(tmp_path))
+    monkeypatch.setattr(ThermAP, "progpath", str(tmp_path))
+    monkeypatch.setattr(ThermAP, "registry", None)
+    ThermAP.getRegistry()
+    return tmp_path
+
+
+def editCalcium(datadir, g):
+    """ Change g(i) of Ca2+ in the Apatite database """
+    path = datadir / "SpeciesDB1.txt"
+    lines = path.read_text().splitlines(True)
+    for i, lin in enumerate(lines):
+        items = lin.split('\t')
+        if len(items) > 3 and items[1].strip() == "Ca2+":
+            items[3] = g
+            lines[i] = '\t'.join(items)
+    # A distinct modification time, even on a coarse clock
+    st = os.stat(str(path))
+    path.write_text("".join(lines))
+    os.utime(str(path), ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+def testReload(datadir):
+    watcher = ThermAP.Watcher(interval=1.0, settle=0.01)
+    old = ThermAP.registry
+    estimator = old.get("Apatite").estimator
+    DGf = estimator.evaluate(Fluorapatite)["DGf"]
+
+    async def estimate(server, port):
+        status, headers, body, raw = await request(port, "POST", "/estimate?db=Apatite",
+                                                   json.dumps(Fluorapatite).encode())
+        assert status == 200
+        return json.loads(body)["DGf"]
+
+    assert run(estimate) == pytest.approx(DGf)
+    assert not watcher.check()
+    # g(Ca2+) 1 kJ/mol lower: DGf 10 kJ/mol lower
+    editCalcium(datadir, "-741.00")
+    assert watcher.check()
+    assert watcher.reloads == 1
+    assert ThermAP.registry is not old
+    assert run(estimate) == pytest.approx(DGf - 10.0)
+    # The Estimator got before the reload keeps its values
+    assert estimator.evaluate(Fluorapatite)["DGf"] == pytest.approx(DGf)
+
+
+def testReloadRejected(datadir, capsys):
+    watcher = ThermAP.Watcher(interval=1.0, settle=0.01)
+    old = ThermAP.registry
+    editCalcium(datadir, "abc")
+    assert not watcher.check()
+    assert ThermAP.registry is old
+    assert "not reloaded" in capsys.readouterr().err
+    # The same files are not read again
+    assert not watcher.check()
+    editCalcium(datadir, "-741.00")
+    assert watcher.check()
+    assert ThermAP.registry.get("Apatite").estimator.evaluate(Fluorapatite)["DGf"] == \
+        pytest.approx(old.get("Apatite").estimator.evaluate(Fluorapatite)["DGf"] - 10.0)